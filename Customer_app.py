@@ -3,37 +3,35 @@ from kivy.uix.screenmanager import ScreenManager, Screen
 from kivymd.app import MDApp
 from kivymd.uix.button import MDRaisedButton, MDIconButton
 from kivymd.uix.label import MDLabel
+from kivymd.uix.dialog import MDDialog
 from kivy.uix.boxlayout import BoxLayout
 from kivy.clock import Clock
-import cv2
-from pyzbar.pyzbar import decode
-import os
 from kivy.uix.image import Image
-
-# Wallet class for customer balances
-class Wallet:
-    def __init__(self, initial_balance=100.0):
-        """Initializes the wallet with a starting balance."""
-        self.balance = initial_balance
-
-    def get_balance(self):
-        """Returns the current balance."""
-        return self.balance
+import metrics
+from decode_worker import DecodeWorker
+from scanner_loader import load_scanner_async
+from scan_debounce import ScanDebouncer
+from scan_tracker import ScanTracker, basket_items, batch_scan_from_env
+from checkout import CheckoutError, CheckoutService
+from checkout_client import connect_from_env
+from journal import new_id
+from loyalty import POINT_VALUE_CENTS
+from receipts import generate_receipt_async
+from sync import start_from_env
 
 # Screen class for the main UI with wallet balance and buttons
 class MainScreen(Screen):
-    def __init__(self, app, wallet, **kwargs):
+    def __init__(self, app, **kwargs):
         """Initializes the main screen with wallet, advertisement box, and buttons."""
         super().__init__(**kwargs)
         self.app = app
-        self.wallet = wallet
 
         # Main layout
         main_layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
 
         # Wallet balance label
         self.balance_label = MDLabel(
-            text=f"Wallet Balance: ${self.wallet.get_balance():.2f}",
+            text=f"Wallet Balance: ${self.app.balance_cents() / 100:.2f}",
             halign="center",
             theme_text_color="Secondary",
             font_style="H6"
@@ -54,12 +52,14 @@ class MainScreen(Screen):
         self.coupons_button = MDRaisedButton(
             text="Coupons",
             size_hint=(1, None),
-            height='50dp'
+            height='50dp',
+            on_release=lambda x: self.app.show_coupons()
         )
         self.points_button = MDRaisedButton(
             text="Points",
             size_hint=(1, None),
-            height='50dp'
+            height='50dp',
+            on_release=lambda x: self.app.show_points()
         )
         buttons_layout.add_widget(self.coupons_button)
         buttons_layout.add_widget(self.points_button)
@@ -85,53 +85,97 @@ class MainScreen(Screen):
 
 # Class for displaying the camera feed and scanning barcodes
 class CameraPreview(Image):
-    def __init__(self, capture, parent_screen, fps=30, **kwargs):
-        """Initializes the camera preview widget."""
+    def __init__(self, capture, parent_screen, decode_fn, fps=30, stats_interval=10,
+                 debounce_window=2.0, debounce_size=128, gate_settings=None, batch=False, **kwargs):
+        """Initializes the camera preview widget.
+
+        With batch, every code in a frame is taken, and codes are tracked
+        across frames so each item in view is counted once.
+        """
         super().__init__(**kwargs)
+        # Imported here so numpy is only loaded once the scanner is in use
+        from frame_gate import FrameGate
+        from preview import TextureUploader
         self.capture = capture
         self.parent_screen = parent_screen
         self.fps = fps
         self.size_hint = (None, None)  # Allow setting a custom size
         self.size = (400, 200)  # Set width and height for barcode scanning
+        # Rotate and flip the camera image with texture coordinates instead of copying pixels
+        self.uploader = TextureUploader(rotate_180=True, flip_vertical=True)
+        # Repeat scans of a code that stays in view are dropped before they reach payment
+        self.debouncer = ScanDebouncer(window=debounce_window, max_entries=debounce_size)
+        # In batch mode each code in view is followed by its bounding box instead, so copies of a product all count
+        self.tracker = ScanTracker() if batch else None
+        # Unchanged and blurry frames are skipped before decoding, and an idle scene is decoded less and less often
+        self.gate = FrameGate(**(gate_settings or {}))
+        # Decoding runs on a background worker so slow frames never stall the preview
+        self.decode_worker = DecodeWorker(decode_fn=decode_fn, on_result=self.on_decoded, gate=self.gate)
+        self.decode_worker.start()
         Clock.schedule_interval(self.update, 1.0 / self.fps)
+        Clock.schedule_interval(self.report_stats, stats_interval)
 
     def update(self, dt):
         """Updates the camera feed and scans for barcodes."""
         if not self.capture.isOpened():
-            print("Error: Camera is not opened.")
+            # Already reported when the camera failed to open; this runs on every tick
+            metrics.inc("preview.camera_closed")
             return
         
+        # The capture thread keeps only the newest frame, so this never waits on the camera
         ret, frame = self.capture.read()
         if not ret:
-            print("Error: Failed to read from the camera.")
             return
         
         try:
-            # Flip the frame to invert the camera feed
-            frame = cv2.rotate(frame, cv2.ROTATE_180)  # Rotate the frame for proper orientation
-            frame = cv2.flip(frame, 0)
-
-            buf = frame.tobytes()
-
-            if not self.texture or self.texture.size != (frame.shape[1], frame.shape[0]):
-                from kivy.graphics.texture import Texture
-                self.texture = Texture.create(size=(frame.shape[1], frame.shape[0]), colorfmt='bgr')
-                self.texture.flip_vertical()
-            self.texture.blit_buffer(buf, colorfmt='bgr', bufferfmt='ubyte')
+            # Blit straight from the camera buffer; rotation and flip are done by the texture
+            with metrics.span("preview.blit"):
+                self.texture = self.uploader.upload(frame)
             self.canvas.ask_update()
 
-            # Scan for barcodes
-            decoded_objects = decode(frame)
-            for obj in decoded_objects:
-                print(f"Barcode detected: {obj.data.decode('utf-8')}")
-                # Pass barcode data to the parent screen for processing
-                self.parent_screen.process_barcode_data(obj.data.decode('utf-8'))
-                break
+            # Hand the frame to the decode worker; barcodes come back through on_decoded
+            self.decode_worker.submit(frame)
         except Exception as e:
             print(f"An error occurred during frame update: {e}")
 
+    def on_decoded(self, decoded_objects):
+        """Processes barcodes found by the decode worker on the UI thread."""
+        if self.tracker is not None:
+            new = self.tracker.update(decoded_objects)
+            metrics.inc("scan.suppressed", len(decoded_objects) - len(new))
+            if new:
+                metrics.inc("scan.accepted", len(new))
+                # Everything that came into view in this frame goes to the basket together
+                self.parent_screen.process_barcode_batch([obj.data.decode('utf-8') for obj in new])
+            return
+        for obj in decoded_objects:
+            if not self.debouncer.accept(obj.data, obj.rect):
+                metrics.inc("scan.suppressed")
+                break
+            metrics.inc("scan.accepted")
+            # Pass barcode data to the parent screen for processing
+            self.parent_screen.process_barcode_data(obj.data.decode('utf-8'))
+            break
+
+    def report_stats(self, dt):
+        """Reports how many frames were captured, decoded and dropped, and how many scans were suppressed."""
+        if metrics.enabled:
+            # The same counters are in the metrics export, so there is no need to print them
+            return
+        stats = self.decode_worker.stats.snapshot()
+        scans = self.debouncer.stats()
+        gate = self.gate.stats()
+        tracked = f", items={self.tracker.stats()['items']}" if self.tracker is not None else ""
+        print(f"Decode stats: captured={stats['frames_captured']}, "
+              f"decoded={stats['frames_decoded']}, dropped={stats['frames_dropped']}, "
+              f"skipped={stats['frames_skipped']} ({gate['skip_ratio']:.0%}), "
+              f"suppressed={scans['suppressed']}{tracked}")
+
     def stop(self):
         """Stops the camera feed."""
+        Clock.unschedule(self.update)
+        Clock.unschedule(self.report_stats)
+        self.decode_worker.stop()
         if self.capture.isOpened():
             self.capture.release()
             print("Camera stopped.")
@@ -143,22 +187,39 @@ class CameraPreview(Image):
 
 # Screen class for barcode scanning and payment processing
 class QRCodeScannerScreen(Screen):
-    def __init__(self, app, wallet, **kwargs):
+    def __init__(self, app, capture_settings=None, decoder_settings=None, gate_settings=None, batch_scan=False,
+                 **kwargs):
         """Initializes the barcode scanner screen."""
         super().__init__(**kwargs)
         self.app = app
-        self.wallet = wallet
-        self.capture = cv2.VideoCapture(0)
-        if not self.capture.isOpened():
-            print("Error: Unable to access the camera.")
-            return
-        print("Camera successfully opened.")
+        # capture_settings are CaptureThread options: source, width, height, fps, fourcc, buffer_size
+        self.capture_settings = capture_settings or {}
+        # decoder_settings are make_scan_decoder options. In "roi" mode only the grayscale guide box is
+        # decoded, with a periodic full-frame fallback; decoder is a backend name from
+        # decoders.BACKENDS, or "auto" to pick the fastest one as it runs
+        # Shoppers scan both the store's printed labels and the retail codes on packaging
+        self.decoder_settings = {"decoder": "pyzbar", "symbology": ("label", "product"), **(decoder_settings or {})}
+        # gate_settings are FrameGate options: motion_threshold, blur_threshold, box, idle_interval and
+        # max_idle_interval; both thresholds at 0 decode every frame
+        self.gate_settings = gate_settings or {}
+        # batch_scan takes every code in view at once, so by default the whole frame is decoded and checked
+        self.batch_scan = batch_scan
+        if batch_scan:
+            self.decoder_settings = {"decode_mode": "full", "multi": True, **self.decoder_settings}
+            self.gate_settings = {"box": None, **self.gate_settings}
+        self.capture = None
+        self.camera_preview = None
+        self.camera_loading = False
+        # Set while "Payment Successful" stands in for the camera, until the screen is left
+        self.payment_shown = False
         
         self.layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
         
-        # Add the camera preview
-        self.camera_preview = CameraPreview(capture=self.capture, parent_screen=self)
-        self.layout.add_widget(self.camera_preview)
+        # The camera preview takes this slot once the camera is open
+        self.preview_slot = BoxLayout()
+        self.camera_status = MDLabel(text="Starting camera...", halign="center", theme_text_color="Secondary")
+        self.preview_slot.add_widget(self.camera_status)
+        self.layout.add_widget(self.preview_slot)
 
         # Ready to Go button
         self.ready_button = MDRaisedButton(
@@ -181,54 +242,141 @@ class QRCodeScannerScreen(Screen):
 
     def process_barcode_data(self, data):
         """Processes the barcode data and opens the item detail screen."""
-        # Simulated product data for demonstration
-        product_database = {
-            "product123": {"name": "Product A", "price": 15.0},
-            "product456": {"name": "Product B", "price": 20.0},
-            "0060410050910": {"name": "Chips", "price": 25.0}
-        }
-        product_info = product_database.get(data)
+        try:
+            product_info = self.app.checkout.lookup(data)
+        except (CheckoutError, OSError) as e:
+            print(f"Product lookup failed: {e}")
+            return
         if product_info:
-            item_name = product_info["name"]
-            item_price = product_info["price"]
-            self.app.open_item_detail_screen(item_name, item_price)
+            self.app.open_item_detail_screen(product_info)
         else:
             print("Product not found in the database.")
 
+    def process_barcode_batch(self, codes, scan_id=None):
+        """Adds the items that came into view together to the basket in one call and pays for them.
+
+        A single item still opens the item detail screen, so its quantity
+        can be changed before paying.
+        """
+        if len(codes) == 1:
+            self.process_barcode_data(codes[0])
+            return
+        checkout = self.app.checkout
+        basket_id = self.app.basket_id
+        # The scan ID is the payment, and the lines are derived from it, so a retried batch is charged once
+        scan_id = scan_id or new_id()
+        try:
+            result = checkout.add_items(basket_id, basket_items(codes, scan_id))
+        except (CheckoutError, OSError) as e:
+            print(f"Items not added: {e}")
+            return
+        lines = [line for line in result["lines"] if "error" not in line]
+        for line in result["lines"]:
+            if "error" in line:
+                print(f"{line['error']}. {line['code']} not added.")
+        if not lines:
+            return
+        try:
+            payment = checkout.pay(basket_id, payment_id=scan_id, use_points=self.app.use_points)
+        except OSError as e:
+            # The payment may have gone through, so the lines stay held; a retry with the scan ID charges once
+            print(f"Payment not confirmed: {e}")
+            return
+        except CheckoutError as e:
+            for line in lines:
+                try:
+                    checkout.remove_item(basket_id, line["line_id"])
+                except (CheckoutError, OSError) as remove_error:
+                    print(f"{line['product']['name']} not returned to stock: {remove_error}")
+            if e.status == 402:
+                print("Insufficient balance. Payment failed.")
+            else:
+                print(f"Payment failed: {e.message}")
+            return
+        if self.app.sync is not None:
+            self.app.sync.notify()
+        self.app.refresh_balance(payment["balance_cents"])
+        self.payment_label.text = f"{sum(line['quantity'] for line in lines)} items paid"
+
     def show_payment_success(self):
-        """Displays the payment success message and stops the camera."""
-        self.layout.remove_widget(self.camera_preview)
+        """Displays the payment success message in place of the camera until the screen is left.
+
+        Called before the screen is shown, so entering it does not open the camera.
+        """
+        self.payment_shown = True
+        self.preview_slot.clear_widgets()
         self.payment_label.text = "Payment Successful"
 
+    def on_enter(self):
+        """Starts opening the camera in the background so the screen shows straight away."""
+        if self.camera_preview is None and not self.camera_loading and not self.payment_shown:
+            self.camera_loading = True
+            self.camera_status.text = "Starting camera..."
+            load_scanner_async(self.on_camera_ready, self.capture_settings, self.decoder_settings)
+
+    def on_camera_ready(self, capture, decode_fn):
+        """Adds the camera preview once the camera is open, or reports that it could not be opened."""
+        self.camera_loading = False
+        if capture is None:
+            print("Error: Unable to access the camera.")
+            self.camera_status.text = "Camera unavailable"
+            return
+        if self.payment_shown or self.manager is not None and self.manager.current_screen is not self:
+            # The screen was left, or a payment went through, while the camera was opening
+            capture.release()
+            return
+        print("Camera successfully opened.")
+        self.capture = capture
+        self.camera_preview = CameraPreview(capture=capture, parent_screen=self, decode_fn=decode_fn,
+                                            gate_settings=self.gate_settings, batch=self.batch_scan)
+        self.preview_slot.clear_widgets()
+        self.preview_slot.add_widget(self.camera_preview)
+
     def on_leave(self):
         """Releases the camera when leaving the screen."""
-        if self.capture.isOpened():
+        if self.camera_preview is not None:
+            self.camera_preview.stop()
+            self.preview_slot.clear_widgets()
+            self.preview_slot.add_widget(self.camera_status)
+            self.camera_preview = None
+        if self.capture is not None and self.capture.isOpened():
             self.capture.release()
             print("Camera released.")
-
-# Item detail screen class
+        self.capture = None
+        if self.payment_shown:
+            # The camera comes back the next time the screen is entered
+            self.payment_shown = False
+            self.preview_slot.clear_widgets()
+            self.preview_slot.add_widget(self.camera_status)
+        self.payment_label.text = ""
+
+# Item detail screen class; built once and shown again for each scanned product
 class ItemDetailScreen(Screen):
-    def __init__(self, app, item_name, item_price, **kwargs):
-        """Initializes the item detail screen."""
+    def __init__(self, app, product=None, **kwargs):
+        """Initializes the item detail screen, showing the product if one is given."""
         super().__init__(**kwargs)
         self.app = app
-        self.item_name = item_name
-        self.item_price = item_price
+        self.product = None
         self.quantity = 1  # Default quantity
+        self.paid = False
+        self.reserved = False
+        self.line_id = None
 
-        layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
+        self.layout = BoxLayout(orientation='vertical', padding=10, spacing=10)
 
         # Header layout with close button
         header_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='40dp')
-        item_label = MDLabel(text=f"Item: {self.item_name}", font_style="H5", halign="left")
+        self.item_label = MDLabel(text="", font_style="H5", halign="left")
         close_button = MDIconButton(icon="close", on_release=lambda x: self.close_screen())
-        header_layout.add_widget(item_label)
+        header_layout.add_widget(self.item_label)
         header_layout.add_widget(close_button)
-        layout.add_widget(header_layout)
+        self.layout.add_widget(header_layout)
 
         # Price label
-        price_label = MDLabel(text=f"Price: ${self.item_price:.2f}", font_style="Subtitle1", halign="left")
-        layout.add_widget(price_label)
+        self.price_label = MDLabel(text="", font_style="Subtitle1", halign="left")
+        self.layout.add_widget(self.price_label)
+        # Added under the price only while the shown product could not be held
+        self.stock_label = MDLabel(text="Out of stock", font_style="Subtitle1", halign="left")
 
         # Quantity control layout
         quantity_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='50dp')
@@ -239,40 +387,129 @@ class ItemDetailScreen(Screen):
         quantity_layout.add_widget(decrease_button)
         quantity_layout.add_widget(self.quantity_label)
         quantity_layout.add_widget(increase_button)
-        layout.add_widget(quantity_layout)
+        self.layout.add_widget(quantity_layout)
 
-        self.add_widget(layout)
+        self.add_widget(self.layout)
+        if product is not None:
+            self.show_product(product)
+
+    def show_product(self, product):
+        """Rebinds the screen to a product and holds one unit of it for the basket.
+
+        Units still held for the product shown before, and not paid for,
+        go back to stock first.
+        """
+        self.release()
+        self.product = product
+        self.item_name = product["name"]
+        self.item_price = product["price"]
+        self.quantity = 1
+        self.paid = False
+        # Each basket line holds its units until it is paid for or closed
+        self.line_id = new_id()
+        try:
+            self.app.checkout.add_item(self.app.basket_id, product["product_id"], self.quantity,
+                                       line_id=self.line_id)
+            self.reserved = True
+        except (CheckoutError, OSError) as e:
+            print(e)
+            self.reserved = False
+
+        self.item_label.text = f"Item: {self.item_name}"
+        self.price_label.text = f"Price: ${self.item_price:.2f}"
+        self.quantity_label.text = str(self.quantity)
+        if self.reserved and self.stock_label.parent is not None:
+            self.layout.remove_widget(self.stock_label)
+        elif not self.reserved and self.stock_label.parent is None:
+            # Index 1 puts it just above the quantity controls
+            self.layout.add_widget(self.stock_label, index=1)
+
+    def release(self):
+        """Returns the held units to stock if they were not paid for."""
+        if self.reserved and not self.paid:
+            try:
+                self.app.checkout.remove_item(self.app.basket_id, self.line_id)
+            except (CheckoutError, OSError) as e:
+                print(e)
+        self.reserved = False
 
     def update_quantity(self, change):
         """Updates the quantity displayed."""
         new_quantity = self.quantity + change
-        if new_quantity > 0:
-            self.quantity = new_quantity
-            self.quantity_label.text = str(self.quantity)
+        if new_quantity < 1 or not self.reserved:
+            return
+        try:
+            self.app.checkout.add_item(self.app.basket_id, self.product["product_id"], new_quantity,
+                                       line_id=self.line_id)
+        except (CheckoutError, OSError) as e:
+            print(e)
+            return
+        self.quantity = new_quantity
+        self.quantity_label.text = str(self.quantity)
 
     def handle_payment(self):
-        """Handles payment and navigates to the scanner screen with a success message."""
-        self.app.switch_to_scanner()
+        """Charges the wallet for the held units less any promotion, records the sale and shows the success message."""
+        if not self.reserved:
+            print(f"{self.item_name} is out of stock. Payment not processed.")
+            return
+        try:
+            # The line ID doubles as the payment ID, so pressing again cannot charge twice
+            payment = self.app.checkout.pay(self.app.basket_id, payment_id=self.line_id,
+                                            use_points=self.app.use_points)
+        except OSError as e:
+            # Pressing pay again retries with the same payment ID, so it cannot charge twice
+            print(f"Payment not confirmed: {e}")
+            return
+        except CheckoutError as e:
+            if e.status == 402:
+                print("Insufficient balance. Payment failed.")
+            else:
+                print(f"Payment failed: {e.message}")
+            return
+        self.paid = True
+        # The sale is committed locally; wake the sync engine to send it to the retailer
+        if self.app.sync is not None:
+            self.app.sync.notify()
+        self.app.refresh_balance(payment["balance_cents"])
         self.app.scanner_screen.show_payment_success()
+        self.app.switch_to_scanner()
 
     def close_screen(self):
-        """Closes the item detail screen."""
+        """Closes the item detail screen, returning the held units if they were not paid for.
+
+        The screen stays in the ScreenManager to be shown again for the next scan.
+        """
+        self.release()
         self.manager.current = 'scanner'
-        self.manager.remove_widget(self)
 
 # Main app class
 class MainApp(MDApp):
     def build(self):
-        """Builds the main app and initializes the wallet."""
-        self.wallet = Wallet(initial_balance=100.0)
+        """Builds the main app and opens the customer's wallet and basket."""
+        metrics.configure_from_env()
+        # The shared checkout server if GOBUY_SERVER names one, otherwise the stores on this machine
+        self.checkout = connect_from_env() or CheckoutService()
+        # Working offline-first, sales committed here are sent to the server named by GOBUY_SYNC
+        self.sync = start_from_env(self.checkout.journal.path) if isinstance(self.checkout, CheckoutService) else None
+        self.customer_id = "customer"
+        # A checkout server's wallets are opened when it is set up, with --wallet
+        if isinstance(self.checkout, CheckoutService):
+            self.checkout.open_wallet(self.customer_id, initial_balance=100.0)
+        basket = self.checkout.open_basket(self.customer_id)
+        self.basket_id = basket["basket_id"]
+        self.session_id = basket["session_id"]
+        self.use_points = False
+        # Built on the first scan and rebound to each product after that
+        self.item_screen = None
         self.sm = ScreenManager()
 
         # Add the main screen
-        main_screen = MainScreen(app=self, wallet=self.wallet, name='main')
+        main_screen = MainScreen(app=self, name='main')
         self.sm.add_widget(main_screen)
 
         # Add the barcode scanner screen
-        self.scanner_screen = QRCodeScannerScreen(app=self, wallet=self.wallet, name='scanner')
+        # GOBUY_BATCH_SCAN takes every code in view, for scanning a whole basket at once
+        self.scanner_screen = QRCodeScannerScreen(app=self, batch_scan=batch_scan_from_env(), name='scanner')
         self.sm.add_widget(self.scanner_screen)
 
         return self.sm
@@ -285,31 +522,86 @@ class MainApp(MDApp):
         """Switches to the main screen."""
         self.sm.current = 'main'
 
-    def open_item_detail_screen(self, item_name, item_price):
-        """Opens the item detail screen."""
-        item_screen = ItemDetailScreen(app=self, item_name=item_name, item_price=item_price, name='item_detail')
-        self.sm.add_widget(item_screen)
+    def balance_cents(self):
+        """Returns the customer's wallet balance in cents."""
+        return self.checkout.wallet(self.customer_id)["balance_cents"]
+
+    def refresh_balance(self, balance_cents=None):
+        """Shows the wallet balance on the main screen, fetching it unless it is given."""
+        if balance_cents is None:
+            balance_cents = self.balance_cents()
+        self.sm.get_screen('main').balance_label.text = f"Wallet Balance: ${balance_cents / 100:.2f}"
+
+    def open_item_detail_screen(self, product):
+        """Opens the item detail screen for a catalog product, reusing the one screen and its widgets."""
+        if self.item_screen is None:
+            self.item_screen = ItemDetailScreen(app=self, name='item_detail')
+            self.sm.add_widget(self.item_screen)
+        self.item_screen.show_product(product)
         self.sm.current = 'item_detail'
 
+    def on_stop(self):
+        """Returns unpaid stock, writes any queued transactions and any profiler samples before the app exits."""
+        try:
+            self.checkout.close_basket(self.basket_id)
+        except OSError as e:
+            # The server returns the stock once the basket's holds expire
+            print(f"Basket not closed: {e}")
+        if self.sync is not None:
+            self.sync.close()
+        self.checkout.close()
+        metrics.shutdown()
+
+    def show_coupons(self):
+        """Shows the promotions applied to the basket and how many are running."""
+        try:
+            applied = self.checkout.applied(self.basket_id)
+            running = self.checkout.coupons(limit=0)["count"]
+        except (CheckoutError, OSError) as e:
+            print(f"Coupons unavailable: {e}")
+            return
+        lines = [f"{line['product']}: {line['coupon']} (-${line['discount_cents'] / 100:.2f})"
+                 for line in applied["promotions"]]
+        lines.append(f"Saved so far: ${applied['discount_cents'] / 100:.2f}")
+        lines.append(f"{running} promotions running")
+        MDDialog(title="Coupons", text="\n".join(lines), size_hint=(0.8, 0.5)).open()
+
+    def show_points(self):
+        """Shows the customer's points and lets them choose whether checkout spends them."""
+        try:
+            points = self.checkout.wallet(self.customer_id)["points"]
+        except (CheckoutError, OSError) as e:
+            print(f"Points unavailable: {e}")
+            return
+        dialog = MDDialog(
+            title="Points",
+            text=f"You have {points} points (${points * POINT_VALUE_CENTS / 100:.2f}).\n"
+                 f"Points are {'being' if self.use_points else 'not being'} spent at checkout.",
+            size_hint=(0.8, 0.5),
+            buttons=[
+                MDRaisedButton(
+                    text="Save points" if self.use_points else "Use points",
+                    on_release=lambda x: self.toggle_points(dialog)
+                )
+            ]
+        )
+        dialog.open()
+
+    def toggle_points(self, dialog):
+        """Switches spending points at checkout on or off."""
+        self.use_points = not self.use_points
+        dialog.dismiss()
+
     def generate_receipt(self):
-        """Generates a PDF receipt from the transactions file."""
-        if os.path.exists("transactions.txt"):
-            try:
-                from reportlab.pdfgen import canvas
-                c = canvas.Canvas("receipt.pdf")
-                c.drawString(100, 800, "Transaction Receipt")
-                with open("transactions.txt", "r") as file:
-                    lines = file.readlines()
-                    y = 780
-                    for line in lines:
-                        c.drawString(100, y, line.strip())
-                        y -= 20
-                c.save()
-                print("Receipt generated as receipt.pdf")
-            except Exception as e:
-                print(f"Error generating receipt: {e}")
+        """Generates a paginated PDF receipt for the current session on a worker thread."""
+        generate_receipt_async(lambda: self.checkout.sales(self.session_id), self.on_receipt_generated)
+
+    def on_receipt_generated(self, result):
+        """Reports the outcome of a background receipt render."""
+        if isinstance(result, Exception):
+            print(f"Error generating receipt: {result}")
         else:
-            print("No transactions to include in the receipt.")
+            print(f"Receipt generated as {result['path']} ({result['lines']} lines, {result['pages']} pages)")
 
 # Run the app
 if __name__ == '__main__':
@@ -0,0 +1,240 @@
+import datetime
+import heapq
+import json
+import os
+import time
+
+from journal import DEFAULT_PATH, scan
+
+# Layout of the saved aggregates; a file in any other layout is ignored and rebuilt from the journal
+STATE_VERSION = 2
+
+
+def state_path(path):
+    """Returns the path of the saved aggregates for a journal file."""
+    return path + ".analytics.json"
+
+
+def sold_at(record):
+    """Returns when a sale record's sale was made: the device's time for a synced sale, else when it was journaled."""
+    return record.get("sold_at", record["ts"])
+
+
+# Sales aggregates kept up to date from the transaction journal
+class SalesAnalytics:
+    def __init__(self, path=DEFAULT_PATH, top_n=10, utc_offset=None):
+        """Initializes the aggregates for a journal, loading the saved state if there is one.
+
+        Sales are bucketed by UTC hour. Hours and days are only put in local
+        time when they are read: in the local time zone, daylight saving
+        time included, or at a fixed utc_offset in seconds if one is given.
+        The aggregates remember how far into the journal they have read, so
+        update() only reads records appended since.
+        """
+        self.path = path
+        self.state_path = state_path(path)
+        self.top_n = top_n
+        self.utc_offset = utc_offset
+        self.reset()
+        self.load()
+
+    def reset(self):
+        """Clears all aggregates."""
+        self.offset = 0
+        self.sales = 0
+        self.units_total = 0
+        self.revenue_cents = 0
+        self.names = {}
+        self.units = {}
+        self.revenue = {}
+        self.revenue_by_hour = {}
+        self._top = {}
+        self._top_dirty = False
+
+    def add(self, record):
+        """Folds one sale record into the aggregates."""
+        product_id = record["product_id"]
+        quantity = record["quantity"]
+        # Revenue is what was taken after promotions
+        amount = record["amount_cents"] - record.get("discount_cents", 0)
+        hour = int(sold_at(record) // 3600)
+        self.sales += 1
+        self.units_total += quantity
+        self.revenue_cents += amount
+        self.names[product_id] = record["name"]
+        units = self.units[product_id] = self.units.get(product_id, 0) + quantity
+        self.revenue[product_id] = self.revenue.get(product_id, 0) + amount
+        self.revenue_by_hour[hour] = self.revenue_by_hour.get(hour, 0) + amount
+        self._update_top(product_id, units, quantity)
+
+    def _update_top(self, product_id, units, quantity):
+        """Keeps the top_n best sellers current as one product's count changes.
+
+        Counts only grow with sales, so a product can only enter the top
+        set by passing its smallest member, which is checked here. A
+        negative quantity (a return) can let an outside product overtake,
+        so the set is then rebuilt on the next read.
+        """
+        top = self._top
+        if quantity < 0:
+            self._top_dirty = True
+        if product_id in top:
+            top[product_id] = units
+        elif len(top) < self.top_n:
+            top[product_id] = units
+        else:
+            smallest = min(top, key=top.get)
+            if units > top[smallest]:
+                del top[smallest]
+                top[product_id] = units
+
+    def update(self):
+        """Reads the records appended to the journal since the last update and returns how many were sales."""
+        if self.offset and (not os.path.exists(self.path) or os.path.getsize(self.path) < self.offset):
+            # The journal was replaced, so the aggregates no longer describe it
+            self.reset()
+        added = 0
+        for offset, length, record in scan(self.path, self.offset):
+            if record["type"] == "sale":
+                self.add(record)
+                added += 1
+            self.offset = offset + length
+        return added
+
+    def top_items(self, n=None):
+        """Returns (product_id, name, units, revenue_cents) for the best sellers, most units first."""
+        n = n or self.top_n
+        if self._top_dirty:
+            self._top = dict(heapq.nlargest(self.top_n, self.units.items(), key=lambda item: item[1]))
+            self._top_dirty = False
+        if n > self.top_n:
+            candidates = heapq.nlargest(n, self.units.items(), key=lambda item: item[1])
+        else:
+            candidates = sorted(self._top.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(pid, self.names[pid], units, self.revenue[pid]) for pid, units in candidates]
+
+    def _local(self, ts, utc_offset=None):
+        """Returns a timestamp as a struct_time in the time zone the aggregates are read in, or at utc_offset."""
+        utc_offset = self.utc_offset if utc_offset is None else utc_offset
+        return time.localtime(ts) if utc_offset is None else time.gmtime(ts + utc_offset)
+
+    def hourly_revenue(self, hours=24, now=None, utc_offset=None):
+        """Returns ("YYYY-MM-DD HH:00", revenue_cents) for each of the last hours hours, oldest first.
+
+        utc_offset, in seconds, overrides the time zone the aggregates are read in.
+        """
+        current = int((time.time() if now is None else now) // 3600)
+        return [(time.strftime("%Y-%m-%d %H:00", self._local(hour * 3600, utc_offset)),
+                 self.revenue_by_hour.get(hour, 0))
+                for hour in range(current - hours + 1, current + 1)]
+
+    def daily_revenue(self, days=7, now=None, utc_offset=None):
+        """Returns ("YYYY-MM-DD", revenue_cents) for each of the last days days, oldest first.
+
+        utc_offset, in seconds, overrides the time zone the aggregates are read in.
+        """
+        now = time.time() if now is None else now
+        today = datetime.date(*self._local(now, utc_offset)[:3])
+        totals = {(today - datetime.timedelta(days=back)).isoformat(): 0 for back in range(days - 1, -1, -1)}
+        current = int(now // 3600)
+        # A day of 25 hours when the clocks go back still falls inside the hours summed
+        for hour in range(current - (days + 1) * 24, current + 1):
+            revenue = self.revenue_by_hour.get(hour)
+            if revenue:
+                day = time.strftime("%Y-%m-%d", self._local(hour * 3600, utc_offset))
+                if day in totals:
+                    totals[day] += revenue
+        return list(totals.items())
+
+    def sell_through(self, catalog, product_ids):
+        """Returns units sold / (units sold + units still in stock) for each product, as {product_id: rate}."""
+        stock = catalog.stock_levels(product_ids)
+        rates = {}
+        for product_id in product_ids:
+            sold = self.units.get(product_id, 0)
+            available = sold + max(stock.get(product_id, 0), 0)
+            rates[product_id] = sold / available if available else 0.0
+        return rates
+
+    def save(self):
+        """Writes the aggregates next to the journal so the next start only reads new records."""
+        state = {
+            "version": STATE_VERSION, "offset": self.offset, "sales": self.sales,
+            "units_total": self.units_total, "revenue_cents": self.revenue_cents, "names": self.names,
+            "units": self.units, "revenue": self.revenue,
+            # JSON object keys are strings, so the hour numbers are stored as pairs
+            "revenue_by_hour": list(self.revenue_by_hour.items()),
+        }
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(state, file, separators=(",", ":"))
+        os.replace(temp_path, self.state_path)
+
+    def load(self):
+        """Loads the saved aggregates, ignoring a missing or unreadable file or one in an older layout."""
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+            return
+        self.offset = state["offset"]
+        self.sales = state["sales"]
+        self.units_total = state["units_total"]
+        self.revenue_cents = state["revenue_cents"]
+        self.names = state["names"]
+        self.units = state["units"]
+        self.revenue = state["revenue"]
+        self.revenue_by_hour = dict(state["revenue_by_hour"])
+        self._top_dirty = True
+
+    def recompute(self, vectorized=True):
+        """Rebuilds the aggregates from the whole journal, for backfills.
+
+        With vectorized set and NumPy installed, the records are only
+        parsed in Python and all of the summing is done on arrays; without
+        NumPy every record goes through add().
+        """
+        self.reset()
+        try:
+            import numpy as np
+        except ImportError:
+            vectorized = False
+        if not vectorized:
+            self.update()
+            return
+        product_ids, quantities, amounts, timestamps = [], [], [], []
+        for offset, length, record in scan(self.path):
+            if record["type"] == "sale":
+                product_ids.append(record["product_id"])
+                quantities.append(record["quantity"])
+                amounts.append(record["amount_cents"] - record.get("discount_cents", 0))
+                timestamps.append(sold_at(record))
+                self.names[record["product_id"]] = record["name"]
+            self.offset = offset + length
+        self.add_columns(product_ids, np.array(quantities, np.int64), np.array(amounts, np.int64),
+                         np.array(timestamps, np.float64))
+
+    def add_columns(self, product_ids, quantities, amounts, timestamps):
+        """Folds a batch of sales given as a list of product IDs and NumPy arrays into the aggregates.
+
+        Every product ID must already have an entry in names.
+        """
+        import numpy as np
+        if not len(product_ids):
+            return
+        keys, inverse = np.unique(np.asarray(product_ids), return_inverse=True)
+        units = np.bincount(inverse, weights=quantities, minlength=len(keys)).astype(np.int64)
+        revenue = np.bincount(inverse, weights=amounts, minlength=len(keys)).astype(np.int64)
+        for product_id, product_units, product_revenue in zip(keys.tolist(), units.tolist(), revenue.tolist()):
+            self.units[product_id] = self.units.get(product_id, 0) + product_units
+            self.revenue[product_id] = self.revenue.get(product_id, 0) + product_revenue
+        hours, hour_inverse = np.unique((timestamps // 3600).astype(np.int64), return_inverse=True)
+        sums = np.bincount(hour_inverse, weights=amounts).astype(np.int64)
+        for hour, total in zip(hours.tolist(), sums.tolist()):
+            self.revenue_by_hour[hour] = self.revenue_by_hour.get(hour, 0) + total
+        self.sales += len(product_ids)
+        self.units_total += int(quantities.sum())
+        self.revenue_cents += int(amounts.sum())
+        self._top_dirty = True
@@ -0,0 +1,147 @@
+"""Measures sales analytics aggregation and page render time up to 10M transactions.
+
+Synthetic sales (skewed over --skus products and spread over --days days)
+are folded into SalesAnalytics both one record at a time, as update()
+does for new journal records, and in NumPy batches, as recompute() does
+for backfills. After each million the time to produce everything the
+Analysis page shows is measured. A smaller real journal is then used to
+compare a full rescan of history with an incremental update and a
+vectorized recompute.
+
+Run from the repository root:
+    python -m benchmarks.bench_analytics --transactions 10000000
+"""
+import argparse
+import os
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+from analytics import SalesAnalytics
+from journal import Journal, read_records
+
+CHUNK = 1000000
+
+
+def synthetic_chunk(rng, size, skus, start_ts, days):
+    """Returns product indexes, quantities, amounts and timestamps for one chunk of sales."""
+    # Zipf-like popularity: a few products sell far more than the rest
+    products = np.minimum(rng.zipf(1.3, size) - 1, skus - 1)
+    quantities = rng.integers(1, 4, size)
+    amounts = quantities * (99 + (products % 50) * 100)
+    timestamps = start_ts + rng.random(size) * days * 86400
+    return products, quantities, amounts, timestamps
+
+
+def render(analytics):
+    """Returns the milliseconds taken to compute the figures the Analysis page shows."""
+    start = time.perf_counter()
+    analytics.top_items()
+    analytics.daily_revenue(7)
+    analytics.hourly_revenue(24)
+    return (time.perf_counter() - start) * 1000
+
+
+def run_synthetic(total, skus, days, seed, workdir):
+    """Folds total synthetic sales into incremental and vectorized aggregates and prints the timings."""
+    rng = np.random.default_rng(seed)
+    names = np.array([f"sku{i:06d}" for i in range(skus)])
+    start_ts = time.time() - days * 86400
+    # Never written; the aggregates are fed directly
+    path = os.path.join(workdir, "synthetic.jsonl")
+    incremental = SalesAnalytics(path, utc_offset=0)
+    vectorized = SalesAnalytics(path, utc_offset=0)
+    vectorized.names = {name: name for name in names.tolist()}
+    add_seconds = 0.0
+    batch_seconds = 0.0
+    print(f"{'transactions':>12} {'add() rate':>14} {'batch rate':>14} {'render ms':>10} {'top item':>12}")
+    done = 0
+    while done < total:
+        size = min(CHUNK, total - done)
+        products, quantities, amounts, timestamps = synthetic_chunk(rng, size, skus, start_ts, days)
+        product_ids = names[products]
+
+        records = [{"product_id": pid, "name": pid, "quantity": q, "amount_cents": a, "ts": ts}
+                   for pid, q, a, ts in zip(product_ids.tolist(), quantities.tolist(), amounts.tolist(),
+                                            timestamps.tolist())]
+        start = time.perf_counter()
+        for record in records:
+            incremental.add(record)
+        add_seconds += time.perf_counter() - start
+        del records
+
+        start = time.perf_counter()
+        vectorized.add_columns(product_ids, quantities, amounts, timestamps)
+        batch_seconds += time.perf_counter() - start
+
+        done += size
+        top = incremental.top_items(1)[0]
+        print(f"{done:>12,} {done / add_seconds:>12,.0f}/s {done / batch_seconds:>12,.0f}/s "
+              f"{render(incremental):>10.3f} {top[0]:>12}")
+
+    same = (incremental.units == vectorized.units and incremental.revenue_by_hour == vectorized.revenue_by_hour
+            and incremental.top_items() == vectorized.top_items())
+    print(f"incremental and vectorized aggregates match: {same}")
+
+
+def run_journal(records, skus, workdir):
+    """Writes a real journal and compares a full rescan with incremental and vectorized aggregation."""
+    path = os.path.join(workdir, "transactions.jsonl")
+    journal = Journal(path, fsync="never")
+    for i in range(records):
+        sku = (i * 7919) % skus
+        journal.append("sale", product_id=f"sku{sku:06d}", name=f"Product {sku}", quantity=1,
+                       unit_price_cents=199, amount_cents=199)
+    journal.close()
+
+    start = time.perf_counter()
+    items_sold = Counter()
+    for record in read_records(path, record_type="sale"):
+        items_sold[record["name"]] += record["quantity"]
+    items_sold.most_common(10)
+    rescan_ms = (time.perf_counter() - start) * 1000
+
+    analytics = SalesAnalytics(path)
+    start = time.perf_counter()
+    analytics.update()
+    catch_up_ms = (time.perf_counter() - start) * 1000
+    analytics.save()
+
+    journal = Journal(path, fsync="never")
+    for i in range(1000):
+        journal.append("sale", product_id="sku000001", name="Product 1", quantity=1,
+                       unit_price_cents=199, amount_cents=199)
+    journal.close()
+    reopened = SalesAnalytics(path)
+    start = time.perf_counter()
+    reopened.update()
+    ms = render(reopened)
+    incremental_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    analytics.recompute()
+    recompute_ms = (time.perf_counter() - start) * 1000
+
+    print(f"journal of {records:,} sales: full rescan {rescan_ms:.0f} ms, first catch-up {catch_up_ms:.0f} ms, "
+          f"vectorized recompute {recompute_ms:.0f} ms, reopen + 1,000 new sales + render "
+          f"{incremental_ms:.1f} ms (render {ms:.2f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transactions", type=int, default=10000000)
+    parser.add_argument("--journal-records", type=int, default=200000, help="sales written to the real journal")
+    parser.add_argument("--skus", type=int, default=10000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run_synthetic(args.transactions, args.skus, args.days, args.seed, workdir)
+        run_journal(args.journal_records, args.skus, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Compares scanning items one at a time with batch scanning every code in view, in items per second.
+
+A synthetic 30 fps clip shows --baskets baskets of two to six items,
+some of them several copies of one product, each with its own QR code.
+In the "whole basket" clip all of a basket's items are held under the
+camera together for --hold seconds, drifting a little and now and then
+hidden behind a hand; in the "one at a time" clip the same items are
+shown singly, each for as long. Every presentation is followed by --gap
+seconds of empty counter, or longer where the next one would otherwise
+be taken for the same scan: in the one-at-a-time clip the gap before
+another copy of a product lasts until the debounce window since the last
+copy has passed, and in the whole-basket clip the gap before a basket
+with a product where the last basket had it lasts until the tracker has
+let that product's track go.
+
+Each clip runs through the frame gate and the decoder on a simulated
+clock, and accepted scans go to a CheckoutService the way the apps send
+them: the single-code mode debounces and adds and pays for one item per
+scan, the batch mode tracks every code and adds and pays for all the new
+ones in a frame in one call each. Items per second is the number of
+items counted correctly over the length of the clip; every item must
+end up in the basket exactly once.
+
+Run from the repository root:
+    python -m benchmarks.bench_batch_scan --baskets 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from catalog import Catalog
+from checkout import CheckoutService
+from decode_region import RegionDecoder
+from decoders import make_decoder
+from frame_gate import FrameGate
+from journal import new_id
+from scan_debounce import ScanDebouncer
+from scan_tracker import MAX_AGE, ScanTracker, basket_items
+
+FPS = 30
+SIZE = (640, 480)
+# Where items lie in the whole-basket view, as top-left corners, and how big their codes look
+SLOTS = [(40, 50), (260, 40), (470, 60), (50, 290), (270, 300), (480, 280)]
+CODE_SIZE = 110
+# One item at a time is held up to the guide box, closer to the camera
+SINGLE_SLOT = (230, 150)
+SINGLE_CODE_SIZE = 180
+
+
+def make_codes(products, size):
+    """Returns {product_id: QR code image} for the products, size pixels across."""
+    encoder = cv2.QRCodeEncoder.create()
+    codes = {}
+    for product_id in products:
+        code = cv2.cvtColor(encoder.encode(product_id), cv2.COLOR_GRAY2BGR)
+        codes[product_id] = cv2.resize(code, (size, size), interpolation=cv2.INTER_NEAREST)
+    return codes
+
+
+def make_baskets(count, products, rng):
+    """Returns count lists of two to six product IDs, with a product sometimes repeated."""
+    baskets = []
+    for _ in range(count):
+        size = rng.randint(2, 6)
+        basket = [rng.choice(products) for _ in range(size - 1)]
+        basket.append(rng.choice(basket) if rng.random() < 0.5 else rng.choice(products))
+        baskets.append(basket)
+    return baskets
+
+
+def make_clip(presentations, codes, slots, hold, seed):
+    """Returns the frames showing each presentation, a (product IDs, gap) pair, at the given slots in turn."""
+    rng = np.random.default_rng(seed)
+    counter = cv2.GaussianBlur(rng.integers(120, 200, (SIZE[1], SIZE[0], 3), dtype=np.uint8), (31, 31), 0)
+
+    def noisy(frame):
+        return cv2.add(frame, rng.normal(0, 2, frame.shape).astype(np.int8), dtype=cv2.CV_8U)
+
+    frames = []
+    for items, gap in presentations:
+        drift = rng.uniform(-1.5, 1.5, 2)
+        # A hand passes over one item for a few frames partway through
+        hidden = int(rng.integers(len(items))), int(hold * FPS * 0.4), int(hold * FPS * 0.4) + 5
+        for i in range(int(hold * FPS)):
+            frame = counter.copy()
+            for index, product_id in enumerate(items):
+                if index == hidden[0] and hidden[1] <= i < hidden[2]:
+                    continue
+                x, y = slots[index]
+                x, y = int(x + drift[0] * i / 3), int(y + drift[1] * i / 3)
+                code = codes[product_id]
+                frame[y:y + code.shape[0], x:x + code.shape[1]] = code
+            frames.append(noisy(frame))
+        frames += [noisy(counter) for _ in range(int(gap * FPS))]
+    return frames
+
+
+# Adds scans to a basket the way QRCodeScannerScreen does, counting checkout calls
+class Lane:
+    def __init__(self, service, customer_id):
+        """Opens a basket for the customer."""
+        self.service = service
+        self.basket_id = service.open_basket(customer_id)["basket_id"]
+        self.calls = 0
+        self.seconds = 0.0
+
+    def scan(self, code):
+        """Adds and pays for one item, as process_qr_data does."""
+        start = time.perf_counter()
+        line_id = new_id()
+        self.service.add_item(self.basket_id, code, 1, line_id=line_id)
+        self.service.pay(self.basket_id, payment_id=line_id)
+        self.calls += 2
+        self.seconds += time.perf_counter() - start
+
+    def scan_batch(self, codes):
+        """Adds and pays for the items new in one frame, as process_qr_batch does."""
+        start = time.perf_counter()
+        scan_id = new_id()
+        self.service.add_items(self.basket_id, basket_items(codes, scan_id))
+        self.service.pay(self.basket_id, payment_id=scan_id)
+        self.calls += 2
+        self.seconds += time.perf_counter() - start
+
+    def counted(self):
+        """Returns Counter({product_id: units}) of what the basket has paid for."""
+        basket = self.service._basket(self.basket_id)
+        counts = Counter()
+        for line in basket.lines.values():
+            if line["paid"]:
+                counts[line["product"]["product_id"]] += line["quantity"]
+        return counts
+
+
+def run(frames, decode, batch, lane):
+    """Feeds the clip through the gate and decoder into the lane and returns the decode CPU seconds."""
+    clock = [0.0]
+    gate = FrameGate(box=None if batch else FrameGate().box, clock=lambda: clock[0])
+    tracker = ScanTracker(clock=lambda: clock[0])
+    debouncer = ScanDebouncer(clock=lambda: clock[0])
+    cpu = 0.0
+    for index, frame in enumerate(frames):
+        clock[0] = index / FPS
+        start = time.process_time()
+        admitted = gate.admit(frame)
+        found = []
+        if admitted:
+            try:
+                found = decode(frame)
+            except cv2.error:
+                # The decode worker treats a backend error as a frame without a code
+                pass
+        cpu += time.process_time() - start
+        if not admitted:
+            continue
+        if batch:
+            new = tracker.update(found)
+            if new:
+                lane.scan_batch([obj.data.decode("utf-8") for obj in new])
+        elif found:
+            obj = found[0]
+            if debouncer.accept(obj.data, obj.rect):
+                lane.scan(obj.data.decode("utf-8"))
+    return cpu
+
+
+def presentation_gaps(presentations, hold, gap, window):
+    """Returns the gap after each presentation, so a product shown again where it was within window seconds counts."""
+    last_shown = {}
+    now = 0.0
+    gaps = []
+    for items, following in zip(presentations, presentations[1:] + [[]]):
+        now += hold
+        for place, product_id in enumerate(items):
+            last_shown[place, product_id] = now
+        wait = max([last_shown.get((place, product_id), -window) + window - now
+                    for place, product_id in enumerate(following)], default=0)
+        gaps.append(max(gap, wait))
+        now += gaps[-1]
+    return gaps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baskets", type=int, default=20)
+    parser.add_argument("--products", type=int, default=12)
+    parser.add_argument("--hold", type=float, default=1.0, help="seconds each presentation is held in view")
+    parser.add_argument("--gap", type=float, default=0.5, help="seconds of empty counter between presentations")
+    parser.add_argument("--decoder", default="auto", help="decoder backend name, or auto")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    products = [f"sku{i:03d}" for i in range(args.products)]
+    baskets = make_baskets(args.baskets, products, rng)
+    expected = Counter(product_id for basket in baskets for product_id in basket)
+    items = sum(expected.values())
+    singles = [[product_id] for basket in baskets for product_id in basket]
+    # Another copy of a product shown where it was a moment ago would not count, so the shopper waits it out:
+    # the debounce window for one item at a time, the tracker's max_age for whole baskets
+    single_gaps = presentation_gaps(singles, args.hold, args.gap, ScanDebouncer().window + 1 / FPS)
+    basket_gaps = presentation_gaps(baskets, args.hold, args.gap, MAX_AGE + 1 / FPS)
+    clips = {
+        "whole basket": make_clip(list(zip(baskets, basket_gaps)), make_codes(products, CODE_SIZE),
+                                  SLOTS, args.hold, args.seed),
+        "one at a time": make_clip(list(zip(singles, single_gaps)), make_codes(products, SINGLE_CODE_SIZE),
+                                   [SINGLE_SLOT], args.hold, args.seed),
+    }
+    print(f"{args.baskets} baskets, {items} items; whole-basket clip {len(clips['whole basket']) / FPS:.0f} s, "
+          f"one-at-a-time clip {len(clips['one at a time']) / FPS:.0f} s")
+
+    runs = [("single", "one at a time"), ("single", "whole basket"), ("batch", "whole basket")]
+    ok = True
+    rates = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        catalog_path = os.path.join(workdir, "catalog.db")
+        catalog = Catalog(catalog_path, seed_defaults=False)
+        catalog.upsert_many({"product_id": product_id, "name": f"Product {product_id}", "price": 1.99,
+                             "category": "grocery", "stock": 10 ** 6} for product_id in products)
+        catalog.close()
+        service = CheckoutService(catalog_path, os.path.join(workdir, "wallets.db"),
+                                  os.path.join(workdir, "journal.jsonl"), journal_fsync="interval")
+        service.open_wallet("shopper", 10 ** 6)
+        try:
+            for mode, clip_name in runs:
+                batch = mode == "batch"
+                frames = clips[clip_name]
+                decode = make_decoder(args.decoder, symbology="qr", multi=batch)
+                if not batch:
+                    decode = RegionDecoder(decode)
+                lane = Lane(service, "shopper")
+                cpu = run(frames, decode, batch, lane)
+                counted = lane.counted()
+                correct = sum((counted & expected).values())
+                exact = counted == expected
+                seconds = len(frames) / FPS
+                rates[mode, clip_name] = correct / seconds
+                print(f"{mode:>6} on {clip_name:<13}: {correct:>4}/{items} items counted "
+                      f"({'exact' if exact else 'WRONG'}), {correct / seconds:5.2f} items/s, "
+                      f"decode CPU {cpu:5.2f} s, {lane.calls} checkout calls in {lane.seconds * 1000:6.1f} ms")
+                if clip_name == "one at a time" or batch:
+                    ok &= exact
+        finally:
+            service.close()
+    gain = rates["batch", "whole basket"] / rates["single", "one at a time"]
+    print(f"batch scanning the whole basket: {gain:.1f}x the items per second of scanning one at a time")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measures catalog bulk-load time and lookup latency at several catalog sizes.
+
+Run from the repository root:
+    python -m benchmarks.bench_catalog --sizes 1000 100000 1000000
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+from catalog import Catalog
+
+
+def write_price_file(path, size):
+    """Writes a synthetic CSV price file with the given number of SKUs."""
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["product_id", "ean", "name", "price", "category", "stock"])
+        for i in range(size):
+            writer.writerow([f"sku{i:07d}", f"{i:013d}", f"Product {i}", f"{(i % 5000) / 100 + 0.99:.2f}",
+                             f"category{i % 50}", i % 100])
+
+
+def percentile(samples, pct):
+    """Returns the given percentile of a sorted list of samples."""
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def time_lookups(catalog, codes):
+    """Returns sorted per-lookup latencies in microseconds."""
+    samples = []
+    for code in codes:
+        start = time.perf_counter()
+        catalog.lookup(code)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return samples
+
+
+def run(size, lookups, workdir):
+    """Loads a catalog of the given size and prints cold and cached lookup latency."""
+    csv_path = os.path.join(workdir, f"prices_{size}.csv")
+    db_path = os.path.join(workdir, f"catalog_{size}.db")
+    write_price_file(csv_path, size)
+
+    catalog = Catalog(db_path, cache_size=lookups, seed_defaults=False)
+    start = time.perf_counter()
+    catalog.load_csv(csv_path)
+    load_seconds = time.perf_counter() - start
+
+    rng = random.Random(size)
+    ids = [f"sku{rng.randrange(size):07d}" for _ in range(lookups // 2)]
+    eans = [f"{rng.randrange(size):013d}" for _ in range(lookups - len(ids))]
+    codes = ids + eans
+    rng.shuffle(codes)
+
+    catalog.clear_cache()
+    cold = time_lookups(catalog, codes)
+    cached = time_lookups(catalog, codes)
+    catalog.close()
+
+    print(f"{size:>9} SKUs  load {load_seconds:7.2f}s ({size / load_seconds:9.0f} rows/s)  "
+          f"cold p50 {percentile(cold, 50):6.1f}us p99 {percentile(cold, 99):6.1f}us  "
+          f"cached p50 {percentile(cached, 50):5.1f}us p99 {percentile(cached, 99):5.1f}us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            run(size, args.lookups, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Stress test: many concurrent checkout lanes reserving, committing and releasing stock in one store.
+
+Each lane fills baskets of one to four lines, mixing a few scarce "hot"
+products that sell out with plentiful ones, then pays for the basket
+(commit) or abandons it (release). Lanes are threads sharing one
+InventoryService, spread over --processes processes that each have their
+own service on the same database. After every run the stock is checked:
+no product may go below zero, and each product's final stock must equal
+its starting stock minus exactly the units that were committed.
+
+Run from the repository root:
+    python -m benchmarks.bench_checkout_lanes --lanes 1 4 16 64 --processes 1 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from catalog import Catalog
+from inventory import InventoryService
+
+
+def make_store(path, skus, hot, hot_stock, stock):
+    """Creates a catalog with the given number of products; the first hot ones are scarce."""
+    catalog = Catalog(path, seed_defaults=False)
+    catalog.upsert_many(
+        {"product_id": f"sku{i:05d}", "name": f"Product {i}", "price": "1.99", "category": "bench",
+         "stock": hot_stock if i < hot else stock}
+        for i in range(skus)
+    )
+    initial = catalog.stock_levels(f"sku{i:05d}" for i in range(skus))
+    catalog.close()
+    return initial
+
+
+def lane(service, baskets, skus, hot, seed, results):
+    """Runs one checkout lane and appends (committed units, latencies, declined lines) to results."""
+    rng = random.Random(seed)
+    committed = Counter()
+    latencies = []
+    declined = 0
+    for _ in range(baskets):
+        basket_id = uuid.uuid4().hex
+        held = []
+        for _ in range(rng.randint(1, 4)):
+            index = rng.randrange(hot) if rng.random() < 0.3 else rng.randrange(hot, skus)
+            product_id = f"sku{index:05d}"
+            quantity = rng.randint(1, 3)
+            line_id = uuid.uuid4().hex
+            start = time.perf_counter()
+            ok = service.reserve(line_id, product_id, quantity, basket_id)
+            latencies.append(time.perf_counter() - start)
+            if ok:
+                held.append((line_id, product_id, quantity))
+            else:
+                declined += 1
+        pay = rng.random() < 0.8
+        for line_id, product_id, quantity in held:
+            start = time.perf_counter()
+            if pay:
+                service.commit(line_id)
+                committed[product_id] += quantity
+            else:
+                service.release(line_id)
+            latencies.append(time.perf_counter() - start)
+    results.append((committed, latencies, declined))
+
+
+def run_process(path, lanes, baskets, skus, hot, seed, queue=None):
+    """Runs lanes as threads against one InventoryService and returns or queues the combined results."""
+    service = InventoryService(path)
+    results = []
+    threads = [threading.Thread(target=lane, args=(service, baskets, skus, hot, seed * 1000 + i, results))
+               for i in range(lanes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    service.close()
+    committed = Counter()
+    latencies = []
+    declined = 0
+    for lane_committed, lane_latencies, lane_declined in results:
+        committed.update(lane_committed)
+        latencies += lane_latencies
+        declined += lane_declined
+    result = (dict(committed), latencies, declined)
+    if queue is not None:
+        queue.put(result)
+    return result
+
+
+def check(path, initial, committed):
+    """Returns a list of stock inconsistencies after a run."""
+    conn = sqlite3.connect(path)
+    problems = []
+    for product_id, stock in conn.execute("SELECT product_id, stock FROM products"):
+        expected = initial[product_id] - committed.get(product_id, 0)
+        if stock < 0:
+            problems.append(f"{product_id} oversold: stock {stock}")
+        elif stock != expected:
+            problems.append(f"{product_id} stock {stock}, expected {expected}")
+    held = conn.execute("SELECT COUNT(*) FROM reservations WHERE status = 'held'").fetchone()[0]
+    if held:
+        problems.append(f"{held} lines still held")
+    conn.close()
+    return problems
+
+
+def run(lanes, processes, baskets, skus, hot, hot_stock, stock, workdir, seed):
+    """Runs one configuration on a fresh store and prints throughput, latency and the consistency check."""
+    path = os.path.join(workdir, f"store_{lanes}_{processes}.db")
+    initial = make_store(path, skus, hot, hot_stock, stock)
+    per_process = max(1, lanes // processes)
+    start = time.perf_counter()
+    if processes == 1:
+        outcomes = [run_process(path, per_process, baskets, skus, hot, seed)]
+    else:
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=run_process,
+                                           args=(path, per_process, baskets, skus, hot, seed + p, queue))
+                   for p in range(processes)]
+        for worker in workers:
+            worker.start()
+        outcomes = [queue.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    elapsed = time.perf_counter() - start
+
+    committed = Counter()
+    latencies = []
+    declined = 0
+    for process_committed, process_latencies, process_declined in outcomes:
+        committed.update(process_committed)
+        latencies += process_latencies
+        declined += process_declined
+    latencies.sort()
+    problems = check(path, initial, committed)
+    hot_left = sum(initial[f"sku{i:05d}"] - committed.get(f"sku{i:05d}", 0) for i in range(hot))
+    print(f"{per_process * processes:>5} lanes x {processes} proc  {len(latencies) / elapsed:>9,.0f} ops/s  "
+          f"p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms  p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms  "
+          f"declined {declined:>5}  hot stock left {hot_left:>3}  "
+          f"{'OK' if not problems else 'FAILED: ' + '; '.join(problems[:3])}")
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lanes", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--baskets", type=int, default=100, help="baskets per lane")
+    parser.add_argument("--skus", type=int, default=500)
+    parser.add_argument("--hot", type=int, default=5, help="scarce products that sell out")
+    parser.add_argument("--hot-stock", type=int, default=40)
+    parser.add_argument("--stock", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as workdir:
+        for processes in args.processes:
+            for lanes in args.lanes:
+                if lanes >= processes:
+                    ok &= run(lanes, processes, args.baskets, args.skus, args.hot, args.hot_stock, args.stock,
+                              workdir, args.seed)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Load test: hundreds of simulated shoppers checking out against one local checkout server.
+
+The server runs in its own process on a fresh store. Each shopper is a
+coroutine with one kept-alive connection that repeatedly opens a basket,
+adds three to six products and pays. With --pipeline the adds and the
+payment are sent in one write; otherwise each request waits for the
+previous answer. Requests per second and latency percentiles are
+reported for each shopper count, where a pipelined request's latency is
+the round trip of its whole batch. Afterwards the retailer wallet must
+hold exactly what the shoppers were charged.
+
+Run from the repository root:
+    python -m benchmarks.bench_checkout_server --shoppers 50 200 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from catalog import Catalog
+from checkout_client import AsyncCheckoutClient
+from wallet import WalletStore
+
+STARTING_BALANCE = 1000000
+
+
+def make_store(workdir, skus):
+    """Creates a catalog with plenty of stock and returns its path."""
+    path = os.path.join(workdir, "catalog.db")
+    catalog = Catalog(path, seed_defaults=False)
+    catalog.upsert_many({"product_id": f"sku{i:05d}", "name": f"Product {i}", "price": f"{1 + i % 20}.99",
+                         "category": f"cat{i % 10}", "stock": 10 ** 9} for i in range(skus))
+    catalog.close()
+    return path
+
+
+def make_wallets(workdir, shoppers):
+    """Opens a funded wallet for each of shoppers customers, since the server does not create them."""
+    store = WalletStore(os.path.join(workdir, "wallets.db"))
+    for i in range(shoppers):
+        store.open_wallet(f"shopper{i}", STARTING_BALANCE)
+    store.close()
+
+
+def start_server(workdir, catalog_path, workers, pool_size, fsync):
+    """Starts the checkout server in a subprocess and returns (process, address)."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "checkout_server", "--port", "0", "--workers", str(workers),
+         "--pool-size", str(pool_size), "--fsync", fsync, "--catalog", catalog_path,
+         "--wallets", os.path.join(workdir, "wallets.db"), "--journal", os.path.join(workdir, "transactions.jsonl")],
+        stdout=subprocess.PIPE, text=True, cwd=os.getcwd(),
+    )
+    line = process.stdout.readline()
+    if not line.startswith("Checkout server listening on"):
+        process.kill()
+        raise SystemExit(f"Checkout server did not start: {line!r}")
+    return process, line.rsplit(" ", 1)[1].strip()
+
+
+async def shopper(address, customer_id, skus, deadline, pipeline, rng, stats):
+    """Checks out baskets until the deadline, recording request latencies and charged cents."""
+    client = AsyncCheckoutClient(address)
+    await client.connect()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        basket = await client.open_basket(customer_id)
+        stats["latencies"].append(time.perf_counter() - start)
+        basket_path = f"/baskets/{basket['basket_id']}"
+        requests = [("POST", basket_path + "/items",
+                     {"code": f"sku{rng.randrange(skus):05d}", "quantity": rng.randint(1, 3)})
+                    for _ in range(rng.randint(3, 6))]
+        requests.append(("POST", basket_path + "/pay", {}))
+        if pipeline:
+            start = time.perf_counter()
+            results = await client.pipeline(requests)
+            elapsed = time.perf_counter() - start
+            stats["latencies"] += [elapsed] * len(requests)
+        else:
+            results = []
+            for request in requests:
+                start = time.perf_counter()
+                results += await client.pipeline([request])
+                stats["latencies"].append(time.perf_counter() - start)
+        payment = results[-1]
+        if isinstance(payment, Exception):
+            stats["errors"] += 1
+        else:
+            stats["charged"] += payment["charged_cents"]
+        stats["baskets"] += 1
+    await client.close()
+
+
+async def run_load(address, shoppers, skus, seconds, pipeline, seed):
+    """Runs shoppers concurrently for seconds and returns their combined stats."""
+    stats = {"latencies": [], "charged": 0, "errors": 0, "baskets": 0}
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(shopper(address, f"shopper{i}", skus, deadline, pipeline,
+                                   random.Random(seed * 100000 + i), stats) for i in range(shoppers)))
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
+
+
+async def retailer_balance(address):
+    """Returns the retailer wallet balance in cents."""
+    client = AsyncCheckoutClient(address)
+    await client.connect()
+    balance = (await client.wallet("retailer"))["balance_cents"]
+    await client.close()
+    return balance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shoppers", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--skus", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=64, help="server threads")
+    parser.add_argument("--pool-size", type=int, default=8, help="server catalog connections")
+    parser.add_argument("--fsync", default="interval", help="server journal fsync policy")
+    parser.add_argument("--no-pipeline", action="store_true", help="only run without pipelining")
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as workdir:
+        catalog_path = make_store(workdir, args.skus)
+        make_wallets(workdir, max(args.shoppers))
+        process, address = start_server(workdir, catalog_path, args.workers, args.pool_size, args.fsync)
+        try:
+            charged = 0
+            seed = 0
+            for pipeline in ([False] if args.no_pipeline else [False, True]):
+                for shoppers in args.shoppers:
+                    seed += 1
+                    stats = asyncio.run(run_load(address, shoppers, args.skus, args.seconds, pipeline, seed))
+                    charged += stats["charged"]
+                    latencies = sorted(stats["latencies"])
+                    print(f"{shoppers:>5} shoppers {'pipelined' if pipeline else 'one by one':>10}  "
+                          f"{len(latencies) / stats['elapsed']:>8,.0f} req/s  "
+                          f"{stats['baskets'] / stats['elapsed']:>7,.0f} baskets/s  "
+                          f"p50 {latencies[len(latencies) // 2] * 1000:6.1f} ms  "
+                          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms  errors {stats['errors']}")
+                    ok &= stats["errors"] == 0
+            balance = asyncio.run(retailer_balance(address))
+            print(f"retailer wallet {balance / 100:,.2f}, shoppers charged {charged / 100:,.2f}: "
+                  f"{'OK' if balance == charged else 'MISMATCH'}")
+            ok &= balance == charged
+        finally:
+            process.terminate()
+            process.wait()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
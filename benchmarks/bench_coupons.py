@@ -0,0 +1,142 @@
+"""Measures promotion index build time and basket evaluation latency with up to 10k active promotions.
+
+Promotions are a mix of percent, fixed and buy-N-get-one-free rules on
+single products and on categories. Each scan adds one unit to a basket,
+as the scanner does, and is timed two ways: through the compiled
+PromotionIndex, which only looks at the promotions for the scanned
+product and its category, and by checking every active promotion, as a
+plain list of rules would. Both must agree on the basket's discount.
+
+Run from the repository root:
+    python -m benchmarks.bench_coupons --promotions 100 1000 10000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from promotions import KINDS, Basket, PromotionStore, line_discount
+
+
+def make_promotions(rng, count, skus, categories):
+    """Returns count random (name, kind, scope, target, value) promotions."""
+    promotions = []
+    for i in range(count):
+        kind = rng.choice(KINDS)
+        if rng.random() < 0.8:
+            scope, target = "sku", f"sku{rng.randrange(skus):06d}"
+        else:
+            scope, target = "category", f"cat{rng.randrange(categories):03d}"
+        value = {"percent": rng.randint(5, 50), "fixed": rng.randint(10, 300), "bogo": rng.randint(1, 3)}[kind]
+        promotions.append((f"Promo {i}", kind, scope, target, value))
+    return promotions
+
+
+def make_products(skus, categories):
+    """Returns catalog-like product dictionaries."""
+    return [{"product_id": f"sku{i:06d}", "name": f"Product {i}", "price_cents": 99 + (i % 50) * 100,
+             "category": f"cat{i % categories:03d}"} for i in range(skus)]
+
+
+# Scans every active promotion for each line, as a plain list of rules would
+class NaiveBasket:
+    def __init__(self, promotions):
+        """Initializes an empty basket priced against a list of Promotions."""
+        self.promotions = promotions
+        self.lines = {}
+        self.discount_cents = 0
+
+    def add(self, product, quantity=1):
+        """Adds units of a product and re-prices every line against every promotion."""
+        line = self.lines.setdefault(product["product_id"], [product, 0])
+        line[1] += quantity
+        self.discount_cents = 0
+        for product, quantity in self.lines.values():
+            best = 0
+            for promotion in self.promotions:
+                target = product["product_id"] if promotion.scope == "sku" else product["category"]
+                if promotion.target == target:
+                    best = max(best, line_discount(promotion, product["price_cents"], quantity))
+            self.discount_cents += best
+
+
+def percentile(samples, fraction):
+    """Returns the sample at the given fraction of the sorted samples."""
+    return sorted(samples)[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def run(count, skus, categories, baskets, basket_size, naive_baskets, workdir, seed):
+    """Times index build and scans for one promotion count and prints the results."""
+    rng = random.Random(seed)
+    products = make_products(skus, categories)
+    # Most scans are for products that have a promotion, the case that does the most work
+    promoted = make_promotions(rng, count, skus, categories)
+    hot = [products[int(target[3:])] for _, _, scope, target, _ in promoted if scope == "sku"]
+
+    store = PromotionStore(os.path.join(workdir, f"promotions_{count}.db"))
+    start = time.perf_counter()
+    store.add_many(promoted)
+    insert_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    index = store.index()
+    build_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for _ in range(1000):
+        store.index()
+    check_us = (time.perf_counter() - start) * 1000
+
+    scans = [[rng.choice(hot) if hot and rng.random() < 0.7 else rng.choice(products) for _ in range(basket_size)]
+             for _ in range(baskets)]
+    latencies = []
+    totals = []
+    for basket_scans in scans:
+        basket = Basket(index)
+        for product in basket_scans:
+            start = time.perf_counter()
+            basket.add(product)
+            latencies.append(time.perf_counter() - start)
+        totals.append(basket.discount_cents)
+
+    naive_latencies = []
+    agree = True
+    active = store.active()
+    for basket_scans, total in zip(scans[:naive_baskets], totals):
+        basket = NaiveBasket(active)
+        for product in basket_scans:
+            start = time.perf_counter()
+            basket.add(product)
+            naive_latencies.append(time.perf_counter() - start)
+        agree &= basket.discount_cents == total
+    store.close()
+
+    print(f"{count:>7,} promotions  insert {insert_ms:7.1f} ms  build {build_ms:6.1f} ms  "
+          f"up-to-date check {check_us:5.1f} us  "
+          f"scan p50 {percentile(latencies, 0.5) * 1e6:5.1f} us  p99 {percentile(latencies, 0.99) * 1e6:6.1f} us  "
+          f"naive p50 {percentile(naive_latencies, 0.5) * 1e6:9.1f} us  "
+          f"{'OK' if agree else 'MISMATCH'}")
+    return agree
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--promotions", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--skus", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--baskets", type=int, default=1000)
+    parser.add_argument("--basket-size", type=int, default=20, help="scans per basket")
+    parser.add_argument("--naive-baskets", type=int, default=20, help="baskets also priced the naive way")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in args.promotions:
+            ok &= run(count, args.skus, args.categories, args.baskets, args.basket_size, args.naive_baskets,
+                      workdir, args.seed)
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
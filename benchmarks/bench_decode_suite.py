@@ -0,0 +1,268 @@
+"""Offline scanner benchmark over sample images, synthetic variants of them, and recorded video.
+
+Each sample is pasted into a 640x480 camera-sized frame and degraded with
+blur, rotation, glare, scale, offset and noise variants. Every case is
+played as a short stream of frames through the same decode function that
+CameraPreview runs (make_scan_decoder), so region-of-interest fallback and
+adaptive backend selection behave as they do on a handset.
+
+Run from the repository root:
+    python -m benchmarks.bench_decode_suite --json results.json
+    python -m benchmarks.bench_decode_suite --baseline results.json   # exit 1 on regression
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from decode_region import make_scan_decoder
+from decoders import PyzbarDecoder
+
+FRAME_SIZE = (640, 480)
+BACKGROUND = 170
+
+# Payloads of the sample images shipped in the repository
+DEFAULT_MANIFEST = {
+    "product123.png": "product123",
+    "product456.png": "product456",
+    "product789.png": "product789",
+    "product_qr_code.png": "product123",
+}
+
+
+def place(sample, scale=1.0, center=(320, 240)):
+    """Returns a camera-sized frame with the sample at scale times its native size, clipped to fit."""
+    frame = np.full((FRAME_SIZE[1], FRAME_SIZE[0], 3), BACKGROUND, np.uint8)
+    # Native size is the reference: shrinking the sample Code128 labels much below it makes bars sub-pixel
+    factor = min(scale, FRAME_SIZE[0] / sample.shape[1], FRAME_SIZE[1] / sample.shape[0])
+    code = cv2.resize(sample, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+    h, w = code.shape[:2]
+    left = int(np.clip(center[0] - w // 2, 0, FRAME_SIZE[0] - w))
+    top = int(np.clip(center[1] - h // 2, 0, FRAME_SIZE[1] - h))
+    frame[top:top + h, left:left + w] = code
+    return frame
+
+
+def rotate(frame, degrees):
+    """Rotates a frame about its centre, filling the corners with background."""
+    matrix = cv2.getRotationMatrix2D((FRAME_SIZE[0] / 2, FRAME_SIZE[1] / 2), degrees, 1.0)
+    return cv2.warpAffine(frame, matrix, FRAME_SIZE, borderValue=(BACKGROUND,) * 3)
+
+
+def motion_blur(frame, length):
+    """Applies horizontal motion blur of the given length in pixels."""
+    kernel = np.zeros((length, length), np.float32)
+    kernel[length // 2, :] = 1.0 / length
+    return cv2.filter2D(frame, -1, kernel)
+
+
+def glare(frame, strength=200):
+    """Adds a bright specular highlight over part of the code."""
+    yy, xx = np.mgrid[0:FRAME_SIZE[1], 0:FRAME_SIZE[0]]
+    spot = strength * np.exp(-(((xx - 350) / 60.0) ** 2 + ((yy - 220) / 40.0) ** 2))
+    return np.clip(frame.astype(np.float32) + spot[..., None], 0, 255).astype(np.uint8)
+
+
+def noise(frame, sigma, rng):
+    """Adds Gaussian sensor noise."""
+    return np.clip(frame + rng.normal(0, sigma, frame.shape), 0, 255).astype(np.uint8)
+
+
+# Synthetic variants: name -> function from the sample image to a frame
+VARIANTS = {
+    "clean": lambda s, rng: place(s),
+    "blur_3": lambda s, rng: cv2.GaussianBlur(place(s), (3, 3), 0),
+    "blur_7": lambda s, rng: cv2.GaussianBlur(place(s), (7, 7), 0),
+    "motion_9": lambda s, rng: motion_blur(place(s), 9),
+    "rotate_15": lambda s, rng: rotate(place(s), 15),
+    "rotate_45": lambda s, rng: rotate(place(s), 45),
+    "rotate_180": lambda s, rng: rotate(place(s), 180),
+    "glare": lambda s, rng: glare(place(s)),
+    "scale_75": lambda s, rng: place(s, 0.75),
+    "scale_125": lambda s, rng: place(s, 1.25),
+    "off_center": lambda s, rng: place(s, 0.8, center=(120, 100)),
+    "noise_15": lambda s, rng: noise(place(s), 15, rng),
+}
+
+
+def image_cases(folder, manifest, variants, frames, seed):
+    """Yields (name, variant, expected payload, frames) for every sample image and variant."""
+    rng = np.random.default_rng(seed)
+    paths = sorted(glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.jpg")))
+    for path in paths:
+        name = os.path.basename(path)
+        sample = cv2.imread(path)
+        if sample is None:
+            continue
+        expected = manifest.get(name, os.path.splitext(name)[0])
+        for variant in variants:
+            base = VARIANTS[variant](sample, rng)
+            # Slight per-frame sensor noise so consecutive frames are not identical
+            stream = [noise(base, 2, rng) for _ in range(frames)]
+            yield name, variant, expected, stream
+
+
+def video_cases(paths, payload, max_frames):
+    """Yields one case per recorded video, all expected to contain the given payload."""
+    for path in paths:
+        capture = cv2.VideoCapture(path)
+        stream = []
+        while len(stream) < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            stream.append(frame)
+        capture.release()
+        yield os.path.basename(path), "recorded", payload, stream
+
+
+def run_case(decode_fn, expected, stream):
+    """Decodes a stream of frames and returns per-frame latencies and outcomes."""
+    latencies = []
+    correct = 0
+    misreads = 0
+    first_frame = None
+    first_ms = None
+    elapsed = 0.0
+    for index, frame in enumerate(stream):
+        start = time.perf_counter()
+        results = decode_fn(frame)
+        ms = (time.perf_counter() - start) * 1000
+        latencies.append(ms)
+        elapsed += ms
+        payloads = {obj.data.decode("utf-8", "replace") for obj in results}
+        if expected in payloads:
+            correct += 1
+            if first_frame is None:
+                first_frame, first_ms = index + 1, elapsed
+        elif payloads:
+            misreads += 1
+    return {"latencies": latencies, "correct": correct, "misreads": misreads,
+            "first_frame": first_frame, "first_ms": first_ms}
+
+
+def percentile(values, pct):
+    """Returns the given percentile of a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(cases):
+    """Aggregates case results into throughput, latency, time-to-first-decode and accuracy figures."""
+    latencies = [ms for case in cases for ms in case["latencies"]]
+    frames = len(latencies)
+    decoded_cases = [case for case in cases if case["first_frame"] is not None]
+    return {
+        "cases": len(cases),
+        "frames": frames,
+        "throughput_fps": frames / (sum(latencies) / 1000) if latencies and sum(latencies) else 0.0,
+        "latency_ms": {"mean": sum(latencies) / frames if frames else None,
+                       "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                       "p99": percentile(latencies, 99)},
+        "frame_accuracy": sum(case["correct"] for case in cases) / frames if frames else 0.0,
+        "case_success": len(decoded_cases) / len(cases) if cases else 0.0,
+        "misreads": sum(case["misreads"] for case in cases),
+        "time_to_first_decode": {
+            "frames_mean": (sum(c["first_frame"] for c in decoded_cases) / len(decoded_cases)
+                            if decoded_cases else None),
+            "ms_mean": sum(c["first_ms"] for c in decoded_cases) / len(decoded_cases) if decoded_cases else None,
+            "ms_p95": percentile([c["first_ms"] for c in decoded_cases], 95),
+        },
+    }
+
+
+def regressions(current, baseline, latency_tolerance, accuracy_tolerance):
+    """Returns descriptions of the ways current is worse than baseline."""
+    problems = []
+    for key in ("frame_accuracy", "case_success"):
+        if current[key] < baseline[key] - accuracy_tolerance:
+            problems.append(f"{key} fell from {baseline[key]:.3f} to {current[key]:.3f}")
+    for key in ("p95", "p99"):
+        old, new = baseline["latency_ms"][key], current["latency_ms"][key]
+        if old and new and new > old * (1 + latency_tolerance):
+            problems.append(f"{key} latency rose from {old:.2f} ms to {new:.2f} ms")
+    if current["throughput_fps"] < baseline["throughput_fps"] * (1 - latency_tolerance):
+        problems.append(f"throughput fell from {baseline['throughput_fps']:.1f} to {current['throughput_fps']:.1f} fps")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", default=".", help="folder of sample images")
+    parser.add_argument("--manifest", help="JSON file mapping image file names to expected payloads")
+    parser.add_argument("--video", nargs="*", default=[], help="recorded scanner videos")
+    parser.add_argument("--video-payload", default="product123", help="payload expected in the videos")
+    parser.add_argument("--variants", nargs="+", choices=sorted(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--frames", type=int, default=15, help="frames per synthetic case")
+    parser.add_argument("--decoder", default="pyzbar" if PyzbarDecoder.available() else "auto")
+    parser.add_argument("--symbology", choices=("qr", "product", "label", "all"), default="all")
+    parser.add_argument("--decode-mode", choices=("roi", "full"), default="roi")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="write machine-readable results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--latency-tolerance", type=float, default=0.2)
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.02)
+    args = parser.parse_args()
+
+    manifest = dict(DEFAULT_MANIFEST)
+    if args.manifest:
+        with open(args.manifest) as file:
+            manifest.update(json.load(file))
+    symbology = None if args.symbology == "all" else args.symbology
+
+    results = []
+    by_variant = {}
+    cases = list(image_cases(args.images, manifest, args.variants, args.frames, args.seed))
+    cases += list(video_cases(args.video, args.video_payload, 900))
+    for name, variant, expected, stream in cases:
+        # A fresh decoder per case, as when the scanner screen is opened
+        decode_fn = make_scan_decoder(args.decoder, symbology, args.decode_mode)
+        result = run_case(decode_fn, expected, stream)
+        result.update({"image": name, "variant": variant, "expected": expected})
+        results.append(result)
+        by_variant.setdefault(variant, []).append(result)
+
+    summary = summarize(results)
+    variants = {variant: summarize(group) for variant, group in by_variant.items()}
+
+    print(f"decoder {args.decoder}, mode {args.decode_mode}, {summary['cases']} cases, {summary['frames']} frames")
+    print(f"{'variant':<12} {'success':>8} {'accuracy':>9} {'p50 ms':>8} {'p95 ms':>8} {'TTFD frames':>12}")
+    for variant, stats in sorted(variants.items()) + [("ALL", summary)]:
+        ttfd = stats["time_to_first_decode"]["frames_mean"]
+        print(f"{variant:<12} {stats['case_success']:>8.0%} {stats['frame_accuracy']:>9.0%} "
+              f"{stats['latency_ms']['p50']:>8.2f} {stats['latency_ms']['p95']:>8.2f} "
+              f"{ttfd if ttfd is None else round(ttfd, 1)!s:>12}")
+    print(f"throughput {summary['throughput_fps']:.1f} frames/s, p99 {summary['latency_ms']['p99']:.2f} ms, "
+          f"misreads {summary['misreads']}")
+
+    report = {
+        "config": {"decoder": args.decoder, "decode_mode": args.decode_mode, "symbology": args.symbology,
+                   "frames_per_case": args.frames, "variants": args.variants, "seed": args.seed},
+        "summary": summary,
+        "variants": variants,
+        "cases": [{k: v for k, v in result.items() if k != "latencies"} for result in results],
+    }
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        problems = regressions(summary, baseline["summary"], args.latency_tolerance, args.accuracy_tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
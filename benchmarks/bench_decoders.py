@@ -0,0 +1,69 @@
+"""Reports decode rate and milliseconds per frame for every installed decoder backend.
+
+Each image in the folder is decoded --repeat times per backend, once as a
+BGR frame and once through RegionDecoder's grayscale conversion (with the
+region covering the whole image, since sample images are not camera frames).
+
+Run from the repository root:
+    python -m benchmarks.bench_decoders --images . --symbology product
+"""
+import argparse
+import glob
+import os
+import time
+
+import cv2
+
+from decode_region import RegionDecoder
+from decoders import AdaptiveDecoder, available_backends
+
+
+def load_images(folder):
+    """Returns (name, BGR image) pairs for the PNG and JPEG files in a folder."""
+    paths = sorted(glob.glob(os.path.join(folder, "*.png")) + glob.glob(os.path.join(folder, "*.jpg")))
+    return [(os.path.basename(path), cv2.imread(path)) for path in paths]
+
+
+def run(name, decode, images, repeat):
+    """Decodes every image repeat times and prints the decode rate and latency."""
+    samples = []
+    found = 0
+    for _ in range(repeat):
+        for _, image in images:
+            start = time.perf_counter()
+            results = decode(image)
+            samples.append((time.perf_counter() - start) * 1000)
+            found += bool(results)
+    samples.sort()
+    frames = len(samples)
+    print(f"  {name:<24} decode rate {found / frames:6.1%}   "
+          f"mean {sum(samples) / frames:7.2f} ms   p95 {samples[int(frames * 0.95)]:7.2f} ms/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", default=".", help="folder of sample images")
+    parser.add_argument("--symbology", choices=("qr", "product", "label", "all"), default="all")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    images = [(name, image) for name, image in load_images(args.images) if image is not None]
+    if not images:
+        raise SystemExit(f"No images found in {args.images}")
+    symbology = None if args.symbology == "all" else args.symbology
+    backends = available_backends(symbology)
+    print(f"{len(images)} images, symbology {args.symbology}, backends: {', '.join(b.name for b in backends)}")
+
+    whole_image = (0, 0, 1 << 16, 1 << 16)
+    for label, wrap in (("BGR", lambda decode: decode),
+                        ("grayscale", lambda decode: RegionDecoder(decode, box=whole_image))):
+        print(label)
+        for backend in backends:
+            run(backend.name, wrap(backend), images, args.repeat)
+        adaptive = AdaptiveDecoder(available_backends(symbology))
+        run("auto", wrap(adaptive), images, args.repeat)
+        print(f"  auto settled on {adaptive.best().name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Measures how much decoding the frame-quality gate saves on a scanner left idling, and what it costs scans.
+
+A synthetic 30 fps clip repeats --cycles times: the camera looks at an
+empty counter for --idle seconds, then a product with the sample QR code
+is swept into the guide box with motion blur, held still for a second
+and swept out again. Every frame carries sensor noise. The clip is
+decoded once without the gate and once with it, on a simulated clock,
+comparing decoder calls, CPU time and how many frames after a product
+enters the view its code is first read.
+
+Run from the repository root:
+    python -m benchmarks.bench_frame_gate --cycles 5 --idle 10
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from decode_region import RegionDecoder
+from decoders import make_decoder
+from frame_gate import FrameGate
+
+FPS = 30
+SIZE = (640, 480)
+CODE_SIZE = 180
+
+
+def make_clip(cycles, idle_seconds, seed):
+    """Returns (frames, entries): the clip and the index of each frame where a product starts entering."""
+    rng = np.random.default_rng(seed)
+    code = cv2.resize(cv2.imread("product_qr_code.png"), (CODE_SIZE, CODE_SIZE), interpolation=cv2.INTER_AREA)
+    counter = cv2.GaussianBlur(rng.integers(120, 200, (SIZE[1], SIZE[0], 3), dtype=np.uint8), (31, 31), 0)
+    target_x, target_y = 230, 150
+    frames = []
+    entries = []
+
+    def noisy(frame):
+        return cv2.add(frame, rng.normal(0, 2, frame.shape).astype(np.int8), dtype=cv2.CV_8U)
+
+    def with_code(x, blur):
+        frame = counter.copy()
+        left, right = max(0, x), min(SIZE[0], x + CODE_SIZE)
+        if right > left:
+            frame[target_y:target_y + CODE_SIZE, left:right] = code[:, left - x:right - x]
+        if blur > 1:
+            frame = cv2.blur(frame, (blur, 1))
+        return noisy(frame)
+
+    for _ in range(cycles):
+        frames += [noisy(counter) for _ in range(int(idle_seconds * FPS))]
+        entries.append(len(frames))
+        # Swept in over half a second, slowing down (and sharpening) as it reaches the guide box
+        sweep = 15
+        for i in range(sweep):
+            progress = 1 - (1 - (i + 1) / sweep) ** 2
+            speed = int(2 * (target_x + CODE_SIZE) / sweep * (1 - i / sweep)) + 1
+            frames.append(with_code(int(-CODE_SIZE + progress * (target_x + CODE_SIZE)), speed))
+        frames += [with_code(target_x, 1) for _ in range(FPS)]
+        for i in range(sweep):
+            frames.append(with_code(target_x + (i + 1) * 30, 30))
+    frames += [noisy(counter) for _ in range(int(idle_seconds * FPS))]
+    return frames, entries
+
+
+def run(frames, entries, decode, gate):
+    """Decodes the clip, through the gate if there is one, and returns the measurements."""
+    clock = [0.0]
+    if gate is not None:
+        gate.clock = lambda: clock[0]
+    decoded = 0
+    hit_frames = []
+    cpu = time.process_time()
+    for index, frame in enumerate(frames):
+        clock[0] = index / FPS
+        if gate is not None and not gate.admit(frame):
+            continue
+        decoded += 1
+        try:
+            found = decode(frame)
+        except cv2.error:
+            # The decode worker treats a backend error as a frame without a code
+            found = None
+        if found:
+            hit_frames.append(index)
+    cpu = time.process_time() - cpu
+    latencies = []
+    for entry in entries:
+        hits = [index - entry for index in hit_frames if index >= entry]
+        latencies.append(hits[0] if hits and hits[0] < 2 * FPS else None)
+    return {"decoded": decoded, "cpu": cpu, "latencies": latencies}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--idle", type=float, default=10.0, help="seconds of empty counter between products")
+    parser.add_argument("--decoder", default="auto", help="decoder backend name, or auto")
+    parser.add_argument("--motion-threshold", type=float, default=None)
+    parser.add_argument("--blur-threshold", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    frames, entries = make_clip(args.cycles, args.idle, args.seed)
+    seconds = len(frames) / FPS
+    print(f"clip: {len(frames):,} frames ({seconds:.0f} s at {FPS} fps), {len(entries)} products")
+
+    gate_options = {name: value for name, value in (("motion_threshold", args.motion_threshold),
+                                                      ("blur_threshold", args.blur_threshold)) if value is not None}
+    ok = True
+    results = {}
+    for label, gate in (("every frame", None), ("gated", FrameGate(**gate_options))):
+        decode = RegionDecoder(make_decoder(args.decoder, symbology="qr"))
+        result = results[label] = run(frames, entries, decode, gate)
+        latencies = result["latencies"]
+        read = [latency for latency in latencies if latency is not None]
+        print(f"{label:>12}: {result['decoded']:>6,} decodes ({result['decoded'] / seconds:5.1f}/s), "
+              f"CPU {result['cpu']:6.2f} s ({result['cpu'] / seconds * 100:4.1f}% of one core), "
+              f"{len(read)}/{len(latencies)} products read, first read after "
+              f"{max(read) if read else '-'} frames at worst")
+        if gate is not None:
+            stats = gate.stats()
+            print(f"{'':>12}  skip ratio {stats['skip_ratio']:.1%} ({stats['skipped_static']:,} static, "
+                  f"{stats['skipped_blurry']:,} blurry), thresholds motion {stats['motion_threshold']} "
+                  f"blur {stats['blur_threshold']}")
+        ok &= len(read) == len(latencies)
+    saved = 1 - results["gated"]["cpu"] / results["every frame"]["cpu"]
+    print(f"CPU saved by the gate: {saved:.0%}")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
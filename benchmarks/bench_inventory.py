@@ -0,0 +1,90 @@
+"""Measures inventory list frame time and memory while scrolling catalogs of increasing size.
+
+The retailer's InventoryList binds a fixed pool of rows to
+InventoryListModel.rows() on every scroll step; this replays smooth
+scrolling at the top, middle and end of the list plus random scrollbar
+jumps, and times each frame's model work. Memory is the peak traced
+allocation while scrolling, which should not grow with the catalog.
+Search, filter and stock-refresh latency are reported too.
+
+Run from the repository root:
+    python -m benchmarks.bench_inventory --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_catalog import percentile, write_price_file
+from catalog import Catalog
+from inventory_list import InventoryListModel
+
+
+def timed(fn, *args):
+    """Returns fn's result and how long it took in milliseconds."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def scroll_positions(count, visible, frames, jumps, rng):
+    """Returns the first visible row for each frame of a scrolling session."""
+    last = max(count - visible, 0)
+    positions = []
+    # Flicks at the top, middle and end of the list, moving about two rows per frame
+    for start in (0, last // 2, max(last - frames * 2, 0)):
+        positions += [min(start + i * 2, last) for i in range(frames)]
+    positions += [rng.randint(0, last) for _ in range(jumps)]
+    return positions
+
+
+def run(size, visible, frames, jumps, workdir, rng):
+    """Builds a catalog of the given size and prints scroll, filter and stock-refresh figures."""
+    csv_path = os.path.join(workdir, f"prices_{size}.csv")
+    db_path = os.path.join(workdir, f"catalog_{size}.db")
+    write_price_file(csv_path, size)
+    catalog = Catalog(db_path, seed_defaults=False)
+    catalog.load_csv(csv_path)
+    model = InventoryListModel(catalog)
+
+    positions = scroll_positions(model.count(), visible, frames, jumps, rng)
+    tracemalloc.start()
+    samples = []
+    for first in positions:
+        _, ms = timed(model.rows, first, visible)
+        samples.append(ms)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples.sort()
+
+    _, search_ms = timed(lambda: (model.set_filter(search="Product 4242"), model.rows(0, visible)))
+    _, filter_ms = timed(lambda: (model.set_filter(category="category7", max_stock=5), model.rows(0, visible)))
+    model.set_filter()
+    model.rows(positions[-1], visible)
+    _, refresh_ms = timed(model.refresh_stock, positions[-1], visible)
+
+    print(f"{size:>9,} items  frame p50 {percentile(samples, 50):6.3f} ms  p99 {percentile(samples, 99):6.3f} ms  "
+          f"max {samples[-1]:6.2f} ms  peak {peak / 1024:7.1f} KiB  "
+          f"search {search_ms:6.1f} ms  filter {filter_ms:6.1f} ms  stock refresh {refresh_ms:5.2f} ms")
+    catalog.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--visible", type=int, default=17, help="rows on screen, plus the two spare pooled rows")
+    parser.add_argument("--frames", type=int, default=600, help="frames per flick")
+    parser.add_argument("--jumps", type=int, default=200, help="random scrollbar jumps")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            run(size, args.visible, args.frames, args.jumps, workdir, rng)
+
+
+if __name__ == "__main__":
+    main()
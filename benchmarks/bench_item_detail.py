@@ -0,0 +1,163 @@
+"""Measures widgets kept alive and scan-to-screen latency over a long run of item detail scans, rebuilt versus pooled.
+
+Runs Customer_app's item detail flow without a camera: every scan opens
+the item detail screen for a product, as process_barcode_data does, and
+two in three are paid for while the rest are closed. The "rebuilt" run
+opens each scan the way the app used to, constructing a new
+ItemDetailScreen and adding it to the ScreenManager, and removes it only
+when it is closed; the "pooled" run goes through
+MainApp.open_item_detail_screen, which rebinds one screen. Every 100
+scans the screens managed and the live widgets are counted, and at the
+end the traced memory growth and the time from the scan to the screen
+being current are reported. A scan whose screen is not the one the
+ScreenManager shows, as happens once old screens with the same name pile
+up, counts as a stale screen.
+
+Kivy and KivyMD must be installed, and a display available (xvfb-run will do).
+
+Run from the repository root:
+    python -m benchmarks.bench_item_detail --scans 1000
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from catalog import Catalog
+from checkout import CheckoutService
+
+CHECKPOINT = 100
+
+
+def percentile(values, fraction):
+    """Returns the value at a fraction of the way through the sorted values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def live_widgets():
+    """Returns how many Kivy widgets the garbage collector can still reach."""
+    from kivy.uix.widget import Widget
+    gc.collect()
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, Widget))
+
+
+def tree_size(widget):
+    """Returns the number of widgets in a widget tree."""
+    return 1 + sum(tree_size(child) for child in widget.children)
+
+
+def make_app(workdir, catalog_path):
+    """Returns a MainApp set up as build() does, with a stand-in for the camera scanner screen."""
+    from kivy.uix.screenmanager import NoTransition, Screen, ScreenManager
+    from Customer_app import MainApp, MainScreen
+
+    # Stands in for the scanner screen, which would open the camera when shown
+    class ScannerScreen(Screen):
+        def show_payment_success(self):
+            pass
+
+    app = MainApp()
+    app.checkout = CheckoutService(catalog_path, os.path.join(workdir, "wallets.db"),
+                                   os.path.join(workdir, "journal.jsonl"), journal_fsync="interval")
+    app.sync = None
+    app.customer_id = "customer"
+    app.checkout.open_wallet(app.customer_id, initial_balance=10 ** 6)
+    basket = app.checkout.open_basket(app.customer_id)
+    app.basket_id = basket["basket_id"]
+    app.session_id = basket["session_id"]
+    app.use_points = False
+    app.item_screen = None
+    app.sm = ScreenManager(transition=NoTransition())
+    app.sm.add_widget(MainScreen(app=app, name='main'))
+    app.scanner_screen = ScannerScreen(name='scanner')
+    app.sm.add_widget(app.scanner_screen)
+    app.sm.current = 'scanner'
+    return app
+
+
+def run(app, products, scans, pooled):
+    """Scans products in turn and returns the measurements."""
+    from Customer_app import ItemDetailScreen
+
+    latencies = []
+    checkpoints = []
+    stale = 0
+    gc.collect()
+    tracemalloc.start()
+    for i in range(scans):
+        product = products[i % len(products)]
+        start = time.perf_counter()
+        if pooled:
+            app.open_item_detail_screen(product)
+            screen = app.item_screen
+        else:
+            screen = ItemDetailScreen(app=app, product=product, name='item_detail')
+            app.sm.add_widget(screen)
+            app.sm.current = 'item_detail'
+        latencies.append(time.perf_counter() - start)
+        if app.sm.current_screen is not screen:
+            stale += 1
+        if i % 3:
+            screen.handle_payment()
+        else:
+            screen.close_screen()
+            if not pooled:
+                app.sm.remove_widget(screen)
+        if (i + 1) % CHECKPOINT == 0:
+            traced, _ = tracemalloc.get_traced_memory()
+            # The ScreenManager only parents the current screen, so every managed screen is walked
+            checkpoints.append({"scans": i + 1, "screens": len(app.sm.screens),
+                                "tree": sum(tree_size(managed) for managed in app.sm.screens),
+                                "live": live_widgets(), "traced": traced})
+    tracemalloc.stop()
+    return {"latencies": latencies, "checkpoints": checkpoints, "stale": stale}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scans", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=50)
+    args = parser.parse_args()
+
+    # Kivy reads the command line and logs to the console unless told not to
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+
+    ok = True
+    results = {}
+    for label, pooled in (("rebuilt", False), ("pooled", True)):
+        with tempfile.TemporaryDirectory() as workdir:
+            catalog_path = os.path.join(workdir, "catalog.db")
+            catalog = Catalog(catalog_path, seed_defaults=False)
+            catalog.upsert_many({"product_id": f"sku{i:03d}", "name": f"Product {i}", "price": 1.99,
+                                 "category": "grocery", "stock": 10 ** 6} for i in range(args.products))
+            products = [catalog.lookup(f"sku{i:03d}") for i in range(args.products)]
+            catalog.close()
+            app = make_app(workdir, catalog_path)
+            try:
+                result = results[label] = run(app, products, args.scans, pooled)
+            finally:
+                app.checkout.close()
+
+        first, last = result["checkpoints"][0], result["checkpoints"][-1]
+        latencies = result["latencies"]
+        print(f"{label}: after {first['scans']} scans {first['screens']} screens, {first['tree']} widgets on "
+              f"them, {first['live']} live; after {last['scans']} scans {last['screens']} screens, "
+              f"{last['tree']} on them, {last['live']} live")
+        print(f"{'':>{len(label)}}  traced memory grew {(last['traced'] - first['traced']) / 1024:,.0f} KiB "
+              f"between those scans, scan to screen p50 {percentile(latencies, 0.5) * 1000:.2f} ms "
+              f"p95 {percentile(latencies, 0.95) * 1000:.2f} ms, {result['stale']} stale screens shown")
+        if pooled:
+            ok &= last["live"] <= first["live"] and last["screens"] == first["screens"] and not result["stale"]
+
+    speedup = percentile(results["rebuilt"]["latencies"], 0.5) / percentile(results["pooled"]["latencies"], 0.5)
+    print(f"pooled screen opens {speedup:.1f}x faster at the median")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Measures loyalty points accrual cost on the checkout path and replay from the journal.
+
+Payments from --customers customers are journaled, and points for each
+are queued with LoyaltyService.accrue(), timing only the call checkout
+makes. The time for the consumer to apply everything shows batch
+throughput. For comparison, the same payments are also applied the
+straightforward way: one transaction per payment that recomputes the
+customer's balance from their whole history.
+
+The journal is then replayed twice into a fresh database and once more
+into the live one; every balance must match the points the payments
+earned, so duplicates are shown to be ignored.
+
+Run from the repository root:
+    python -m benchmarks.bench_loyalty --payments 100000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+from journal import Journal, new_id
+from loyalty import LoyaltyService, points_for, sale_event_id
+
+
+def percentile(samples, fraction):
+    """Returns the sample at the given fraction of the sorted samples."""
+    return sorted(samples)[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def naive_accrual(path, payments):
+    """Applies payments one transaction each, recomputing the balance from history, and returns the latencies."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+        CREATE TABLE history (event_id TEXT PRIMARY KEY, customer_id TEXT, points INTEGER);
+        CREATE INDEX idx_history_customer ON history (customer_id);
+        CREATE TABLE balances (customer_id TEXT PRIMARY KEY, balance INTEGER);
+    """)
+    latencies = []
+    for event_id, customer_id, paid in payments:
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT OR IGNORE INTO history VALUES (?, ?, ?)", (event_id, customer_id, points_for(paid)))
+        conn.execute("INSERT OR REPLACE INTO balances VALUES (?, (SELECT SUM(points) FROM history WHERE customer_id = ?))",
+                     (customer_id, customer_id))
+        conn.execute("COMMIT")
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    return latencies
+
+
+def balances(service, customers):
+    """Returns {customer_id: points} for every customer."""
+    return {customer_id: service.balance(customer_id) for customer_id in customers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--payments", type=int, default=100000)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--naive-payments", type=int, default=20000, help="payments applied the naive way")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    customers = [f"customer{i:05d}" for i in range(args.customers)]
+    with tempfile.TemporaryDirectory() as workdir:
+        journal_path = os.path.join(workdir, "transactions.jsonl")
+        journal = Journal(journal_path, fsync="never")
+        service = LoyaltyService(os.path.join(workdir, "wallets.db"))
+        expected = Counter()
+        payments = []
+        latencies = []
+        start_all = time.perf_counter()
+        for _ in range(args.payments):
+            customer_id = rng.choice(customers)
+            paid = rng.randint(99, 9999)
+            sale = {"product_id": "sku", "name": "Product", "quantity": 1, "unit_price_cents": paid,
+                    "amount_cents": paid, "customer_id": customer_id, "payment_id": new_id(), "line_id": new_id()}
+            seq = journal.append("sale", **sale)
+            event_id = sale_event_id(seq, sale)
+            start = time.perf_counter()
+            service.accrue(customer_id, event_id, paid)
+            latencies.append(time.perf_counter() - start)
+            expected[customer_id] += points_for(paid)
+            payments.append((event_id, customer_id, paid))
+        queued_seconds = time.perf_counter() - start_all
+        service.flush()
+        applied_seconds = time.perf_counter() - start_all
+        journal.close()
+        live_ok = balances(service, customers) == {c: expected[c] for c in customers}
+        print(f"{args.payments:,} payments: accrue() p50 {percentile(latencies, 0.5) * 1e6:.1f} us, "
+              f"p99 {percentile(latencies, 0.99) * 1e6:.1f} us; all applied after {applied_seconds:.2f} s "
+              f"({args.payments / applied_seconds:,.0f}/s, checkout loop {queued_seconds:.2f} s)  "
+              f"{'OK' if live_ok else 'MISMATCH'}")
+
+        start = time.perf_counter()
+        replayed = service.catch_up(journal_path)
+        live_ok &= balances(service, customers) == {c: expected[c] for c in customers}
+        print(f"replay into the live database: {replayed:,} records in {(time.perf_counter() - start) * 1000:.0f} ms, "
+              f"balances {'unchanged' if live_ok else 'CHANGED'}")
+        service.close()
+
+        fresh = LoyaltyService(os.path.join(workdir, "replayed.db"))
+        start = time.perf_counter()
+        fresh.catch_up(journal_path)
+        replay_seconds = time.perf_counter() - start
+        fresh.catch_up(journal_path, from_start=True)
+        replay_ok = balances(fresh, customers) == {c: expected[c] for c in customers}
+        fresh.close()
+        print(f"replay of {args.payments:,} records into a fresh database: {replay_seconds:.2f} s; "
+              f"balances after replaying twice {'match' if replay_ok else 'DO NOT MATCH'}")
+
+        naive = naive_accrual(os.path.join(workdir, "naive.db"), payments[:args.naive_payments])
+        print(f"naive per-payment transaction with recompute ({len(naive):,} payments): "
+              f"p50 {percentile(naive, 0.5) * 1e6:.1f} us, p99 {percentile(naive, 0.99) * 1e6:.1f} us, "
+              f"last 1,000 p50 {percentile(naive[-1000:], 0.5) * 1e6:.1f} us")
+    if not (live_ok and replay_ok):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Runs the scanner pipeline (capture thread, preview tick, decode worker) against a video file.
+
+Without --video a synthetic clip is generated from product_qr_code.png.
+The preview tick runs on this thread at --fps, like the Kivy clock would.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline --seconds 10
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from capture import CaptureThread
+from decode_region import RegionDecoder
+from decode_worker import DecodeWorker
+from decoders import make_decoder
+from preview import TextureUploader
+
+def make_video(path, frames=150, size=(640, 480)):
+    """Writes a clip of the sample QR code drifting through the guide box."""
+    code = cv2.imread("product_qr_code.png")
+    code = cv2.resize(code, (180, 180))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, size)
+    for i in range(frames):
+        frame = np.full((size[1], size[0], 3), 200, np.uint8)
+        x = 230 + int(40 * np.sin(i / 15))
+        frame[150:330, x - 20:x + 160] = code
+        writer.write(frame)
+    writer.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--video", help="video file to replay instead of the synthetic clip")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--full-frame", action="store_true", help="decode whole frames instead of the guide box")
+    parser.add_argument("--decoder", default="auto", help="decoder backend name, or auto")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        video = args.video
+        if not video:
+            video = os.path.join(workdir, "scanner.avi")
+            make_video(video)
+
+        decode = make_decoder(args.decoder, symbology="qr")
+        decode_fn = decode if args.full_frame else RegionDecoder(decode)
+        hits = []
+        worker = DecodeWorker(decode_fn, hits.append, dispatch=lambda callback, result: callback(result))
+        capture = CaptureThread(video, fps=args.fps)
+        if not capture.start():
+            raise SystemExit(f"Could not open {video}")
+        worker.start()
+
+        uploader = TextureUploader(rotate_180=True)
+        tick_times = []
+        interval = 1.0 / args.fps
+        deadline = time.perf_counter() + args.seconds
+        next_tick = time.perf_counter()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            ok, frame = capture.read()
+            if ok:
+                uploader.prepare(frame)
+                worker.submit(frame)
+            tick_times.append((time.perf_counter() - start) * 1000)
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+        worker.stop()
+        capture.release()
+
+    tick_times.sort()
+    stats = worker.stats.snapshot()
+    print(f"preview ticks {len(tick_times)} ({len(tick_times) / args.seconds:.1f}/s), "
+          f"tick p50 {tick_times[len(tick_times) // 2]:.2f} ms p99 {tick_times[int(len(tick_times) * 0.99)]:.2f} ms")
+    print(f"capture read {capture.frames_read}, overwritten {capture.frames_overwritten}")
+    print(f"frames captured {stats['frames_captured']}, decoded {stats['frames_decoded']}, "
+          f"dropped {stats['frames_dropped']}, with a code {len(hits)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Renders large receipts from a journal and reports time, pages and peak memory.
+
+Run from the repository root:
+    python -m benchmarks.bench_receipts --lines 1000 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from journal import Journal, read_records
+from receipts import ReceiptRenderer
+
+
+def write_journal(path, lines):
+    """Appends the given number of sale records to a fresh journal."""
+    journal = Journal(path, fsync="never")
+    for i in range(lines):
+        unit = 99 + (i % 400)
+        quantity = 1 + i % 3
+        fields = {}
+        if i % 10 == 0:
+            fields = {"coupon": "Coupon 1", "discount_cents": unit // 10}
+        journal.append("sale", product_id=f"sku{i % 5000:07d}", name=f"Product {i % 5000}",
+                       quantity=quantity, unit_price_cents=unit, amount_cents=unit * quantity, **fields)
+    journal.close()
+
+
+def run(lines, workdir):
+    """Renders one receipt of the given length and prints the measurements."""
+    journal_path = os.path.join(workdir, f"journal_{lines}.jsonl")
+    pdf_path = os.path.join(workdir, f"receipt_{lines}.pdf")
+    write_journal(journal_path, lines)
+
+    start = time.perf_counter()
+    summary = ReceiptRenderer(pdf_path).render(read_records(journal_path, "sale"))
+    seconds = time.perf_counter() - start
+
+    # Memory is measured in a second pass because tracing slows rendering down several times
+    tracemalloc.start()
+    ReceiptRenderer(pdf_path).render(read_records(journal_path, "sale"))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{lines:>7} lines  {summary['pages']:>4} pages  {seconds:6.2f}s  "
+          f"peak {peak / 1024 / 1024:6.1f} MiB  ({peak / lines:6.0f} B/line)  "
+          f"pdf {os.path.getsize(pdf_path) / 1024:7.0f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for lines in args.lines:
+            run(lines, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Compares reading one session through the offset index with a full journal scan as the journal grows.
+
+Run from the repository root:
+    python -m benchmarks.bench_sessions --lines 10000 100000 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from journal import Journal, read_records, read_session
+
+SESSION_LINES = 40
+
+
+def fill(journal, lines):
+    """Appends lines sale records spread over sessions of SESSION_LINES records each."""
+    for i in range(lines):
+        if i % SESSION_LINES == 0:
+            journal.start_session()
+        journal.append("sale", product_id=f"sku{i % 5000:07d}", name=f"Product {i % 5000}",
+                       quantity=1, unit_price_cents=199, amount_cents=199)
+
+
+def run(lines, workdir):
+    """Builds a journal of the given size and times one session read both ways."""
+    path = os.path.join(workdir, f"journal_{lines}.jsonl")
+    journal = Journal(path, fsync="never", max_batch=4096)
+    fill(journal, lines)
+    session_id = journal.session_id
+    journal.close()
+
+    start = time.perf_counter()
+    indexed = list(read_session(session_id, path))
+    indexed_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    scanned = [record for record in read_records(path) if record["session_id"] == session_id]
+    scan_ms = (time.perf_counter() - start) * 1000
+
+    assert indexed == scanned
+    print(f"{lines:>9} lines  session of {len(indexed)}  indexed {indexed_ms:7.2f} ms  full scan {scan_ms:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        for lines in args.lines:
+            run(lines, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Measures cold-start import times and time-to-first-frame of the scanner, for tracking per release.
+
+Every measurement runs in a fresh interpreter so nothing is already
+imported. Import times are reported per module together with the heavy
+libraries each import pulled in; the app modules must not load the
+deferred ones (cv2, numpy, pyzbar, reportlab) until they are needed.
+Time-to-first-frame starts the scanner the way the scanner screens do
+(scanner_loader.load_scanner_async) and records when the camera is open,
+when the first frame arrives and when the first code is decoded. Without
+--source a synthetic clip is generated from product_qr_code.png.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --json startup.json
+    python -m benchmarks.bench_startup --baseline startup.json   # exit 1 on regression
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Libraries that should only load when the scanner or a receipt needs them
+DEFERRED = ("cv2", "numpy", "pyzbar", "reportlab")
+HEAVY = DEFERRED + ("kivy", "kivymd")
+
+LIBRARIES = ("cv2", "numpy", "pyzbar.pyzbar", "reportlab.pdfgen.canvas", "kivy", "kivymd.app")
+APP_MODULES = ("main", "Customer_app", "retailer_app", "scanner_loader", "catalog", "journal", "wallet",
+               "receipts", "metrics")
+
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    __import__(sys.argv[1])
+    error = None
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+elapsed = (time.perf_counter() - start) * 1000
+heavy = sorted(name for name in json.loads(sys.argv[2]) if name in sys.modules)
+print(json.dumps({"ms": elapsed, "error": error, "heavy": heavy}))
+"""
+
+FIRST_FRAME_PROBE = """
+import json, sys, threading, time
+start = time.perf_counter()
+from scanner_loader import load_scanner_async
+imported = time.perf_counter()
+ready = threading.Event()
+result = {}
+def on_ready(capture, decode_fn):
+    result.update(capture=capture, decode_fn=decode_fn, ready=time.perf_counter())
+    ready.set()
+source = int(sys.argv[1]) if sys.argv[1].isdigit() else sys.argv[1]
+load_scanner_async(on_ready, {"source": source}, json.loads(sys.argv[2]), dispatch=lambda callback, *args: callback(*args))
+ready.wait(30)
+capture, decode_fn = result.get("capture"), result.get("decode_fn")
+report = {"import_ms": (imported - start) * 1000, "ready_ms": None, "first_frame_ms": None, "first_decode_ms": None}
+if capture is not None:
+    report["ready_ms"] = (result["ready"] - start) * 1000
+    deadline = time.perf_counter() + 10
+    while time.perf_counter() < deadline:
+        ok, frame = capture.read()
+        if not ok:
+            time.sleep(0.001)
+            continue
+        if report["first_frame_ms"] is None:
+            report["first_frame_ms"] = (time.perf_counter() - start) * 1000
+        if decode_fn(frame):
+            report["first_decode_ms"] = (time.perf_counter() - start) * 1000
+            break
+    capture.release()
+print(json.dumps(report))
+"""
+
+
+def probe(script, *args):
+    """Runs a probe script in a fresh interpreter from the repository root and returns its JSON output."""
+    output = subprocess.run([sys.executable, "-c", script, *args], capture_output=True, text=True,
+                            cwd=os.getcwd(), check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median(values):
+    """Returns the median of a list of numbers, or None if it is empty."""
+    values = sorted(v for v in values if v is not None)
+    return values[len(values) // 2] if values else None
+
+
+def measure_imports(modules, repeat):
+    """Returns the median cold import time and the heavy libraries loaded for each module."""
+    results = {}
+    for module in modules:
+        runs = [probe(IMPORT_PROBE, module, json.dumps(HEAVY)) for _ in range(repeat)]
+        results[module] = {"ms": median([run["ms"] for run in runs]), "error": runs[0]["error"],
+                           "heavy": runs[0]["heavy"]}
+    return results
+
+
+def measure_first_frame(source, decoder_settings, repeat):
+    """Returns median import, camera-ready, first-frame and first-decode times in milliseconds."""
+    runs = [probe(FIRST_FRAME_PROBE, str(source), json.dumps(decoder_settings)) for _ in range(repeat)]
+    return {key: median([run[key] for run in runs]) for key in runs[0]}
+
+
+def regressions(current, baseline, tolerance):
+    """Returns descriptions of the ways current is worse than baseline."""
+    problems = []
+    for module, stats in current["imports"].items():
+        old = baseline["imports"].get(module, {})
+        if stats["error"] is None and old.get("ms") and stats["ms"] > old["ms"] * (1 + tolerance):
+            problems.append(f"import {module} rose from {old['ms']:.1f} ms to {stats['ms']:.1f} ms")
+    for key, new in current["first_frame"].items():
+        old = baseline["first_frame"].get(key)
+        if old and new and new > old * (1 + tolerance):
+            problems.append(f"{key} rose from {old:.1f} ms to {new:.1f} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", help="camera index or video file for time-to-first-frame")
+    parser.add_argument("--decoder", default="auto", help="decoder backend name, or auto")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--json", help="write machine-readable results to this file")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    imports = measure_imports(LIBRARIES + APP_MODULES, args.repeat)
+    print(f"{'module':<26} {'import ms':>10}  heavy libraries loaded")
+    problems = []
+    for module, stats in imports.items():
+        if stats["error"]:
+            print(f"{module:<26} {'-':>10}  unavailable ({stats['error']})")
+            continue
+        print(f"{module:<26} {stats['ms']:>10.1f}  {', '.join(stats['heavy']) or '-'}")
+        eager = [name for name in stats["heavy"] if name in DEFERRED]
+        if module in APP_MODULES and eager:
+            problems.append(f"importing {module} loads {', '.join(eager)}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = args.source
+        if source is None:
+            from benchmarks.bench_pipeline import make_video
+            source = os.path.join(workdir, "scanner.avi")
+            make_video(source)
+        first_frame = measure_first_frame(source, {"decoder": args.decoder, "symbology": "qr"}, args.repeat)
+    print(f"time from process start (median of {args.repeat} runs):")
+    for key, value in first_frame.items():
+        print(f"  {key:<16} {'-' if value is None else f'{value:.1f} ms'}")
+
+    report = {"python": sys.version.split()[0], "imports": imports, "first_frame": first_frame}
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            problems += regressions(report, json.load(file), args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
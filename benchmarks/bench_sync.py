@@ -0,0 +1,235 @@
+"""Measures offline-first checkout and how long a device takes to sync a backlog of 100k sales.
+
+A device runs CheckoutService on its own stores with a SyncEngine. First
+the server is unreachable: --scans baskets are paid one at a time and
+commit locally while the engine backs off. Then --backlog more sales are
+queued on the device journal, as a long outage would leave them. The
+engine is pointed at a local checkout server through a proxy that drops
+a fraction of its reads (--drop-rate) to imitate flaky Wi-Fi, and the
+time until the server has applied everything is the catch-up time. More
+baskets are paid while it catches up, to show checkout speed is not held
+back by the sync.
+
+The server's catalog holds little stock of a tenth of the products, so
+some offline sales oversell. Afterwards the server must have applied
+every record exactly once: the retailer wallet holds exactly what was
+paid, and stock and oversold conflicts match a replay of the sales.
+
+Run from the repository root:
+    python -m benchmarks.bench_sync --backlog 100000 --drop-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+
+from benchmarks.bench_checkout_server import start_server
+from catalog import Catalog
+from checkout import RETAILER_WALLET, CheckoutService
+from checkout_client import CheckoutClient
+from loyalty import paid_cents
+from sync import SyncEngine
+
+PRICE_CENTS = 199
+LOW_STOCK = 50
+
+
+def make_catalog(path, skus, low_stock):
+    """Creates a catalog where every tenth product has only low_stock units, or plenty when low_stock is None."""
+    catalog = Catalog(path, seed_defaults=False)
+    catalog.upsert_many({"product_id": f"sku{i:05d}", "name": f"Product {i}", "price": PRICE_CENTS / 100,
+                         "category": f"cat{i % 10}",
+                         "stock": low_stock if low_stock is not None and i % 10 == 0 else 10 ** 9}
+                        for i in range(skus))
+    catalog.close()
+
+
+def unused_address():
+    """Returns the address of a local port nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+# TCP proxy that cuts a connection on a random fraction of the reads passing through it
+class FlakyProxy:
+    def __init__(self, target, drop_rate, seed=0):
+        """Initializes the proxy for a "host:port" target."""
+        self.target_host, target_port = target.rsplit(":", 1)
+        self.target_port = int(target_port)
+        self.drop_rate = drop_rate
+        self.drops = 0
+        self._rng = random.Random(seed)
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self.address = None
+
+    def start(self):
+        """Starts the proxy on its own thread and returns its address."""
+        threading.Thread(target=self._loop.run_forever, name="flaky-proxy", daemon=True).start()
+        server = asyncio.run_coroutine_threadsafe(asyncio.start_server(self._handle, "127.0.0.1", 0),
+                                                  self._loop).result()
+        self.address = f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        return self.address
+
+    async def _handle(self, reader, writer):
+        """Relays one connection in both directions until either side closes or a drop is drawn."""
+        upstream_reader, upstream_writer = await asyncio.open_connection(self.target_host, self.target_port)
+
+        async def pipe(source, destination):
+            try:
+                while True:
+                    data = await source.read(65536)
+                    if not data:
+                        break
+                    if self._rng.random() < self.drop_rate:
+                        self.drops += 1
+                        break
+                    destination.write(data)
+                    await destination.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+                upstream_writer.close()
+
+        await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+
+
+def checkout_baskets(service, customer_id, baskets, rng, skus):
+    """Pays for baskets of one to three products one at a time and returns the elapsed seconds."""
+    start = time.perf_counter()
+    for _ in range(baskets):
+        basket_id = service.open_basket(customer_id)["basket_id"]
+        for _ in range(rng.randint(1, 3)):
+            service.add_item(basket_id, f"sku{rng.randrange(skus):05d}", rng.randint(1, 2))
+        service.pay(basket_id)
+        service.close_basket(basket_id)
+    return time.perf_counter() - start
+
+
+def queue_backlog(journal, count, rng, skus):
+    """Appends count sales to the device journal, as paid while offline, and returns the elapsed seconds."""
+    start = time.perf_counter()
+    for _ in range(count):
+        i = rng.randrange(skus)
+        quantity = rng.randint(1, 3)
+        journal.append("sale", product_id=f"sku{i:05d}", name=f"Product {i}", quantity=quantity,
+                       unit_price_cents=PRICE_CENTS, amount_cents=PRICE_CENTS * quantity, discount_cents=0,
+                       customer_id="shopper", points_cents=0)
+    journal.flush()
+    return time.perf_counter() - start
+
+
+def expected_outcome(records, skus, low_stock):
+    """Replays sales against the server's starting stock and returns (paid_cents, oversold, stock)."""
+    stock = {f"sku{i:05d}": low_stock if i % 10 == 0 else 10 ** 9 for i in range(skus)}
+    paid = 0
+    oversold = 0
+    for record in records:
+        paid += paid_cents(record)
+        product_id = record["product_id"]
+        if stock[product_id] < record["quantity"]:
+            oversold += 1
+            stock[product_id] = 0
+        else:
+            stock[product_id] -= record["quantity"]
+    return paid, oversold, stock
+
+
+def count_conflicts(client, device_id):
+    """Returns Counter({kind: count}) of the server's sync conflicts for a device."""
+    kinds = Counter()
+    after_id = 0
+    while True:
+        page = client.sync_status(device_id, after_id, limit=1000)["conflicts"]
+        if not page:
+            return kinds
+        kinds.update(conflict["kind"] for conflict in page)
+        after_id = page[-1]["conflict_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backlog", type=int, default=100000, help="sales queued while offline")
+    parser.add_argument("--scans", type=int, default=2000, help="baskets paid offline and again while syncing")
+    parser.add_argument("--skus", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--drop-rate", type=float, default=0.02, help="fraction of proxied reads that cut the link")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        device_catalog = os.path.join(workdir, "device.db")
+        server_catalog = os.path.join(workdir, "server.db")
+        make_catalog(device_catalog, args.skus, None)
+        make_catalog(server_catalog, args.skus, LOW_STOCK)
+        device = CheckoutService(device_catalog, os.path.join(workdir, "device-wallets.db"),
+                                 os.path.join(workdir, "device.jsonl"), journal_fsync="interval")
+        device.open_wallet("shopper", 10 ** 8)
+
+        offline = SyncEngine(CheckoutClient(unused_address(), timeout=1.0), device.journal.path,
+                             batch_size=args.batch_size, interval=0.05, max_backoff=1.0).start()
+        seconds = checkout_baskets(device, "shopper", args.scans, rng, args.skus)
+        print(f"offline: {args.scans:,} baskets paid in {seconds:.2f} s ({args.scans / seconds:,.0f}/s), "
+              f"sync failures meanwhile: {offline.status()['last_error'] is not None}")
+        offline.close()
+
+        seconds = queue_backlog(device.journal, args.backlog, rng, args.skus)
+        print(f"offline: {args.backlog:,} more sales queued in {seconds:.2f} s ({args.backlog / seconds:,.0f}/s)")
+        records = list(device.journal.records())
+        sample = json.dumps(records[:args.batch_size], separators=(",", ":")).encode("utf-8")
+        print(f"a batch of {args.batch_size} records: {len(sample):,} bytes of JSON, "
+              f"{len(zlib.compress(sample)):,} deflated")
+
+        process, address = start_server(workdir, server_catalog, workers=8, pool_size=2, fsync="interval")
+        proxy = FlakyProxy(address, args.drop_rate, args.seed)
+        try:
+            engine = SyncEngine(CheckoutClient(proxy.start(), timeout=30.0), device.journal.path,
+                                batch_size=args.batch_size, interval=0.05, max_backoff=1.0)
+            backlog = engine.pending()
+            start = time.perf_counter()
+            engine.start()
+            online_seconds = checkout_baskets(device, "shopper", args.scans, rng, args.skus)
+            engine.notify()
+            while engine.pending():
+                time.sleep(0.05)
+            catch_up = time.perf_counter() - start
+            status = engine.status()
+            engine.close()
+            print(f"online: {args.scans:,} baskets paid in {online_seconds:.2f} s "
+                  f"({args.scans / online_seconds:,.0f}/s) while syncing")
+            print(f"catch-up: {backlog:,} queued records plus those paid meanwhile synced in {catch_up:.2f} s "
+                  f"({status['acked_seq'] / catch_up:,.0f} records/s), {proxy.drops} dropped reads, "
+                  f"{status['conflicts']:,} conflicts reported")
+
+            records = list(device.journal.records(record_type="sale"))
+            paid, oversold, stock = expected_outcome(records, args.skus, LOW_STOCK)
+            client = CheckoutClient(address, timeout=30.0)
+            balance = client.wallet(RETAILER_WALLET)["balance_cents"]
+            conflicts = count_conflicts(client, status["device_id"])
+            server_stock = client.stock(list(stock))
+            client.close()
+            ok = (balance == paid and conflicts["oversold"] == oversold and server_stock == stock
+                  and status["acked_seq"] == records[-1]["seq"])
+            print(f"server: retailer wallet {balance / 100:,.2f} of {paid / 100:,.2f} paid, "
+                  f"{conflicts['oversold']:,} oversold of {oversold:,} expected, "
+                  f"stock {'matches' if server_stock == stock else 'DIFFERS'}: {'OK' if ok else 'MISMATCH'}")
+        finally:
+            process.terminate()
+            process.wait()
+            device.close()
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Hammers one wallet from many threads and checks that no update was lost or applied twice.
+
+Run from the repository root:
+    python -m benchmarks.bench_wallet --threads 8 --ops 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from wallet import WalletStore
+
+
+def worker(wallet, thread_id, ops, results):
+    """Runs a mix of deductions, top-ups and retried deductions, recording what succeeded."""
+    rng = random.Random(thread_id)
+    applied = 0
+    calls = 0
+    for i in range(ops):
+        key = f"{thread_id}:{i}"
+        if rng.random() < 0.3:
+            cents = rng.randint(1, 500)
+            wallet.add_balance(cents / 100, idempotency_key=key)
+            applied += cents
+            calls += 1
+        else:
+            cents = rng.randint(1, 500)
+            charged = wallet.deduct_amount(cents / 100, idempotency_key=key)
+            # A retried scan reuses its key: it must not be charged twice, but may
+            # succeed if the first attempt was declined and another thread topped up since
+            retried = wallet.deduct_amount(cents / 100, idempotency_key=key)
+            if charged or retried:
+                applied -= cents
+            calls += 2
+    results[thread_id] = (applied, calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=2000, help="operations per thread, excluding retries")
+    parser.add_argument("--initial", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store = WalletStore(os.path.join(workdir, "wallets.db"))
+        wallet = store.open_wallet("bench", initial_balance=args.initial)
+        results = {}
+        threads = [threading.Thread(target=worker, args=(wallet, i, args.ops, results)) for i in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        expected = round(args.initial * 100) + sum(applied for applied, _ in results.values())
+        actual = wallet.get_balance_cents()
+        calls = sum(count for _, count in results.values())
+        print(f"{args.threads} threads, {calls} wallet calls in {seconds:.2f}s ({calls / seconds:.0f} ops/s)")
+        print(f"expected balance {expected} cents, actual {actual} cents: {'OK' if expected == actual else 'LOST UPDATES'}")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import cv2
+
+import metrics
+
+# Rewinds in a row that may each fail to give a frame before a looping file is given up on
+LOOP_RETRIES = 3
+
+
+# Reads camera or video frames on a dedicated thread into a single-slot latest-frame buffer
+class CaptureThread:
+    def __init__(self, source=0, width=640, height=480, fps=30, fourcc="MJPG", buffer_size=1,
+                 loop=True, realtime=True):
+        """Initializes the capture settings.
+
+        source is a camera index or a video file path. fourcc selects the
+        camera pixel format ("MJPG" or "YUYV"; None keeps the driver default)
+        and buffer_size the number of frames the driver may queue. File
+        sources are paced at fps when realtime is set and restart at the end
+        when loop is set, so the scanner pipeline can run without a camera.
+        """
+        self.source = source
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.buffer_size = buffer_size
+        self.loop = loop
+        self.realtime = realtime
+        self.frames_read = 0
+        self.frames_overwritten = 0
+        self._capture = None
+        self._lock = threading.Lock()
+        self._frame = None
+        self._seq = 0
+        self._read_seq = 0
+        self._running = False
+        self._thread = None
+
+    @property
+    def is_file(self):
+        """Returns True if the source is a video file rather than a camera."""
+        return isinstance(self.source, str)
+
+    def start(self):
+        """Opens the source and starts the reader thread; returns False if the source could not be opened."""
+        self._capture = cv2.VideoCapture(self.source)
+        if not self._capture.isOpened():
+            return False
+        if not self.is_file:
+            self._configure(self._capture)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="camera-capture", daemon=True)
+        self._thread.start()
+        return True
+
+    def _configure(self, capture):
+        """Applies the resolution, frame rate, pixel format and buffer size to a camera."""
+        if self.fourcc:
+            capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        capture.set(cv2.CAP_PROP_FPS, self.fps)
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+
+    def isOpened(self):
+        """Returns True while frames are being captured, matching cv2.VideoCapture."""
+        return self._running
+
+    def read(self):
+        """Returns (True, frame) if a frame arrived since the last call, otherwise (False, None).
+
+        This never waits for the camera, so it is safe to call from the UI thread.
+        """
+        with self._lock:
+            if self._seq == self._read_seq:
+                return False, None
+            self._read_seq = self._seq
+            return True, self._frame
+
+    def release(self):
+        """Stops the reader thread and releases the camera or file."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+    def _run(self):
+        """Reads frames until released, keeping only the newest one."""
+        interval = 1.0 / self.fps if self.is_file and self.realtime else 0
+        next_frame_at = time.perf_counter()
+        failing = False
+        rewinds = 0
+        while self._running:
+            with metrics.span("capture.read"):
+                ok, frame = self._capture.read()
+            if not ok:
+                if self.is_file and self.loop and rewinds < LOOP_RETRIES:
+                    if rewinds:
+                        # Nothing was read since the last rewind, so wait before trying again
+                        metrics.inc("capture.read_errors")
+                        time.sleep(0.1)
+                    rewinds += 1
+                    self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                if self.is_file and self.loop:
+                    print(f"Error: No frames could be read from {self.source}.")
+                if self.is_file:
+                    self._running = False
+                    return
+                metrics.inc("capture.read_errors")
+                # Report a failing camera once, not on every retry
+                if not failing:
+                    print("Error: Failed to read from the camera.")
+                    failing = True
+                time.sleep(0.1)
+                continue
+            failing = False
+            rewinds = 0
+            with self._lock:
+                if self._seq != self._read_seq:
+                    self.frames_overwritten += 1
+                    metrics.inc("capture.frames_overwritten")
+                self._frame = frame
+                self._seq += 1
+            self.frames_read += 1
+            metrics.inc("capture.frames")
+            if interval:
+                next_frame_at += interval
+                delay = next_frame_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
@@ -0,0 +1,231 @@
+import csv
+import sqlite3
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+
+import metrics
+
+DEFAULT_PATH = "catalog.db"
+
+# Products the apps shipped with before the catalog existed
+DEFAULT_PRODUCTS = [
+    {"product_id": "product123", "ean": None, "name": "Product A", "price": "15.00", "category": "general", "stock": 10},
+    {"product_id": "product456", "ean": None, "name": "Product B", "price": "20.00", "category": "general", "stock": 5},
+    {"product_id": "product789", "ean": None, "name": "Product C", "price": "25.00", "category": "general", "stock": 8},
+    {"product_id": "0060410050910", "ean": "0060410050910", "name": "Chips", "price": "25.00", "category": "snacks", "stock": 20},
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    ean TEXT,
+    name TEXT NOT NULL,
+    price_cents INTEGER NOT NULL,
+    category TEXT,
+    stock INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_products_ean ON products (ean) WHERE ean IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_products_name ON products (name, product_id);
+"""
+
+COLUMNS = "product_id, ean, name, price_cents, category, stock"
+
+# Columns lookup() reads; stock changes with every sale, so it is left out of the cached products
+LOOKUP_COLUMNS = "product_id, ean, name, price_cents, category"
+
+
+def to_cents(price):
+    """Converts a price given as a string, Decimal or number of dollars to integer cents."""
+    return int((Decimal(str(price)) * 100).quantize(Decimal(1)))
+
+
+def _upsert_sql(with_stock):
+    """Returns the statement that adds a product or updates it in place, writing stock only if with_stock.
+
+    Updating in place keeps a product's stock when a price file without
+    stock is loaded, and a row whose EAN belongs to another product fails
+    instead of deleting that product as INSERT OR REPLACE would.
+    """
+    columns = ["product_id", "ean", "name", "price_cents", "category"] + (["stock"] if with_stock else [])
+    return (f"INSERT INTO products ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (product_id) DO UPDATE SET "
+            + ", ".join(f"{column} = excluded.{column}" for column in columns[1:]))
+
+
+def _filter(search=None, category=None, max_stock=None):
+    """Returns the WHERE clause and parameters for the product list filters."""
+    clauses = []
+    params = []
+    if search:
+        clauses.append("(name LIKE ? OR product_id LIKE ? OR ean LIKE ?)")
+        params += [f"%{search}%"] * 3
+    if category:
+        clauses.append("category = ?")
+        params.append(category)
+    if max_stock is not None:
+        clauses.append("stock <= ?")
+        params.append(max_stock)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _row_to_product(row):
+    """Converts a products table row to the dictionary the apps work with; a row without stock gives none."""
+    product_id, ean, name, price_cents, category, *stock = row
+    product = {
+        "product_id": product_id,
+        "ean": ean,
+        "name": name,
+        "price_cents": price_cents,
+        "price": price_cents / 100,
+        "category": category,
+    }
+    if stock:
+        product["stock"] = stock[0]
+    return product
+
+
+# Product catalog backed by SQLite with an in-process LRU read cache
+class Catalog:
+    def __init__(self, path=DEFAULT_PATH, cache_size=4096, seed_defaults=True):
+        """Opens (or creates) the catalog database and seeds the default products into an empty one."""
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        if seed_defaults and self.count() == 0:
+            self.upsert_many(DEFAULT_PRODUCTS)
+
+    def lookup(self, code):
+        """Returns the product for a scanned product ID or EAN/UPC code, or None if it is unknown.
+
+        The product has no stock field, as cached products would soon show
+        stale stock; stock_levels() reads the current stock.
+        """
+        with self._lock:
+            if code in self._cache:
+                self._cache.move_to_end(code)
+                metrics.inc("catalog.cache_hits")
+                return self._cache[code]
+            with metrics.span("catalog.lookup"):
+                row = self._conn.execute(
+                    f"SELECT {LOOKUP_COLUMNS} FROM products WHERE product_id = ?", (code,)
+                ).fetchone()
+                if row is None:
+                    row = self._conn.execute(
+                        f"SELECT {LOOKUP_COLUMNS} FROM products WHERE ean = ?", (code,)
+                    ).fetchone()
+            product = _row_to_product(row) if row else None
+            # Unknown codes are cached too so a code held in view does not hit the database each frame
+            self._cache[code] = product
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return product
+
+    def products(self, offset=0, limit=None, search=None, category=None, max_stock=None):
+        """Returns products ordered by name.
+
+        search matches part of the name, product ID or EAN, category an exact
+        category and max_stock keeps products with at most that much stock.
+        """
+        where, params = _filter(search, category, max_stock)
+        # Ordered by the (name, product_id) index, so a page does not sort the whole table
+        query = f"SELECT {COLUMNS} FROM products{where} ORDER BY name, product_id LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        with self._lock:
+            return [_row_to_product(row) for row in self._conn.execute(query, params)]
+
+    def count(self, search=None, category=None, max_stock=None):
+        """Returns the number of products in the catalog, or matching the products() filters."""
+        where, params = _filter(search, category, max_stock)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM products{where}", params).fetchone()[0]
+
+    def categories(self):
+        """Returns the distinct product categories in alphabetical order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT category FROM products WHERE category IS NOT NULL ORDER BY category"
+            )
+            return [row[0] for row in rows]
+
+    def stock_levels(self, product_ids):
+        """Returns the current stock of each of the given products as a {product_id: stock} dictionary."""
+        product_ids = list(product_ids)
+        levels = {}
+        with self._lock:
+            # Chunked to stay under SQLite's limit on query parameters
+            for start in range(0, len(product_ids), 500):
+                chunk = product_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT product_id, stock FROM products WHERE product_id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                levels.update(rows)
+        return levels
+
+    def upsert_many(self, products):
+        """Adds or updates products given as dictionaries with a dollar "price" field.
+
+        Stock is only set for products whose dictionary has a "stock" key;
+        the others keep theirs, or start with none if they are new.
+        """
+        with_stock, without_stock = [], []
+        for p in products:
+            row = (p["product_id"], p.get("ean") or None, p["name"], to_cents(p["price"]), p.get("category"))
+            if "stock" in p:
+                with_stock.append(row + (int(p["stock"] or 0),))
+            else:
+                without_stock.append(row)
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(_upsert_sql(True), with_stock)
+                self._conn.executemany(_upsert_sql(False), without_stock)
+            self._cache.clear()
+
+    def load_csv(self, path, batch_size=10000):
+        """Bulk loads a CSV price file with product_id, ean, name, price, category and stock columns.
+
+        Rows are written in batches of batch_size inside a single transaction,
+        so a file with hundreds of thousands of SKUs loads in seconds.
+        Products already in the catalog are updated in place; a file with no
+        stock column leaves their stock as it is. Returns the number of rows
+        loaded.
+        """
+        loaded = 0
+        with open(path, newline="") as file, self._lock:
+            reader = csv.DictReader(file)
+            with_stock = "stock" in (reader.fieldnames or ())
+            with self._conn:
+                batch = []
+                for record in reader:
+                    row = (record["product_id"], record.get("ean") or None, record["name"],
+                           to_cents(record["price"]), record.get("category") or None)
+                    batch.append(row + (int(record["stock"] or 0),) if with_stock else row)
+                    if len(batch) >= batch_size:
+                        self._insert_batch(batch, with_stock)
+                        loaded += len(batch)
+                        batch = []
+                if batch:
+                    self._insert_batch(batch, with_stock)
+                    loaded += len(batch)
+            self._cache.clear()
+        return loaded
+
+    def _insert_batch(self, batch, with_stock):
+        """Writes one batch of product rows, which end with a stock column if with_stock."""
+        self._conn.executemany(_upsert_sql(with_stock), batch)
+
+    def clear_cache(self):
+        """Empties the read cache."""
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,543 @@
+import contextlib
+import math
+import queue
+import threading
+import time
+
+from analytics import SalesAnalytics
+from catalog import DEFAULT_PATH as CATALOG_PATH, Catalog
+from inventory import HOLD_TIMEOUT, InventoryService
+from journal import DEFAULT_PATH as JOURNAL_PATH, REQUIRED_FIELDS, Journal, new_id
+from loyalty import POINTS_PER_DOLLAR, LoyaltyService, paid_cents, points_earned, points_for
+from promotions import Basket, PromotionStore
+from wallet import DEFAULT_PATH as WALLET_PATH, WalletStore
+
+# Wallet credited with what customers pay
+RETAILER_WALLET = "retailer"
+
+# Seconds between restarts of a basket's hold timeout while the basket is in use
+HOLD_REFRESH = 60
+
+# Fields of a device's sale record that the server copies into its own journal; the rest are the device's own
+SYNCED_SALE_FIELDS = ("product_id", "name", "quantity", "unit_price_cents", "amount_cents", "discount_cents",
+                      "coupon", "customer_id", "points_cents", "payment_id", "line_id", "points_earned")
+
+
+# A checkout request that cannot be carried out, with the HTTP status the checkout server answers it with
+class CheckoutError(Exception):
+    def __init__(self, status, message):
+        """Initializes the error with a status code and a message for the customer."""
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _is_count(value):
+    """Returns whether a record field holds a whole number, which JSON booleans are not."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_synced(record):
+    """Raises CheckoutError(400) unless a synced journal record has the fields receive_sync relies on."""
+    if not isinstance(record, dict):
+        raise CheckoutError(400, "Sync record is not an object")
+    if not _is_count(record.get("seq")) or record["seq"] < 1:
+        raise CheckoutError(400, "Sync record has no sequence number")
+    if not isinstance(record.get("type"), str):
+        raise CheckoutError(400, f"Sync record {record['seq']} has no type")
+    if record["type"] == "parked" and not _is_count(record.get("status")):
+        raise CheckoutError(400, f"Sync record {record['seq']} is parked without a status")
+    missing = [name for name in REQUIRED_FIELDS.get(record["type"], ()) if name not in record]
+    if missing:
+        raise CheckoutError(400, f"Sync record {record['seq']} is missing {', '.join(missing)}")
+    if record["type"] != "sale":
+        return
+    for name in ("product_id", "name"):
+        if not isinstance(record[name], str):
+            raise CheckoutError(400, f"Sync record {record['seq']} has a bad {name}")
+    for name in ("coupon", "payment_id", "line_id"):
+        if record.get(name) is not None and not isinstance(record[name], str):
+            raise CheckoutError(400, f"Sync record {record['seq']} has a bad {name}")
+    if not _is_count(record["quantity"]) or record["quantity"] < 1:
+        raise CheckoutError(400, f"Sync record {record['seq']} has a bad quantity")
+    for name in ("unit_price_cents", "amount_cents", "discount_cents", "points_cents"):
+        if name in record and (not _is_count(record[name]) or record[name] < 0):
+            raise CheckoutError(400, f"Sync record {record['seq']} has a bad {name}")
+    if paid_cents(record) < 0:
+        raise CheckoutError(400, f"Sync record {record['seq']} pays a negative amount")
+    # A line's share of its payment's points is at most one dollar's worth more than its own amount earns
+    if "points_earned" in record and (not _is_count(record["points_earned"]) or record["points_earned"] < 0
+                                      or record["points_earned"] > points_for(paid_cents(record)) + POINTS_PER_DOLLAR):
+        raise CheckoutError(400, f"Sync record {record['seq']} has a bad points_earned")
+    if record.get("customer_id") is not None and not isinstance(record["customer_id"], str):
+        raise CheckoutError(400, f"Sync record {record['seq']} has a bad customer_id")
+    if "ts" in record and (not isinstance(record["ts"], (int, float)) or isinstance(record["ts"], bool)
+                           or not math.isfinite(record["ts"]) or record["ts"] < 0):
+        raise CheckoutError(400, f"Sync record {record['seq']} has a bad ts")
+
+
+# A fixed set of objects that each own a SQLite connection, lent to one thread at a time
+class ConnectionPool:
+    def __init__(self, factory, size=4):
+        """Creates size objects with factory()."""
+        self._all = [factory() for _ in range(size)]
+        self._idle = queue.Queue()
+        for conn in self._all:
+            self._idle.put(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Lends out an idle object, waiting for one if they are all in use."""
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        """Closes every object in the pool."""
+        for conn in self._all:
+            conn.close()
+
+
+# One customer's open basket; lines are held in stock until paid for or removed
+class _OpenBasket:
+    def __init__(self, basket_id, session_id, customer_id, promotions):
+        """Initializes an empty basket."""
+        self.basket_id = basket_id
+        self.session_id = session_id
+        self.customer_id = customer_id
+        self.pricing = Basket(promotions)
+        self.lines = {}
+        self.payments = {}
+        self.lock = threading.Lock()
+        self.touched = time.time()
+        self.holds_touched = self.touched
+
+
+# Catalog, basket, payment, stock and coupon operations shared by the apps and the checkout server
+class CheckoutService:
+    def __init__(self, catalog_path=CATALOG_PATH, wallet_path=WALLET_PATH, journal_path=JOURNAL_PATH,
+                 pool_size=4, journal_fsync="commit"):
+        """Opens the stores checkout works on.
+
+        Catalog reads go through a pool of pool_size connections so
+        concurrent requests do not queue behind one connection; stock,
+        points and journal writes go through the group-committing services.
+        """
+        self.catalogs = ConnectionPool(lambda: Catalog(catalog_path), pool_size)
+        self.inventory = InventoryService(catalog_path)
+        self.promotions = PromotionStore(catalog_path)
+        self.wallets = WalletStore(wallet_path)
+        self.wallets.open_wallet(RETAILER_WALLET)
+        self.journal = Journal(journal_path, fsync=journal_fsync)
+        self.loyalty = LoyaltyService(wallet_path)
+        # Accrue points for sales whose events were lost, such as in a crash before they were applied
+        self.loyalty.catch_up(self.journal.path)
+        self.analytics = SalesAnalytics(self.journal.path)
+        self._analytics_lock = threading.Lock()
+        self._baskets = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.release_expired()
+
+    def lookup(self, code):
+        """Returns the product for a product ID or EAN/UPC code, or None if it is unknown."""
+        with self.catalogs.connection() as catalog:
+            return catalog.lookup(code)
+
+    def stock(self, product_ids):
+        """Returns {product_id: stock} for the given products."""
+        with self.catalogs.connection() as catalog:
+            return catalog.stock_levels(product_ids)
+
+    def products(self, offset=0, limit=None, search=None, category=None, max_stock=None):
+        """Returns products ordered by name with their stock, filtered as Catalog.products() does."""
+        with self.catalogs.connection() as catalog:
+            return catalog.products(offset, limit, search, category, max_stock)
+
+    def count_products(self, search=None, category=None, max_stock=None):
+        """Returns the number of products matching the products() filters."""
+        with self.catalogs.connection() as catalog:
+            return catalog.count(search, category, max_stock)
+
+    def categories(self):
+        """Returns the distinct product categories in alphabetical order."""
+        with self.catalogs.connection() as catalog:
+            return catalog.categories()
+
+    def low_stock_events(self, after_id=None, limit=100):
+        """Returns low-stock events as dictionaries, the ones after after_id or else the most recent, oldest first."""
+        return self.inventory.low_stock_events(after_id, limit)
+
+    def coupons(self, limit=20):
+        """Returns how many promotions are running and the newest limit of them."""
+        return {"count": self.promotions.index().count,
+                "promotions": [promotion._asdict() for promotion in self.promotions.active(limit=limit)]}
+
+    def add_coupon(self, name, kind, scope, target, value, coupon_id=None):
+        """Adds an active promotion and returns it; raises CheckoutError(400) for an invalid one.
+
+        Adding again with the same coupon_id returns the promotion the first
+        call added, so a retried request does not add it twice.
+        """
+        try:
+            return self.promotions.add(name, kind, scope, target, value, request_id=coupon_id)._asdict()
+        except ValueError as e:
+            raise CheckoutError(400, str(e))
+
+    def open_wallet(self, customer_id, initial_balance=0):
+        """Creates a customer's wallet with initial_balance dollars if it does not exist and returns its balances."""
+        try:
+            self.wallets.open_wallet(customer_id, initial_balance)
+        except (ArithmeticError, ValueError):
+            raise CheckoutError(400, f"Invalid initial balance: {initial_balance}")
+        return self.wallet(customer_id)
+
+    def wallet(self, customer_id):
+        """Returns a customer's wallet balance in cents and loyalty points."""
+        try:
+            balance_cents = self.wallets.balance_cents(customer_id)
+        except KeyError:
+            raise CheckoutError(404, f"Unknown wallet: {customer_id}")
+        return {"customer_id": customer_id, "balance_cents": balance_cents,
+                "points": self.loyalty.balance(customer_id)}
+
+    def open_basket(self, customer_id, session_id=None, basket_id=None):
+        """Opens an empty basket for a customer and returns its basket and session IDs.
+
+        Opening again with the basket_id of the customer's open basket
+        returns that basket, so a retried request does not open a second one.
+        """
+        self.wallet(customer_id)
+        basket = _OpenBasket(basket_id or new_id(), session_id or new_id(), customer_id, self.promotions)
+        with self._lock:
+            basket = self._baskets.setdefault(basket.basket_id, basket)
+        if basket.customer_id != customer_id:
+            raise CheckoutError(409, f"Basket {basket.basket_id} belongs to another customer")
+        return {"basket_id": basket.basket_id, "session_id": basket.session_id}
+
+    def close_basket(self, basket_id):
+        """Returns the basket's unpaid lines to stock and forgets the basket."""
+        with self._lock:
+            basket = self._baskets.pop(basket_id, None)
+        if basket is None:
+            return False
+        with basket.lock:
+            for line_id, line in basket.lines.items():
+                if not line["paid"]:
+                    self.inventory.release(line_id)
+        return True
+
+    def release_expired(self, max_age=HOLD_TIMEOUT):
+        """Closes baskets left untouched for max_age seconds and releases stock held for as long."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            expired = [basket_id for basket_id, basket in self._baskets.items() if basket.touched < cutoff]
+        for basket_id in expired:
+            self.close_basket(basket_id)
+        return self.inventory.release_expired(max_age)
+
+    def _basket(self, basket_id):
+        """Returns an open basket or raises CheckoutError."""
+        with self._lock:
+            basket = self._baskets.get(basket_id)
+        if basket is None:
+            raise CheckoutError(404, f"Unknown basket: {basket_id}")
+        basket.touched = time.time()
+        if basket.touched - basket.holds_touched >= HOLD_REFRESH:
+            # A basket in use keeps its stock, however long ago its lines were added
+            basket.holds_touched = basket.touched
+            self.inventory.touch(basket_id)
+        return basket
+
+    def _totals(self, basket):
+        """Returns the basket's running totals in cents."""
+        return {"subtotal_cents": basket.pricing.subtotal_cents,
+                "basket_discount_cents": basket.pricing.discount_cents,
+                "total_cents": basket.pricing.total_cents}
+
+    def add_item(self, basket_id, code, quantity=1, line_id=None):
+        """Sets a basket line to quantity units of a product, holding them in stock.
+
+        Calling it again with the same line_id changes the line's quantity,
+        so a retried request does not add the units twice. Returns the line
+        with the change in the basket's discount and the basket's totals.
+        """
+        if quantity < 1:
+            raise CheckoutError(400, "Quantity must be at least 1")
+        result = self.add_items(basket_id, [{"code": code, "quantity": quantity, "line_id": line_id}])
+        line = result.pop("lines")[0]
+        if "error" in line:
+            raise CheckoutError(line["status"], line["error"])
+        return {**line, **result}
+
+    def add_items(self, basket_id, items):
+        """Sets several basket lines at once, holding all their units in one inventory operation.
+
+        items are dicts with a code and, as add_item takes them, an optional
+        quantity and line_id. A line that cannot be added does not stop the
+        others: its entry in the returned lines has the code, the HTTP
+        status and an error message instead of the line. Returns the lines
+        in order and the basket's totals after all of them.
+        """
+        basket = self._basket(basket_id)
+        with self.catalogs.connection() as catalog:
+            products = [catalog.lookup(item["code"]) for item in items]
+        with basket.lock:
+            lines = [None] * len(items)
+            changes = []
+            seen = set()
+            for index, (item, product) in enumerate(zip(items, products)):
+                code, quantity = item["code"], int(item.get("quantity", 1))
+                line_id = item.get("line_id") or new_id()
+                line = basket.lines.get(line_id)
+                if quantity < 1:
+                    lines[index] = {"code": code, "status": 400, "error": "Quantity must be at least 1"}
+                elif product is None:
+                    lines[index] = {"code": code, "status": 404, "error": f"Product not found: {code}"}
+                elif (line_id in seen or line is not None
+                      and (line["paid"] or line["product"]["product_id"] != product["product_id"])):
+                    lines[index] = {"code": code, "status": 409, "error": f"Line {line_id} cannot be changed"}
+                else:
+                    seen.add(line_id)
+                    changes.append((index, line_id, product, quantity, line["quantity"] if line else 0))
+            # Lines whose quantity did not change hold nothing more
+            holds = [(line_id, product["product_id"], quantity, basket_id)
+                     for _, line_id, product, quantity, old_quantity in changes if quantity != old_quantity]
+            held = iter(self.inventory.reserve_all(holds) if holds else [])
+            for index, line_id, product, quantity, old_quantity in changes:
+                discount_cents, promotion = 0, None
+                if quantity != old_quantity:
+                    if not next(held):
+                        lines[index] = {"code": items[index]["code"], "status": 409,
+                                        "error": f"{product['name']} is out of stock"}
+                        continue
+                    discount_cents, promotion = basket.pricing.add(product, quantity - old_quantity)
+                basket.lines[line_id] = {"product": product, "quantity": quantity, "paid": False}
+                lines[index] = {"line_id": line_id, "product": product, "quantity": quantity,
+                                "discount_cents": discount_cents, "coupon": promotion.name if discount_cents else None}
+            return {"lines": lines, **self._totals(basket)}
+
+    def remove_item(self, basket_id, line_id):
+        """Takes an unpaid line out of the basket and returns its units to stock."""
+        basket = self._basket(basket_id)
+        with basket.lock:
+            line = basket.lines.get(line_id)
+            if line is None:
+                raise CheckoutError(404, f"Unknown line: {line_id}")
+            if line["paid"]:
+                raise CheckoutError(409, f"Line {line_id} is already paid for")
+            self.inventory.release(line_id)
+            basket.pricing.add(line["product"], -line["quantity"])
+            del basket.lines[line_id]
+            return self._totals(basket)
+
+    def applied(self, basket_id):
+        """Returns the promotions applied to a basket and the total they save."""
+        basket = self._basket(basket_id)
+        with basket.lock:
+            return {"discount_cents": basket.pricing.discount_cents,
+                    "promotions": [{"product": product["name"], "coupon": promotion.name, "discount_cents": discount}
+                                   for product, promotion, discount in basket.pricing.applied()]}
+
+    def pay(self, basket_id, payment_id=None, use_points=False):
+        """Charges the customer's wallet for every unpaid line and records the sales.
+
+        With use_points, loyalty points cover as much of the charge as they
+        can. Paying again with the same payment_id returns the first result
+        without charging twice. Raises CheckoutError with status 402 if the
+        wallet cannot cover the charge, or 404 if the customer has no wallet.
+        """
+        basket = self._basket(basket_id)
+        payment_id = payment_id or new_id()
+        customer_id = basket.customer_id
+        with basket.lock:
+            if payment_id in basket.payments:
+                return basket.payments[payment_id]
+            unpaid = [(line_id, line) for line_id, line in basket.lines.items() if not line["paid"]]
+            if not unpaid:
+                raise CheckoutError(409, "Nothing to pay for")
+            # Holding each line again at its quantity only restarts its timeout, or fails if it was released
+            held = self.inventory.reserve_all([(line_id, line["product"]["product_id"], line["quantity"], basket_id)
+                                               for line_id, line in unpaid])
+            lost = [(line_id, line) for (line_id, line), ok in zip(unpaid, held) if not ok]
+            if lost:
+                # A released line cannot be held again, so it leaves the basket to be scanned again
+                for line_id, line in lost:
+                    basket.pricing.add(line["product"], -line["quantity"])
+                    del basket.lines[line_id]
+                names = ", ".join(line["product"]["name"] for _, line in lost)
+                raise CheckoutError(409, f"No longer held, please scan again: {names}")
+
+            # The discount on a product's unpaid units goes on its first unpaid line
+            priced = set()
+            sales = []
+            for line_id, line in unpaid:
+                product = line["product"]
+                discount, promotion = 0, None
+                if product["product_id"] not in priced:
+                    priced.add(product["product_id"])
+                    discount, promotion = basket.pricing.due(product["product_id"])
+                    discount = max(discount, 0)
+                sales.append((line_id, line, product["price_cents"] * line["quantity"], discount,
+                              promotion.name if promotion and discount else None))
+            due_cents = sum(amount - discount for _, _, amount, discount, _ in sales)
+
+            points_cents = 0
+            if use_points:
+                points_cents = self.loyalty.redeem_cents(customer_id, due_cents, "redeem:" + payment_id)
+            charged_cents = due_cents - points_cents
+            # Points redeemed for a charge that does not go through are given back, however it fails
+            try:
+                paid = self.wallets.transfer(customer_id, RETAILER_WALLET, charged_cents, "pay:" + payment_id)
+            except ValueError:
+                self.loyalty.refund_cents(customer_id, points_cents, "redeem:" + payment_id)
+                raise CheckoutError(409, f"Payment {payment_id} was already made for a different amount")
+            except KeyError as e:
+                self.loyalty.refund_cents(customer_id, points_cents, "redeem:" + payment_id)
+                raise CheckoutError(404, e.args[0])
+            except Exception:
+                self.loyalty.refund_cents(customer_id, points_cents, "redeem:" + payment_id)
+                raise
+            if not paid:
+                self.loyalty.refund_cents(customer_id, points_cents, "redeem:" + payment_id)
+                raise CheckoutError(402, "Insufficient balance")
+
+            self.inventory.commit_all(line_id for line_id, _, _, _, _ in sales)
+            points_left = points_cents
+            paid_so_far = 0
+            for line_id, line, amount, discount, coupon in sales:
+                line["paid"] = True
+                line_points = min(points_left, max(amount - discount, 0))
+                points_left -= line_points
+                line_paid = amount - discount - line_points
+                sale = {
+                    "product_id": line["product"]["product_id"],
+                    "name": line["product"]["name"],
+                    "quantity": line["quantity"],
+                    "unit_price_cents": line["product"]["price_cents"],
+                    "amount_cents": amount,
+                    "discount_cents": discount,
+                    "coupon": coupon,
+                    "customer_id": customer_id,
+                    "points_cents": line_points,
+                    "payment_id": payment_id,
+                    "line_id": line_id,
+                    "points_earned": points_earned(paid_so_far, line_paid),
+                }
+                paid_so_far += line_paid
+                seq = self.journal.append("sale", session_id=basket.session_id, basket_id=basket.basket_id, **sale)
+                # Queued with the sale's event ID, so replaying the journal cannot count it twice
+                self.loyalty.accrue_sale(seq, sale)
+            # The units just paid for keep this price whatever the promotions do later
+            for product_id in priced:
+                basket.pricing.settle(product_id)
+
+            result = {"payment_id": payment_id, "lines": len(sales), "charged_cents": charged_cents,
+                      "points_cents": points_cents, "discount_cents": sum(sale[3] for sale in sales),
+                      "balance_cents": self.wallets.balance_cents(customer_id)}
+            basket.payments[payment_id] = result
+            return result
+
+    def sales(self, session_id):
+        """Returns the sale records of one checkout session, for receipts."""
+        return list(self.journal.session_records(session_id, record_type="sale"))
+
+    def receive_sync(self, device_id, records):
+        """Applies journal records a device committed while offline and returns how far it is synced.
+
+        Records are applied once each, in sequence order: the retailer
+        wallet is credited with what the customer paid, sold units leave
+        stock and each sale is added to this journal, tagged with the device
+        and its sequence number, for the dashboard. Records at or before
+        the device's acked_seq are skipped, so a retried batch is harmless;
+        a batch that does not follow on is refused after the point where it
+        stops following on. A "parked" or "gap" stand-in the device sends
+        for a record it cannot send is recorded as a conflict and moved
+        past. Returns {"acked_seq", "conflicts"}, where
+        conflicts are those this batch raised. A malformed record refuses
+        the whole batch with CheckoutError(400) before any of it is applied.
+        """
+        if not isinstance(records, list):
+            raise CheckoutError(400, "Sync records must be a list")
+        for record in records:
+            _check_synced(record)
+        records = sorted(records, key=lambda record: record["seq"])
+        with self._sync_lock:
+            acked_seq = self.inventory.synced_seq(device_id)
+            fresh = []
+            for record in records:
+                if record["seq"] <= acked_seq + len(fresh):
+                    continue
+                if record["seq"] != acked_seq + len(fresh) + 1:
+                    break
+                fresh.append(record)
+            if not fresh:
+                return {"acked_seq": acked_seq, "conflicts": []}
+            sales = [record for record in fresh if record["type"] == "sale"]
+            # Credited and journaled before the batch is acked, each keyed by device and sequence number, so a
+            # batch that fails part way is resent and only what is still missing is added
+            self.wallets.credit_many(RETAILER_WALLET, [(f"sync:{device_id}:{record['seq']}", paid_cents(record))
+                                                       for record in sales])
+            if sales:
+                journaled = self.journal.synced_seqs(device_id, sales[0]["seq"], sales[-1]["seq"])
+                for record in sales:
+                    if record["seq"] in journaled:
+                        continue
+                    sale = {name: record[name] for name in SYNCED_SALE_FIELDS if name in record}
+                    sale.update(device_id=device_id, device_seq=record["seq"])
+                    if "ts" in record:
+                        # This journal's ts is when the sale was synced; analytics counts it when it was made
+                        sale["sold_at"] = record["ts"]
+                    seq = self.journal.append("sale", **sale)
+                    # Points for a sale journaled before a crash are accrued by catch_up() when the server starts
+                    if record.get("customer_id"):
+                        self.loyalty.accrue_sale(seq, sale)
+                self.journal.flush()
+                if len(self.journal.synced_seqs(device_id, sales[0]["seq"], sales[-1]["seq"])) < len(sales):
+                    raise CheckoutError(503, "Could not record the synced sales, please retry")
+            acked_seq, conflicts = self.inventory.apply_synced(device_id, fresh)
+            return {"acked_seq": acked_seq, "conflicts": conflicts}
+
+    def sales_report(self, top=10, days=7, hours=24, utc_offset=None):
+        """Returns the best sellers and the revenue by day and by hour from the sales in this journal.
+
+        The aggregates are caught up with the sales recorded since the last
+        report first. top_items are dicts with each product's units,
+        revenue_cents and sell_through, the share of its units sold out of
+        those sold and still in stock. daily_revenue and hourly_revenue are
+        [label, revenue_cents] pairs, oldest first, in this machine's time
+        zone or at utc_offset seconds from UTC.
+        """
+        self.journal.flush()
+        with self._analytics_lock:
+            self.analytics.update()
+            top_items = self.analytics.top_items(top)
+            with self.catalogs.connection() as catalog:
+                rates = self.analytics.sell_through(catalog, [item[0] for item in top_items])
+            daily = self.analytics.daily_revenue(days, utc_offset=utc_offset)
+            hourly = self.analytics.hourly_revenue(hours, utc_offset=utc_offset)
+        return {
+            "top_items": [{"product_id": product_id, "name": name, "units": units, "revenue_cents": revenue_cents,
+                           "sell_through": rates[product_id]}
+                          for product_id, name, units, revenue_cents in top_items],
+            "daily_revenue": [list(entry) for entry in daily],
+            "hourly_revenue": [list(entry) for entry in hourly],
+        }
+
+    def sync_status(self, device_id, after_id=None, limit=100):
+        """Returns the last sequence number applied from a device and a page of the conflicts its records raised."""
+        return {"device_id": device_id, "acked_seq": self.inventory.synced_seq(device_id),
+                "conflicts": self.inventory.sync_conflicts(device_id, after_id, limit)}
+
+    def close(self):
+        """Writes any queued sales and points, saves the sales aggregates and closes the stores."""
+        self.journal.close()
+        with self._analytics_lock:
+            self.analytics.save()
+        self.loyalty.close()
+        self.inventory.close()
+        self.promotions.close()
+        self.wallets.close()
+        self.catalogs.close()
@@ -0,0 +1,332 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from urllib.parse import quote, urlencode
+
+from checkout import CheckoutError
+from checkout_server import DEFAULT_PORT
+from journal import new_id
+
+# Request bodies at least this many bytes long are sent deflated
+COMPRESS_MIN = 1024
+
+
+def parse_address(address):
+    """Splits "host:port" into (host, port), using the default port if there is none."""
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return host or "127.0.0.1", int(port or DEFAULT_PORT)
+
+
+def encode_request(method, path, payload=None, host="localhost"):
+    """Returns an HTTP/1.1 request with an optional JSON body, deflated if it is large."""
+    body = b"" if payload is None else json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    encoding = None
+    if len(body) >= COMPRESS_MIN:
+        body = zlib.compress(body)
+        encoding = "deflate"
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n"
+    if body:
+        head += "Content-Type: application/json\r\n"
+    if encoding:
+        head += f"Content-Encoding: {encoding}\r\n"
+    return head.encode("ascii") + b"\r\n" + body
+
+
+def parse_head(head):
+    """Returns (status, content_length) from a response's status line and headers."""
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, length
+
+
+def decode_response(status, body):
+    """Returns the decoded body of a response, raising CheckoutError for an error status."""
+    payload = json.loads(body) if body else None
+    if status >= 400:
+        raise CheckoutError(status, (payload or {}).get("error", f"HTTP {status}"))
+    return payload
+
+
+def _segment(value):
+    """Returns an ID or code quoted to be one segment of a request path."""
+    return quote(value, safe="")
+
+
+def _encode_query(**params):
+    """Returns a query string of the parameters that are not None."""
+    return urlencode({name: value for name, value in params.items() if value is not None})
+
+
+# The checkout endpoints; the clients supply _call(method, path, payload, repeatable), where a repeatable request
+# has the same effect sent twice: a GET, or a POST carrying an ID the server remembers, which is required here
+class _Endpoints:
+    def health(self):
+        """Returns {"ok": True} if the server is up."""
+        return self._call("GET", "/health")
+
+    def lookup(self, code):
+        """Returns the product for a product ID or EAN/UPC code; raises CheckoutError 404 if it is unknown."""
+        return self._call("GET", f"/products/{_segment(code)}")
+
+    def products(self, offset=0, limit=None, search=None, category=None, max_stock=None):
+        """Returns products ordered by name with their stock, filtered by search text, category and stock."""
+        return self._call("GET", "/catalog?" + _encode_query(offset=offset, limit=limit, search=search,
+                                                             category=category, max_stock=max_stock))
+
+    def count_products(self, search=None, category=None, max_stock=None):
+        """Returns the number of products matching the products() filters."""
+        return self._call("GET", "/catalog/count?" + _encode_query(search=search, category=category,
+                                                                   max_stock=max_stock))
+
+    def categories(self):
+        """Returns the distinct product categories in alphabetical order."""
+        return self._call("GET", "/categories")
+
+    def stock(self, product_ids):
+        """Returns {product_id: stock} for the given products."""
+        return self._call("GET", "/stock?ids=" + ",".join(_segment(i) for i in product_ids))
+
+    def low_stock_events(self, after_id=None, limit=100):
+        """Returns low-stock events, the ones after after_id or else the most recent, oldest first."""
+        return self._call("GET", "/low-stock?" + _encode_query(after=after_id, limit=limit))
+
+    def coupons(self, limit=20):
+        """Returns how many promotions are running and the newest limit of them."""
+        return self._call("GET", f"/coupons?limit={limit}")
+
+    def add_coupon(self, name, kind, scope, target, value, coupon_id=None):
+        """Adds an active promotion and returns it; raises CheckoutError 400 for an invalid one."""
+        return self._call("POST", "/coupons", {"name": name, "kind": kind, "scope": scope, "target": target,
+                                               "value": value, "coupon_id": coupon_id or new_id()},
+                          repeatable=True)
+
+    def wallet(self, customer_id):
+        """Returns a customer's wallet balance in cents and loyalty points."""
+        return self._call("GET", f"/wallets/{_segment(customer_id)}")
+
+    def open_basket(self, customer_id, session_id=None, basket_id=None):
+        """Opens a basket and returns its basket and session IDs."""
+        return self._call("POST", "/baskets", {"customer_id": customer_id, "session_id": session_id,
+                                               "basket_id": basket_id or new_id()}, repeatable=True)
+
+    def close_basket(self, basket_id):
+        """Returns the basket's unpaid lines to stock and closes it."""
+        return self._call("DELETE", f"/baskets/{_segment(basket_id)}")
+
+    def add_item(self, basket_id, code, quantity=1, *, line_id):
+        """Sets a basket line to quantity units of a product and returns the line and basket totals."""
+        return self._call("POST", f"/baskets/{_segment(basket_id)}/items",
+                          {"code": code, "quantity": quantity, "line_id": line_id}, repeatable=True)
+
+    def add_items(self, basket_id, items):
+        """Sets several basket lines in one request and returns each line, or its error, and the basket totals.
+
+        Every item must have a line_id; raises ValueError otherwise.
+        """
+        if not all(item.get("line_id") for item in items):
+            raise ValueError("Every item needs a line_id")
+        return self._call("POST", f"/baskets/{_segment(basket_id)}/items/batch", {"items": items}, repeatable=True)
+
+    def remove_item(self, basket_id, line_id):
+        """Takes an unpaid line out of the basket."""
+        return self._call("DELETE", f"/baskets/{_segment(basket_id)}/items/{_segment(line_id)}")
+
+    def applied(self, basket_id):
+        """Returns the promotions applied to a basket and the total they save."""
+        return self._call("GET", f"/baskets/{_segment(basket_id)}/coupons")
+
+    def pay(self, basket_id, payment_id, use_points=False):
+        """Pays for the basket's unpaid lines; raises CheckoutError with status 402 if the wallet is short."""
+        return self._call("POST", f"/baskets/{_segment(basket_id)}/pay",
+                          {"payment_id": payment_id, "use_points": use_points}, repeatable=True)
+
+    def sales(self, session_id):
+        """Returns the sale records of one checkout session."""
+        return self._call("GET", f"/sessions/{_segment(session_id)}/sales")
+
+    def sales_report(self, top=10, days=7, hours=24, utc_offset=None):
+        """Returns the best sellers and revenue by day and hour, in this machine's time zone or at utc_offset."""
+        utc_offset = time.localtime().tm_gmtoff if utc_offset is None else utc_offset
+        return self._call("GET", "/sales/report?" + _encode_query(top=top, days=days, hours=hours,
+                                                                 utc_offset=utc_offset))
+
+    def receive_sync(self, device_id, records):
+        """Sends journal records a device committed offline and returns how far the device is synced."""
+        return self._call("POST", "/sync", {"device_id": device_id, "records": records}, repeatable=True)
+
+    def sync_status(self, device_id, after_id=None, limit=100):
+        """Returns the last sequence number applied from a device and a page of its sync conflicts."""
+        return self._call("GET", f"/sync/{_segment(device_id)}?after={after_id or 0}&limit={limit}")
+
+
+# Blocking client for the checkout server over one kept-alive connection
+class CheckoutClient(_Endpoints):
+    def __init__(self, address=f"127.0.0.1:{DEFAULT_PORT}", timeout=5.0):
+        """Initializes the client; the connection is opened on the first request and reopened if it drops.
+
+        It has the same methods as CheckoutService, so the apps can use
+        either one. Calls may come from any thread; they take turns on the
+        connection.
+        """
+        self.host, self.port = parse_address(address)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        """Opens the connection."""
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+
+    def _disconnect(self):
+        """Closes the connection."""
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = self._file = None
+
+    def _stale(self):
+        """Returns True if the server has closed the kept-alive connection since the last response."""
+        self._sock.setblocking(False)
+        try:
+            return self._sock.recv(1, socket.MSG_PEEK) == b""
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self._sock.settimeout(self.timeout)
+
+    def _read_response(self):
+        """Reads one response and returns (status, body)."""
+        head = b""
+        while not head.endswith(b"\r\n\r\n"):
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("Connection closed by the checkout server")
+            head += line
+        status, length = parse_head(head)
+        return status, self._file.read(length)
+
+    def pipeline(self, requests, repeatable=False):
+        """Sends (method, path, payload) requests without waiting between them and returns their results in order.
+
+        Each result is the decoded body, or the CheckoutError for a request
+        that failed. A connection the server has closed is reopened before
+        sending. If it fails once the batch is on its way, such as on a
+        timeout, the server may already have carried out some of it, so
+        the batch is only sent again if the caller says every request in it
+        is repeatable; otherwise the OSError is raised.
+        """
+        data = b"".join(encode_request(method, path, payload, self.host) for method, path, payload in requests)
+        with self._lock:
+            for attempt in (1, 2):
+                sending = False
+                try:
+                    if self._sock is not None and self._stale():
+                        self._disconnect()
+                    if self._sock is None:
+                        self._connect()
+                    sending = True
+                    self._sock.sendall(data)
+                    responses = [self._read_response() for _ in requests]
+                    break
+                except OSError:
+                    self._disconnect()
+                    if attempt == 2 or (sending and not repeatable):
+                        raise
+        results = []
+        for status, body in responses:
+            try:
+                results.append(decode_response(status, body))
+            except CheckoutError as e:
+                results.append(e)
+        return results
+
+    def _call(self, method, path, payload=None, repeatable=False):
+        """Sends one request and returns its decoded body, raising CheckoutError for an error."""
+        result = self.pipeline([(method, path, payload)], repeatable or method == "GET")[0]
+        if isinstance(result, CheckoutError):
+            raise result
+        return result
+
+    def lookup(self, code):
+        """Returns the product for a product ID or EAN/UPC code, or None if it is unknown, as CheckoutService does."""
+        try:
+            return super().lookup(code)
+        except CheckoutError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def close(self):
+        """Closes the connection."""
+        with self._lock:
+            self._disconnect()
+
+
+# asyncio client for the checkout server over one kept-alive connection, for load tests and async callers
+class AsyncCheckoutClient(_Endpoints):
+    def __init__(self, address=f"127.0.0.1:{DEFAULT_PORT}"):
+        """Initializes the client; call connect() before the first request."""
+        self.host, self.port = parse_address(address)
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        """Opens the connection."""
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def _read_response(self):
+        """Reads one response and returns (status, body)."""
+        status, length = parse_head(await self._reader.readuntil(b"\r\n\r\n"))
+        return status, await self._reader.readexactly(length)
+
+    async def pipeline(self, requests):
+        """Sends (method, path, payload) requests in one write and returns their results in order.
+
+        Each result is the decoded body, or the CheckoutError for a request
+        that failed.
+        """
+        async with self._lock:
+            self._writer.write(b"".join(encode_request(m, p, b, self.host) for m, p, b in requests))
+            await self._writer.drain()
+            responses = [await self._read_response() for _ in requests]
+        results = []
+        for status, body in responses:
+            try:
+                results.append(decode_response(status, body))
+            except CheckoutError as e:
+                results.append(e)
+        return results
+
+    async def _call(self, method, path, payload=None, repeatable=False):
+        """Sends one request and returns its decoded body, raising CheckoutError for an error; it is never resent."""
+        result = (await self.pipeline([(method, path, payload)]))[0]
+        if isinstance(result, CheckoutError):
+            raise result
+        return result
+
+    async def close(self):
+        """Closes the connection."""
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+
+def connect_from_env():
+    """Returns a CheckoutClient for the server named by GOBUY_SERVER ("host:port"), or None if it is not set."""
+    address = os.environ.get("GOBUY_SERVER")
+    return CheckoutClient(address) if address else None
@@ -0,0 +1,297 @@
+"""Local checkout server shared by the customer and retailer apps.
+
+Serves CheckoutService over HTTP/1.1 with JSON bodies, which clients may
+deflate. Connections are kept alive and requests may be pipelined: a
+client can send several requests without waiting, and the answers come
+back in the same order.
+
+The server is for the apps on this machine: it listens on 127.0.0.1 by
+default and does not authenticate clients, so any client can read any
+wallet. Wallets are not created over HTTP but when the server is set up,
+with --wallet.
+
+Run from the repository root:
+    python -m checkout_server --port 8765 --wallet customer=100
+"""
+import argparse
+import asyncio
+import json
+import re
+import signal
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import metrics
+from checkout import CheckoutError, CheckoutService
+
+DEFAULT_PORT = 8765
+
+# Largest request body accepted, in bytes, before and after inflating a deflated one
+MAX_BODY = 1024 * 1024
+MAX_DECODED_BODY = 16 * 1024 * 1024
+
+# Seconds between sweeps for abandoned baskets
+EXPIRY_INTERVAL = 60
+
+REASONS = {200: "OK", 400: "Bad Request", 402: "Payment Required", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def _query(query, name, default=None):
+    """Returns the first value of a query string parameter."""
+    return query.get(name, [default])[0]
+
+
+def _number(query, name):
+    """Returns a whole-number query string parameter, or None if it is not given."""
+    value = _query(query, name)
+    return None if value is None else int(value)
+
+
+def _filters(query):
+    """Returns the product list filters given in a query string as keyword arguments."""
+    return {"search": _query(query, "search"), "category": _query(query, "category"),
+            "max_stock": _number(query, "max_stock")}
+
+
+# (method, path pattern, handler(service, match, query, body)) for each endpoint
+ROUTES = [
+    ("GET", r"/health", lambda s, m, q, b: {"ok": True}),
+    ("GET", r"/products/([^/]+)", lambda s, m, q, b: s.lookup(m[1]) or _not_found(f"Product not found: {m[1]}")),
+    ("GET", r"/catalog",
+     lambda s, m, q, b: s.products(int(_query(q, "offset", 0)), _number(q, "limit"), **_filters(q))),
+    ("GET", r"/catalog/count", lambda s, m, q, b: s.count_products(**_filters(q))),
+    ("GET", r"/categories", lambda s, m, q, b: s.categories()),
+    ("GET", r"/stock", lambda s, m, q, b: s.stock([i for i in _query(q, "ids", "").split(",") if i])),
+    ("GET", r"/low-stock", lambda s, m, q, b: s.low_stock_events(_number(q, "after"), int(_query(q, "limit", 100)))),
+    ("GET", r"/coupons", lambda s, m, q, b: s.coupons(int(_query(q, "limit", 20)))),
+    ("POST", r"/coupons",
+     lambda s, m, q, b: s.add_coupon(b["name"], b["kind"], b["scope"], b["target"], int(b["value"]),
+                                     b.get("coupon_id"))),
+    ("GET", r"/wallets/([^/]+)", lambda s, m, q, b: s.wallet(m[1])),
+    ("POST", r"/baskets",
+     lambda s, m, q, b: s.open_basket(b["customer_id"], b.get("session_id"), b.get("basket_id"))),
+    ("DELETE", r"/baskets/([^/]+)", lambda s, m, q, b: {"closed": s.close_basket(m[1])}),
+    ("GET", r"/baskets/([^/]+)/coupons", lambda s, m, q, b: s.applied(m[1])),
+    ("POST", r"/baskets/([^/]+)/items",
+     lambda s, m, q, b: s.add_item(m[1], b["code"], int(b.get("quantity", 1)), b.get("line_id"))),
+    ("POST", r"/baskets/([^/]+)/items/batch", lambda s, m, q, b: s.add_items(m[1], b["items"])),
+    ("DELETE", r"/baskets/([^/]+)/items/([^/]+)", lambda s, m, q, b: s.remove_item(m[1], m[2])),
+    ("POST", r"/baskets/([^/]+)/pay",
+     lambda s, m, q, b: s.pay(m[1], b.get("payment_id"), bool(b.get("use_points")))),
+    ("GET", r"/sessions/([^/]+)/sales", lambda s, m, q, b: s.sales(m[1])),
+    ("GET", r"/sales/report",
+     lambda s, m, q, b: s.sales_report(int(_query(q, "top", 10)), int(_query(q, "days", 7)),
+                                       int(_query(q, "hours", 24)), _number(q, "utc_offset"))),
+    ("POST", r"/sync", lambda s, m, q, b: s.receive_sync(b["device_id"], b["records"])),
+    ("GET", r"/sync/([^/]+)",
+     lambda s, m, q, b: s.sync_status(m[1], int(_query(q, "after", 0)), int(_query(q, "limit", 100)))),
+]
+ROUTES = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in ROUTES]
+
+
+def _not_found(message):
+    """Raises a 404 CheckoutError."""
+    raise CheckoutError(404, message)
+
+
+def _decode_body(body, encoding):
+    """Returns a request body with its content encoding undone."""
+    if encoding in ("", "identity"):
+        return body
+    if encoding != "deflate":
+        raise ValueError(f"Unsupported content encoding: {encoding}")
+    inflater = zlib.decompressobj()
+    try:
+        decoded = inflater.decompress(body, MAX_DECODED_BODY)
+    except zlib.error as e:
+        raise ValueError(f"Bad deflated body: {e}")
+    if inflater.unconsumed_tail:
+        raise ValueError("Request body too large")
+    return decoded
+
+
+def _response(status, payload, keep_alive=True):
+    """Returns an HTTP response with a JSON body."""
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode("ascii") + body
+
+
+# asyncio HTTP front end for a CheckoutService
+class CheckoutServer:
+    def __init__(self, service, host="127.0.0.1", port=DEFAULT_PORT, workers=32):
+        """Initializes the server for a service.
+
+        The service's calls block on SQLite, so they run on a pool of
+        workers threads while the event loop keeps reading and writing
+        connections. Many threads also let the stock and points services
+        group-commit the work of many shoppers in one transaction.
+        """
+        self.service = service
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="checkout")
+        self._server = None
+        self._expiry = None
+
+    async def start(self):
+        """Starts listening and returns the port, which is chosen by the OS if port was 0."""
+        self._server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._expiry = asyncio.ensure_future(self._expire_baskets())
+        return self.port
+
+    async def close(self):
+        """Stops accepting connections and waits for running requests."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def _expire_baskets(self):
+        """Periodically returns stock held by baskets that were abandoned."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(EXPIRY_INTERVAL)
+            await loop.run_in_executor(self.executor, self.service.release_expired)
+
+    async def _serve_connection(self, reader, writer):
+        """Answers requests on one connection, in order, until the client closes it."""
+        metrics.inc("server.connections")
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await self._dispatch(method, target, body)
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down with the client still connected
+            pass
+        except (ValueError, asyncio.LimitOverrunError) as e:
+            writer.write(_response(400, {"error": str(e)}, keep_alive=False))
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        """Reads one request and returns (method, target, headers, body), or None at end of stream."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise ValueError("Incomplete request")
+            return None
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise ValueError(f"Bad request line: {lines[0]!r}")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, _decode_body(body, headers.get("content-encoding", "").lower())
+
+    async def _dispatch(self, method, target, body):
+        """Runs the endpoint for a request and returns (status, payload)."""
+        url = urlsplit(target)
+        allowed = False
+        for route_method, pattern, handler in ROUTES:
+            match = pattern.match(url.path)
+            if not match:
+                continue
+            allowed = True
+            if route_method != method:
+                continue
+            try:
+                arguments = json.loads(body) if body else {}
+                query = parse_qs(url.query)
+                # Matched on the encoded path so an encoded "/" stays inside its segment, then decoded
+                captures = (match[0],) + tuple(unquote(group) for group in match.groups())
+                with metrics.span("server.request"):
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, handler, self.service, captures, query, arguments)
+                return 200, result
+            except CheckoutError as e:
+                return e.status, {"error": e.message}
+            except (KeyError, TypeError, ValueError) as e:
+                return 400, {"error": f"Bad request: {e}"}
+            except Exception as e:
+                print(f"Error handling {method} {url.path}: {e}")
+                return 500, {"error": "Internal error"}
+        if allowed:
+            return 405, {"error": f"{method} not allowed on {url.path}"}
+        return 404, {"error": f"No endpoint {url.path}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=32, help="threads running checkout operations")
+    parser.add_argument("--pool-size", type=int, default=4, help="catalog read connections")
+    parser.add_argument("--catalog", default=None, help="catalog database path")
+    parser.add_argument("--wallets", default=None, help="wallet database path")
+    parser.add_argument("--journal", default=None, help="transaction journal path")
+    parser.add_argument("--fsync", default="commit", help="journal fsync policy")
+    parser.add_argument("--wallet", action="append", default=[], metavar="CUSTOMER_ID=DOLLARS",
+                        help="open a customer's wallet with an initial balance if it does not exist; repeatable")
+    args = parser.parse_args()
+    wallets = [spec.partition("=")[::2] for spec in args.wallet]
+
+    metrics.configure_from_env()
+    paths = {name: value for name, value in (("catalog_path", args.catalog), ("wallet_path", args.wallets),
+                                               ("journal_path", args.journal)) if value}
+    service = CheckoutService(pool_size=args.pool_size, journal_fsync=args.fsync, **paths)
+    try:
+        for customer_id, balance in wallets:
+            service.open_wallet(customer_id, balance or 0)
+    except CheckoutError as e:
+        service.close()
+        parser.error(str(e))
+    server = CheckoutServer(service, args.host, args.port, args.workers)
+
+    async def run():
+        port = await server.start()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                # Not available on Windows, where Ctrl+C raises KeyboardInterrupt instead
+                pass
+        print(f"Checkout server listening on {args.host}:{port}", flush=True)
+        try:
+            await stop.wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        metrics.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import cv2
+
+from decoders import make_decoder
+
+# Guide box from the barCodeReadingFeature prototype, as (left, top, right, bottom) in a 640x480 frame
+GUIDE_BOX = (220, 140, 420, 340)
+
+# Frame size that guide boxes are given in; they are scaled to the size of the frames actually captured
+GUIDE_FRAME_SIZE = (640, 480)
+
+
+def scale_box(box, frame):
+    """Returns a (left, top, right, bottom) box given in a GUIDE_FRAME_SIZE frame scaled to the frame's size."""
+    height, width = frame.shape[:2]
+    if (width, height) == GUIDE_FRAME_SIZE:
+        return box
+    scale_x, scale_y = width / GUIDE_FRAME_SIZE[0], height / GUIDE_FRAME_SIZE[1]
+    left, top, right, bottom = box
+    return (int(left * scale_x), int(top * scale_y), int(right * scale_x), int(bottom * scale_y))
+
+
+# Decodes a cropped, grayscale region of the frame and falls back to the full frame periodically
+class RegionDecoder:
+    def __init__(self, decode_fn, box=GUIDE_BOX, grayscale=True, downsample=1,
+                 full_frame_every=10, track=False, track_margin=40, track_timeout=15):
+        """Initializes the region decoder around a decode function.
+
+        box is the (left, top, right, bottom) region handed to decode_fn,
+        given in a 640x480 frame and scaled to the frames decoded, and
+        downsample shrinks it by that integer factor first. When nothing is
+        found in the region, every full_frame_every-th miss decodes the whole
+        frame instead. With track enabled the region follows the last code
+        found, padded by track_margin, until track_timeout frames pass without
+        a hit.
+        """
+        self.decode_fn = decode_fn
+        self.guide_box = box
+        # The box around the last code found while tracking, in frame coordinates; None for the guide box
+        self.box = None
+        self.grayscale = grayscale
+        self.downsample = max(1, int(downsample))
+        self.full_frame_every = full_frame_every
+        self.track = track
+        self.track_margin = track_margin
+        self.track_timeout = track_timeout
+        self.misses = 0
+
+    def __call__(self, frame):
+        """Decodes the region of interest, or the full frame on every N-th miss."""
+        box = self.box if self.box is not None else scale_box(self.guide_box, frame)
+        left, top, right, bottom = self._clip(box, frame)
+        results = self._decode(frame[top:bottom, left:right], left, top, self.downsample)
+        if not results and self.full_frame_every and (self.misses + 1) % self.full_frame_every == 0:
+            results = self._decode(frame, 0, 0, 1)
+
+        if results:
+            self.misses = 0
+            if self.track:
+                self.box = self._padded(results[0].rect)
+        else:
+            self.misses += 1
+            if self.track and self.misses >= self.track_timeout:
+                self.box = None
+        return results
+
+    def _decode(self, image, offset_x, offset_y, scale):
+        """Runs decode_fn on a prepared image and maps the results back to frame coordinates."""
+        if image.size == 0:
+            return []
+        if self.grayscale and image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if scale > 1:
+            image = cv2.resize(image, (image.shape[1] // scale, image.shape[0] // scale),
+                               interpolation=cv2.INTER_AREA)
+        results = self.decode_fn(image)
+        if offset_x == 0 and offset_y == 0 and scale == 1:
+            return results
+        return [_to_frame_coords(obj, offset_x, offset_y, scale) for obj in results]
+
+    def _clip(self, box, frame):
+        """Clips a box to the frame bounds."""
+        height, width = frame.shape[:2]
+        left, top, right, bottom = box
+        return max(0, left), max(0, top), min(width, right), min(height, bottom)
+
+    def _padded(self, rect):
+        """Returns a tracking box around a decoded symbol's rectangle."""
+        left, top, width, height = rect
+        margin = self.track_margin
+        return (left - margin, top - margin, left + width + margin, top + height + margin)
+
+
+def make_scan_decoder(decoder="pyzbar", symbology=None, decode_mode="roi", roi_box=GUIDE_BOX,
+                      downsample=1, full_frame_every=10, track_roi=False, multi=False):
+    """Returns the per-frame decode function the scanner preview runs on its decode worker.
+
+    decoder is a backend name from decoders.BACKENDS or "auto". In "roi"
+    mode the backend is wrapped in a RegionDecoder; any other mode decodes
+    whole frames. multi makes the backend report every code it finds
+    rather than the first, for batch scanning.
+    """
+    decode = make_decoder(decoder, symbology, multi)
+    if decode_mode != "roi":
+        return decode
+    return RegionDecoder(decode, box=roi_box, downsample=downsample,
+                         full_frame_every=full_frame_every, track=track_roi)
+
+
+def _to_frame_coords(obj, offset_x, offset_y, scale):
+    """Translates a decoded symbol's rectangle and polygon from region to frame coordinates."""
+    left, top, width, height = obj.rect
+    rect = type(obj.rect)(left * scale + offset_x, top * scale + offset_y, width * scale, height * scale)
+    fields = {"rect": rect}
+    polygon = getattr(obj, "polygon", None)
+    if polygon:
+        fields["polygon"] = [type(point)(point[0] * scale + offset_x, point[1] * scale + offset_y)
+                             for point in polygon]
+    return obj._replace(**fields)
@@ -0,0 +1,108 @@
+import threading
+from collections import deque
+
+import metrics
+from ui_thread import schedule_on_ui_thread
+
+
+# Counters describing how frames move through the decode pipeline
+class DecodeStats:
+    def __init__(self):
+        """Initializes all pipeline counters to zero."""
+        self._lock = threading.Lock()
+        self.frames_captured = 0
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+
+    def increment(self, name, amount=1):
+        """Adds the given amount to one of the counters."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        """Returns a copy of the counters as a dictionary."""
+        with self._lock:
+            return {
+                "frames_captured": self.frames_captured,
+                "frames_decoded": self.frames_decoded,
+                "frames_dropped": self.frames_dropped,
+                "frames_skipped": self.frames_skipped,
+            }
+
+
+# Background worker that decodes the newest camera frames off the UI thread
+class DecodeWorker:
+    def __init__(self, decode_fn, on_result, max_pending=1, dispatch=None, gate=None):
+        """Initializes the worker with a decode function and a result callback.
+
+        Frames wait in a bounded queue of size max_pending; when it is full
+        the oldest frame is dropped so the worker always sees the newest one.
+        If a gate (a FrameGate) is given, frames it does not admit are
+        skipped without decoding. Non-empty results are passed to on_result
+        through dispatch, which defaults to Kivy's Clock.schedule_once.
+        """
+        self.decode_fn = decode_fn
+        self.gate = gate
+        self.on_result = on_result
+        self.dispatch = dispatch or schedule_on_ui_thread
+        self.stats = DecodeStats()
+        self._pending = deque(maxlen=max_pending)
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts the decode thread if it is not already running."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="decode-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        """Stops the decode thread and discards any frames still waiting."""
+        with self._condition:
+            self._running = False
+            self._pending.clear()
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, frame):
+        """Queues a frame for decoding, dropping the oldest one if the queue is full."""
+        self.stats.increment("frames_captured")
+        metrics.inc("decode.frames_captured")
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self.stats.increment("frames_dropped")
+                metrics.inc("decode.frames_dropped")
+            self._pending.append(frame)
+            self._condition.notify()
+
+    def _run(self):
+        """Decodes queued frames until the worker is stopped."""
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                frame = self._pending.popleft()
+            try:
+                if self.gate is not None and not self.gate.admit(frame):
+                    self.stats.increment("frames_skipped")
+                    continue
+                with metrics.span("decode"):
+                    result = self.decode_fn(frame)
+            except Exception as e:
+                metrics.inc("decode.errors")
+                print(f"An error occurred during decoding: {e}")
+                continue
+            self.stats.increment("frames_decoded")
+            metrics.inc("decode.frames_decoded")
+            if result:
+                metrics.inc("decode.hits")
+                self.dispatch(self.on_result, result)
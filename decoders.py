@@ -0,0 +1,302 @@
+import abc
+import collections
+import functools
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# Results use pyzbar's field names so pyzbar's own Decoded tuples can be used interchangeably
+Rect = collections.namedtuple("Rect", "left top width height")
+Point = collections.namedtuple("Point", "x y")
+Symbol = collections.namedtuple("Symbol", "data type rect polygon")
+
+# Symbol types worth trying for each kind of code the apps scan
+SYMBOLOGIES = {
+    # Wallet codes
+    "qr": ("QRCODE",),
+    # Retail EAN/UPC codes printed on product packaging
+    "product": ("EAN13", "EAN8", "UPCA", "UPCE"),
+    # The Code128 and QR labels that labels.py prints for in-store products
+    "label": ("CODE128", "QRCODE"),
+}
+
+
+def _symbol(data, symbol_type, points):
+    """Builds a Symbol from decoded text and the corner points of the code."""
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    x, y, w, h = cv2.boundingRect(points)
+    polygon = [Point(int(px), int(py)) for px, py in points]
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return Symbol(data, symbol_type, Rect(x, y, w, h), polygon)
+
+
+# Base class for decoder backends
+class Decoder(abc.ABC):
+    name = "base"
+    types = ()
+
+    def __init__(self, symbology=None, multi=False):
+        """Initializes the decoder, limiting it to SYMBOLOGIES entries when symbology names one or a tuple of them.
+
+        With multi, backends that stop at the first code they find look for
+        every code in the image instead, which costs them more per frame.
+        """
+        self.multi = multi
+        names = (symbology,) if isinstance(symbology, str) else symbology
+        wanted = {t for name in names for t in SYMBOLOGIES[name]} if names else None
+        self.symbol_types = tuple(t for t in self.types if wanted is None or t in wanted)
+
+    @classmethod
+    def available(cls):
+        """Returns True if the backend's library can be used here."""
+        return True
+
+    def __call__(self, image):
+        """Decodes a BGR or grayscale image and returns a list of Symbols."""
+        if not self.symbol_types:
+            return []
+        return self.decode(image)
+
+    @abc.abstractmethod
+    def decode(self, image):
+        """Decodes an image with the backend and returns a list of Symbols of the wanted types."""
+
+
+# zbar through pyzbar, the backend the apps have always used
+class PyzbarDecoder(Decoder):
+    name = "pyzbar"
+    types = ("QRCODE", "EAN13", "EAN8", "UPCA", "UPCE", "CODE128", "CODE39", "I25")
+
+    def __init__(self, symbology=None, multi=False):
+        """Initializes the decoder and the zbar symbol filter."""
+        super().__init__(symbology, multi)
+        from pyzbar.pyzbar import ZBarSymbol, decode
+        self._decode = decode
+        # Telling zbar which symbologies to look for skips the scanners for all the others
+        self._symbols = [ZBarSymbol[t] for t in self.symbol_types]
+
+    @classmethod
+    def available(cls):
+        try:
+            import pyzbar.pyzbar  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def decode(self, image):
+        return self._decode(image, symbols=self._symbols)
+
+
+# OpenCV's QR code detector
+class OpenCVQRDecoder(Decoder):
+    name = "opencv-qr"
+    types = ("QRCODE",)
+
+    def __init__(self, symbology=None, multi=False):
+        """Initializes the decoder and its detector."""
+        super().__init__(symbology, multi)
+        self._detector = cv2.QRCodeDetector()
+
+    def decode(self, image):
+        if self.multi:
+            ok, texts, points, _ = self._detector.detectAndDecodeMulti(image)
+            if not ok or points is None:
+                return []
+            return [_symbol(text, "QRCODE", corners) for text, corners in zip(texts, points) if text]
+        data, points, _ = self._detector.detectAndDecode(image)
+        if not data or points is None:
+            return []
+        return [_symbol(data, "QRCODE", points)]
+
+
+# OpenCV's 1D barcode detector (EAN/UPC)
+class OpenCVBarcodeDecoder(Decoder):
+    name = "opencv-barcode"
+    types = ("EAN13", "EAN8", "UPCA", "UPCE")
+
+    def __init__(self, symbology=None, multi=False):
+        """Initializes the decoder and its detector."""
+        super().__init__(symbology, multi)
+        factory = getattr(getattr(cv2, "barcode", None), "BarcodeDetector", None) or cv2.barcode_BarcodeDetector
+        self._detector = factory()
+
+    @classmethod
+    def available(cls):
+        return hasattr(cv2, "barcode") or hasattr(cv2, "barcode_BarcodeDetector")
+
+    def decode(self, image):
+        ok, texts, kinds, points = self._detector.detectAndDecodeWithType(image)
+        if not ok or points is None:
+            return []
+        results = []
+        for text, kind, corners in zip(texts, kinds, points):
+            kind = kind.replace("_", "").upper()
+            if text and kind in self.symbol_types:
+                results.append(_symbol(text, kind, corners))
+        return results
+
+
+# ZXing, through the zxing-cpp bindings or, failing that, the Java zxing package from the notebook
+class ZXingDecoder(Decoder):
+    name = "zxing"
+    types = ("QRCODE", "EAN13", "EAN8", "UPCA", "UPCE", "CODE128")
+    FORMATS = {"QRCODE": "QRCode", "EAN13": "EAN13", "EAN8": "EAN8", "UPCA": "UPCA", "UPCE": "UPCE",
+               "CODE128": "Code128"}
+
+    def __init__(self, symbology=None, multi=False):
+        """Initializes the decoder with whichever ZXing binding is installed."""
+        super().__init__(symbology, multi)
+        try:
+            import zxingcpp
+            self._zxingcpp = zxingcpp
+            formats = [getattr(zxingcpp.BarcodeFormat, self.FORMATS[t]) for t in self.symbol_types]
+            # zxing-cpp 3 takes a tuple of formats; older releases only accept them or-ed together
+            self._formats = tuple(formats)
+            try:
+                zxingcpp.read_barcodes(np.zeros((8, 8), np.uint8), formats=self._formats)
+            except TypeError:
+                self._formats = functools.reduce(lambda a, b: a | b, formats)
+            self._types = {str(f): t for f, t in zip(formats, self.symbol_types)}
+        except ImportError:
+            import zxing
+            self._zxingcpp = None
+            self._reader = zxing.BarCodeReader()
+
+    @classmethod
+    def available(cls):
+        for module in ("zxingcpp", "zxing"):
+            try:
+                __import__(module)
+                return True
+            except ImportError:
+                continue
+        return False
+
+    def decode(self, image):
+        if self._zxingcpp is None:
+            return self._decode_java(image)
+        results = []
+        for barcode in self._zxingcpp.read_barcodes(image, formats=self._formats):
+            p = barcode.position
+            corners = [(p.top_left.x, p.top_left.y), (p.top_right.x, p.top_right.y),
+                       (p.bottom_right.x, p.bottom_right.y), (p.bottom_left.x, p.bottom_left.y)]
+            results.append(_symbol(barcode.text, self._types.get(str(barcode.format), "UNKNOWN"), corners))
+        return results
+
+    def _decode_java(self, image):
+        """Decodes through the Java zxing package, which only reads image files."""
+        fd, path = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
+        try:
+            cv2.imwrite(path, image)
+            barcode = self._reader.decode(path)
+        finally:
+            os.remove(path)
+        if not barcode or not barcode.parsed:
+            return []
+        kind = barcode.format.replace("_", "").upper()
+        return [_symbol(barcode.parsed, kind, barcode.points or [(0, 0)])]
+
+
+BACKENDS = {cls.name: cls for cls in (PyzbarDecoder, OpenCVQRDecoder, OpenCVBarcodeDecoder, ZXingDecoder)}
+
+
+# Picks the backend with the lowest measured cost per successful decode
+class AdaptiveDecoder:
+    name = "auto"
+
+    def __init__(self, backends, explore_every=50, smoothing=0.1):
+        """Initializes the selector over a list of Decoder instances.
+
+        Every backend is tried once before selection starts, and after that
+        every explore_every-th frame goes to a backend other than the
+        current favourite so the measurements stay fresh. Latency and hit
+        rate are exponentially smoothed with the given factor.
+        """
+        if not backends:
+            raise ValueError("AdaptiveDecoder needs at least one backend")
+        self.backends = backends
+        self.explore_every = explore_every
+        self.smoothing = smoothing
+        self.latency_ms = {b.name: None for b in backends}
+        self.hit_rate = {b.name: 0.0 for b in backends}
+        self.frames = 0
+        self._explore_index = 0
+
+    def __call__(self, image):
+        """Decodes an image with the chosen backend, measuring it as it goes."""
+        self.frames += 1
+        backend = self._choose()
+        start = time.perf_counter()
+        results = backend(image)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._record(backend.name, elapsed_ms, bool(results))
+        return results
+
+    def _choose(self):
+        """Returns the backend to use for the next frame."""
+        untried = [b for b in self.backends if self.latency_ms[b.name] is None]
+        if untried:
+            return untried[0]
+        best = self.best()
+        if len(self.backends) > 1 and self.frames % self.explore_every == 0:
+            others = [b for b in self.backends if b is not best]
+            self._explore_index = (self._explore_index + 1) % len(others)
+            return others[self._explore_index]
+        return best
+
+    def best(self):
+        """Returns the backend with the lowest expected time per successful decode."""
+        def cost(backend):
+            latency = self.latency_ms[backend.name]
+            if latency is None:
+                return 0.0
+            # Backends that never find anything rank by latency, behind any that do
+            hit_rate = self.hit_rate[backend.name]
+            return latency / hit_rate if hit_rate > 0 else 1e6 + latency
+        return min(self.backends, key=cost)
+
+    def _record(self, name, elapsed_ms, hit):
+        """Folds one measurement into the smoothed latency and hit rate."""
+        a = self.smoothing
+        previous = self.latency_ms[name]
+        self.latency_ms[name] = elapsed_ms if previous is None else (1 - a) * previous + a * elapsed_ms
+        self.hit_rate[name] = (1 - a) * self.hit_rate[name] + a * (1.0 if hit else 0.0)
+
+    def stats(self):
+        """Returns the current measurements per backend and the backend in use."""
+        return {
+            "current": self.best().name,
+            "backends": {
+                b.name: {"latency_ms": self.latency_ms[b.name], "hit_rate": self.hit_rate[b.name]}
+                for b in self.backends
+            },
+        }
+
+
+def available_backends(symbology=None, multi=False):
+    """Returns instances of every installed backend that can read the given symbology."""
+    backends = []
+    for cls in BACKENDS.values():
+        if cls.available():
+            backend = cls(symbology, multi)
+            if backend.symbol_types:
+                backends.append(backend)
+    return backends
+
+
+def make_decoder(name="pyzbar", symbology=None, multi=False):
+    """Returns a decoder by backend name, or an AdaptiveDecoder over all installed backends for "auto".
+
+    With multi, every backend reports all the codes in an image, as batch
+    scanning needs.
+    """
+    if name == "auto":
+        return AdaptiveDecoder(available_backends(symbology, multi))
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown decoder backend: {name}")
+    return BACKENDS[name](symbology, multi)
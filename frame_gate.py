@@ -0,0 +1,133 @@
+import threading
+import time
+
+import cv2
+
+import metrics
+from decode_region import GUIDE_BOX, scale_box
+
+# Mean absolute difference, on a 0-255 scale, of the downscaled frame against the last decoded one
+# below which nothing is taken to have moved; sensor noise stays well under it
+MOTION_THRESHOLD = 4.0
+
+# Variance of the Laplacian over the guide box below which a frame is too blurry to decode
+BLUR_THRESHOLD = 60.0
+
+# Seconds between decodes of an unchanged scene: the first wait, and the longest it backs off to
+IDLE_INTERVAL = 0.1
+MAX_IDLE_INTERVAL = 1.0
+
+# Size the frame is shrunk to for the motion check
+THUMBNAIL_SIZE = (64, 48)
+
+
+# Decides before decoding whether a camera frame is worth it: skips unchanged and blurry frames
+class FrameGate:
+    def __init__(self, motion_threshold=MOTION_THRESHOLD, blur_threshold=BLUR_THRESHOLD, box=GUIDE_BOX,
+                 idle_interval=IDLE_INTERVAL, max_idle_interval=MAX_IDLE_INTERVAL, clock=time.monotonic):
+        """Initializes the gate.
+
+        A frame whose thumbnail differs from the last moving frame's by
+        less than motion_threshold is static; static frames are let through
+        only every idle_interval seconds, a wait that doubles with each
+        static decode up to max_idle_interval and drops back as soon as
+        something moves. A moving frame is decoded straight away unless the
+        Laplacian variance of its box region, given in a 640x480 frame and
+        scaled to the frame, is under blur_threshold, as it
+        is while a product is still being brought into view; a blurry frame
+        still gets through once max_idle_interval has passed without a
+        decode. Setting both thresholds to 0 lets every frame through.
+        """
+        self.motion_threshold = motion_threshold
+        self.blur_threshold = blur_threshold
+        self.box = box
+        self.idle_interval = idle_interval
+        self.max_idle_interval = max_idle_interval
+        self.clock = clock
+        self.frames = 0
+        self.skipped_static = 0
+        self.skipped_blurry = 0
+        self.last_motion = None
+        self.last_blur = None
+        self._wait = idle_interval
+        self._reference = None
+        self._last_decode = None
+        self._lock = threading.Lock()
+
+    def admit(self, frame):
+        """Returns True if the frame should be decoded, and False to skip it."""
+        now = self.clock()
+        with metrics.span("gate.check"):
+            thumbnail = self._thumbnail(frame)
+            with self._lock:
+                self.frames += 1
+                if self._last_decode is None:
+                    # Timed from the first frame, so a blurry start is not already overdue
+                    self._last_decode = now
+                since_decode = now - self._last_decode
+                moving = self._reference is None or self._motion(thumbnail) >= self.motion_threshold
+                if not moving:
+                    if since_decode < self._wait:
+                        self.skipped_static += 1
+                        metrics.inc("gate.skipped_static")
+                        return False
+                    # Nothing moved, but look again in case a code is held still; back off further each time
+                    self._wait = min(self.max_idle_interval, self._wait * 2)
+                else:
+                    self._wait = self.idle_interval
+                    overdue = since_decode >= self.max_idle_interval
+                    # The scene it moved to is the new reference, decoded or not, so it reads as static once it settles
+                    self._reference = thumbnail
+                    if self.blur_threshold and not overdue and self._blur(frame) < self.blur_threshold:
+                        self.skipped_blurry += 1
+                        metrics.inc("gate.skipped_blurry")
+                        return False
+                self._reference = thumbnail
+                self._last_decode = now
+        metrics.inc("gate.admitted")
+        return True
+
+    def stats(self):
+        """Returns the frame counts, skip ratio, thresholds, current idle wait and the last scores measured."""
+        with self._lock:
+            skipped = self.skipped_static + self.skipped_blurry
+            return {"frames": self.frames, "skipped_static": self.skipped_static,
+                    "skipped_blurry": self.skipped_blurry, "skip_ratio": skipped / self.frames if self.frames else 0.0,
+                    "motion_threshold": self.motion_threshold, "blur_threshold": self.blur_threshold,
+                    "idle_wait": self._wait, "last_motion": self.last_motion, "last_blur": self.last_blur}
+
+    def reset(self):
+        """Forgets the reference frame, so the next frame is decoded."""
+        with self._lock:
+            self._reference = None
+            self._last_decode = None
+            self._wait = self.idle_interval
+
+    def _thumbnail(self, frame):
+        """Returns the frame shrunk to THUMBNAIL_SIZE in grayscale."""
+        width, height = THUMBNAIL_SIZE
+        # A cheap linear shrink to twice the size, then averaging 2x2 blocks to even out sensor noise;
+        # one INTER_AREA pass over the whole frame costs ten times as much
+        small = cv2.resize(frame, (width * 2, height * 2), interpolation=cv2.INTER_LINEAR)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(small, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+    def _motion(self, thumbnail):
+        """Returns how much the scene changed since the last frame that moved."""
+        self.last_motion = float(cv2.absdiff(thumbnail, self._reference).mean())
+        return self.last_motion
+
+    def _blur(self, frame):
+        """Returns the variance of the Laplacian over the box region; low values mean blurry."""
+        height, width = frame.shape[:2]
+        left, top, right, bottom = scale_box(self.box, frame) if self.box else (0, 0, width, height)
+        region = frame[max(0, top):min(height, bottom), max(0, left):min(width, right)]
+        if region.size == 0:
+            region = frame
+        if region.ndim == 3:
+            region = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        # 16-bit Laplacian with meanStdDev is a few times faster than a float64 Laplacian and numpy's var()
+        deviation = cv2.meanStdDev(cv2.Laplacian(region, cv2.CV_16S))[1][0, 0]
+        self.last_blur = float(deviation * deviation)
+        return self.last_blur
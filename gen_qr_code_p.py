@@ -1,12 +1,21 @@
-import qrcode
+import os
+from contextlib import closing
+
+from catalog import DEFAULT_PATH, DEFAULT_PRODUCTS, Catalog
+from labels import DEFAULT_SETTINGS, render_label
 
 # Define the product ID to be encoded in the QR code
 product_id = "product123"
+if os.path.exists(DEFAULT_PATH):
+    with closing(Catalog()) as catalog:
+        known = catalog.lookup(product_id) is not None
+else:
+    # No catalog is created just to check a label; a new one would be seeded with the default products
+    known = any(product["product_id"] == product_id for product in DEFAULT_PRODUCTS)
+if not known:
+    raise SystemExit(f"Product {product_id} is not in the catalog")
 
-# Create a QR code
-qr = qrcode.make(product_id)
-
-# Save the QR code as an image
-qr.save("product_qr_code.png")
+# Create the QR code and save it as an image
+render_label(("qr", product_id, DEFAULT_SETTINGS, "product_qr_code.png"))
 
 print("QR code generated and saved as 'product_qr_code.png'")
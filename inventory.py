@@ -0,0 +1,428 @@
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+from catalog import DEFAULT_PATH
+
+# Stock level at or below which a product is reported as running low
+LOW_STOCK = 5
+
+# Seconds a basket line may hold stock before release_expired() may return it
+HOLD_TIMEOUT = 30 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reservations (
+    line_id TEXT PRIMARY KEY,
+    basket_id TEXT,
+    product_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_held ON reservations (status, ts);
+CREATE TABLE IF NOT EXISTS low_stock_events (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id TEXT NOT NULL,
+    stock INTEGER NOT NULL,
+    threshold INTEGER NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_devices (
+    device_id TEXT PRIMARY KEY,
+    acked_seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_conflicts (
+    conflict_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    product_id TEXT,
+    kind TEXT NOT NULL,
+    detail INTEGER,
+    ts REAL NOT NULL
+);
+"""
+
+# Ways a sale made offline can disagree with the catalog when it is synced; "parked" is a record the server
+# refused, which the device kept and replaced with a stand-in, its detail the status it was refused with, and
+# "gap" a sequence number missing from the device's journal
+CONFLICT_KINDS = ("oversold", "unknown_product", "price_changed", "parked", "gap")
+
+HELD = "held"
+COMMITTED = "committed"
+RELEASED = "released"
+
+
+# A queued inventory operation and, once the writer has applied it, its outcome
+class _Operation:
+    def __init__(self, kind, args):
+        """Initializes the operation with its kind and arguments."""
+        self.kind = kind
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# Stock reservations per basket line, applied in group-committed batches on the catalog database
+class InventoryService:
+    def __init__(self, path=DEFAULT_PATH, low_stock=LOW_STOCK, max_batch=256, busy_timeout=5.0):
+        """Opens the inventory tables in the catalog database and starts the writer thread.
+
+        Callers on any thread queue operations and wait for the outcome;
+        a single writer applies whatever is queued in one transaction, so
+        many checkout lanes share one commit instead of contending for the
+        database lock. Every stock change is a conditional UPDATE inside
+        that transaction, which also keeps other processes sharing the
+        database from overselling.
+        """
+        self.path = path
+        self.low_stock = low_stock
+        self.max_batch = max_batch
+        self._listeners = []
+        self._queue = queue.Queue()
+        self._conn = self._connect(busy_timeout)
+        self._conn.executescript(SCHEMA)
+        self._read_lock = threading.Lock()
+        self._reader = self._connect(busy_timeout)
+        self._thread = threading.Thread(target=self._run, name="inventory-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self, busy_timeout):
+        """Opens a connection to the catalog database in autocommit mode."""
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def reserve(self, line_id, product_id, quantity=1, basket_id=None):
+        """Holds quantity units of a product for one basket line and returns True if there was enough stock.
+
+        Reserving a line that is already held changes its quantity, taking
+        or returning only the difference. Reserved units leave the stock
+        straight away, so other lanes cannot sell them.
+        """
+        return self._submit("reserve", (line_id, product_id, quantity, basket_id))
+
+    def reserve_all(self, lines):
+        """Holds several basket lines in one queued operation and returns a list of their results.
+
+        lines are (line_id, product_id, quantity, basket_id) tuples. Each
+        line is held or not on its own, as with reserve(); a line reserve()
+        would reject comes back False instead of failing the others.
+        """
+        return self._submit("reserve_all", (list(lines),))
+
+    def commit(self, line_id):
+        """Marks a held line as sold and returns True; committing it again also returns True."""
+        return self._submit("commit", (line_id,))
+
+    def commit_all(self, line_ids):
+        """Commits several lines in one queued operation and returns a list of their results."""
+        return self._submit("commit_all", (list(line_ids),))
+
+    def release(self, line_id):
+        """Returns a held line's units to stock and returns True if the line was held."""
+        return self._submit("release", (line_id,))
+
+    def touch(self, basket_id):
+        """Restarts the hold timeout of a basket's held lines and returns how many there are."""
+        return self._submit("touch", (basket_id,))
+
+    def release_expired(self, max_age):
+        """Releases lines held for longer than max_age seconds, such as baskets abandoned in a crash.
+
+        Returns the number of lines released.
+        """
+        return self._submit("release_expired", (time.time() - max_age,))
+
+    def apply_synced(self, device_id, records):
+        """Takes the units of sales a device made offline out of stock and returns (acked_seq, conflicts).
+
+        records are the device's journal records in sequence order. Only
+        those that directly follow the device's last applied sequence number
+        are applied, so a resent batch changes nothing; the number of the
+        last one applied is returned either way. The sale always stands:
+        stock that would go below zero is set to zero and the shortfall is
+        recorded as an "oversold" conflict for the retailer to reconcile.
+        """
+        return self._submit("apply_synced", (device_id, list(records)))
+
+    def synced_seq(self, device_id):
+        """Returns the last sequence number applied from a device, or 0 if it never synced."""
+        with self._read_lock:
+            row = self._reader.execute("SELECT acked_seq FROM sync_devices WHERE device_id = ?",
+                                       (device_id,)).fetchone()
+        return row[0] if row else 0
+
+    def sync_conflicts(self, device_id=None, after_id=None, limit=100):
+        """Returns up to limit sync conflicts as dictionaries, oldest first, optionally only one device's."""
+        query = "SELECT conflict_id, device_id, seq, product_id, kind, detail, ts FROM sync_conflicts WHERE conflict_id > ?"
+        params = [after_id or 0]
+        if device_id is not None:
+            query += " AND device_id = ?"
+            params.append(device_id)
+        query += " ORDER BY conflict_id LIMIT ?"
+        params.append(limit)
+        with self._read_lock:
+            rows = self._reader.execute(query, params).fetchall()
+        return [{"conflict_id": conflict_id, "device_id": device, "seq": seq, "product_id": product_id, "kind": kind,
+                 "detail": detail, "ts": ts}
+                for conflict_id, device, seq, product_id, kind, detail, ts in rows]
+
+    def _submit(self, kind, args, timeout=None):
+        """Queues an operation and waits for the writer to apply it."""
+        operation = _Operation(kind, args)
+        self._queue.put(operation)
+        operation.done.wait(timeout)
+        if operation.error is not None:
+            raise operation.error
+        return operation.result
+
+    def add_listener(self, callback):
+        """Registers callback(event) for low-stock events raised in this process.
+
+        Callbacks run on the writer thread, so UI code should hand them to
+        the main thread. Other processes see the events through
+        low_stock_events().
+        """
+        self._listeners.append(callback)
+
+    def low_stock_events(self, after_id=None, limit=100):
+        """Returns up to limit low-stock events as dictionaries, oldest first.
+
+        With after_id, these are the events that follow it; without, the
+        most recent ones.
+        """
+        query = ("SELECT e.event_id, e.product_id, p.name, e.stock, e.threshold, e.ts FROM low_stock_events e "
+                 "LEFT JOIN products p ON p.product_id = e.product_id ")
+        if after_id is None:
+            query += "ORDER BY e.event_id DESC LIMIT ?"
+            params = (limit,)
+        else:
+            query += "WHERE e.event_id > ? ORDER BY e.event_id LIMIT ?"
+            params = (after_id, limit)
+        with self._read_lock:
+            rows = self._reader.execute(query, params).fetchall()
+        if after_id is None:
+            rows.reverse()
+        return [{"event_id": event_id, "product_id": product_id, "name": name or product_id, "stock": stock,
+                 "threshold": threshold, "ts": ts}
+                for event_id, product_id, name, stock, threshold, ts in rows]
+
+    def held(self, basket_id=None):
+        """Returns {line_id: (product_id, quantity)} for held lines, optionally of one basket."""
+        query = "SELECT line_id, product_id, quantity FROM reservations WHERE status = ?"
+        params = [HELD]
+        if basket_id is not None:
+            query += " AND basket_id = ?"
+            params.append(basket_id)
+        with self._read_lock:
+            return {line_id: (product_id, quantity)
+                    for line_id, product_id, quantity in self._reader.execute(query, params)}
+
+    def close(self):
+        """Applies any queued operations and stops the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+        self._conn.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def _run(self):
+        """Applies queued operations in batches, one transaction per batch."""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            operations = [operation for operation in batch if operation is not None]
+            if operations:
+                self._apply(operations)
+            if stopping:
+                return
+
+    def _apply(self, operations):
+        """Applies one batch of operations in a single transaction and wakes their callers."""
+        events = []
+        with metrics.span("inventory.batch"):
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                for operation in operations:
+                    try:
+                        operation.result = getattr(self, "_" + operation.kind)(*operation.args, events=events)
+                    except ValueError as e:
+                        # Invalid requests are rejected before they write anything, so the batch goes on
+                        operation.error = e
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                # Anything else may have left a partial write, so none of the batch is kept
+                print(f"Error applying inventory batch: {e}")
+                try:
+                    if self._conn.in_transaction:
+                        self._conn.execute("ROLLBACK")
+                except sqlite3.Error as rollback_error:
+                    print(f"Error rolling back inventory batch: {rollback_error}")
+                events = []
+                for operation in operations:
+                    operation.result, operation.error = None, e
+        metrics.inc("inventory.operations", len(operations))
+        metrics.inc("inventory.batches")
+        for operation in operations:
+            operation.done.set()
+        for event in events:
+            for callback in self._listeners:
+                try:
+                    callback(event)
+                except Exception as e:
+                    # A failing listener must not stop the writer thread
+                    print(f"Error in low-stock listener: {e}")
+
+    def _change_stock(self, product_id, delta, events):
+        """Adds delta to a product's stock unless that would take it below zero, and returns True if it did.
+
+        Records a low-stock event when the change takes the stock from above
+        the threshold to at or below it.
+        """
+        updated = self._conn.execute(
+            "UPDATE products SET stock = stock + ? WHERE product_id = ? AND stock + ? >= 0",
+            (delta, product_id, delta),
+        ).rowcount
+        if not updated:
+            return False
+        stock, name = self._conn.execute(
+            "SELECT stock, name FROM products WHERE product_id = ?", (product_id,)
+        ).fetchone()
+        if stock <= self.low_stock < stock - delta:
+            ts = time.time()
+            cursor = self._conn.execute(
+                "INSERT INTO low_stock_events (product_id, stock, threshold, ts) VALUES (?, ?, ?, ?)",
+                (product_id, stock, self.low_stock, ts),
+            )
+            events.append({"event_id": cursor.lastrowid, "product_id": product_id, "name": name, "stock": stock,
+                           "threshold": self.low_stock, "ts": ts})
+        return True
+
+    def _reserve(self, line_id, product_id, quantity, basket_id, events):
+        """Applies a reserve operation."""
+        if quantity < 1:
+            raise ValueError(f"Cannot reserve {quantity} units; release the line instead")
+        row = self._conn.execute(
+            "SELECT product_id, quantity, status FROM reservations WHERE line_id = ?", (line_id,)
+        ).fetchone()
+        held = row[1] if row and row[2] == HELD else 0
+        if row and row[2] != HELD:
+            # A committed or released line cannot be reopened
+            return row[2] == COMMITTED and row[1] == quantity
+        if row and row[0] != product_id:
+            raise ValueError(f"Line {line_id} is already held for {row[0]}")
+        delta = quantity - held
+        if delta and not self._change_stock(product_id, -delta, events):
+            metrics.inc("inventory.out_of_stock")
+            return False
+        self._conn.execute(
+            "INSERT OR REPLACE INTO reservations VALUES (?, ?, ?, ?, ?, ?)",
+            (line_id, basket_id, product_id, quantity, HELD, time.time()),
+        )
+        return True
+
+    def _reserve_all(self, lines, events):
+        """Applies a reserve_all operation."""
+        results = []
+        for line in lines:
+            try:
+                results.append(self._reserve(*line, events))
+            except ValueError:
+                # Rejected before anything was written, like a single reserve
+                results.append(False)
+        return results
+
+    def _commit(self, line_id, events):
+        """Applies a commit operation."""
+        row = self._conn.execute("SELECT status FROM reservations WHERE line_id = ?", (line_id,)).fetchone()
+        if row is None or row[0] == RELEASED:
+            return False
+        self._conn.execute("UPDATE reservations SET status = ? WHERE line_id = ?", (COMMITTED, line_id))
+        return True
+
+    def _commit_all(self, line_ids, events):
+        """Applies a commit_all operation."""
+        return [self._commit(line_id, events) for line_id in line_ids]
+
+    def _release(self, line_id, events):
+        """Applies a release operation."""
+        row = self._conn.execute(
+            "SELECT product_id, quantity, status FROM reservations WHERE line_id = ?", (line_id,)
+        ).fetchone()
+        if row is None or row[2] != HELD:
+            return False
+        self._change_stock(row[0], row[1], events)
+        self._conn.execute("UPDATE reservations SET status = ? WHERE line_id = ?", (RELEASED, line_id))
+        return True
+
+    def _apply_synced(self, device_id, records, events):
+        """Applies an apply_synced operation."""
+        row = self._conn.execute("SELECT acked_seq FROM sync_devices WHERE device_id = ?", (device_id,)).fetchone()
+        acked = row[0] if row else 0
+        conflicts = []
+        for record in records:
+            if record["seq"] <= acked:
+                continue
+            if record["seq"] != acked + 1:
+                # A gap means records were lost on the way; the device resends from acked_seq
+                break
+            acked = record["seq"]
+            if record["type"] == "sale":
+                conflicts += self._sell_synced(record, events)
+            elif record["type"] == "parked":
+                conflicts.append({"seq": record["seq"], "product_id": record.get("product_id"), "kind": "parked",
+                                  "detail": record["status"]})
+            elif record["type"] == "gap":
+                conflicts.append({"seq": record["seq"], "product_id": None, "kind": "gap", "detail": None})
+        now = time.time()
+        self._conn.executemany(
+            "INSERT INTO sync_conflicts (device_id, seq, product_id, kind, detail, ts) VALUES (?, ?, ?, ?, ?, ?)",
+            [(device_id, c["seq"], c["product_id"], c["kind"], c["detail"], now) for c in conflicts],
+        )
+        self._conn.execute("INSERT OR REPLACE INTO sync_devices VALUES (?, ?)", (device_id, acked))
+        return acked, conflicts
+
+    def _sell_synced(self, record, events):
+        """Takes one synced sale's units out of stock and returns the conflicts it raised."""
+        product_id = record["product_id"]
+        quantity = record["quantity"]
+        row = self._conn.execute("SELECT price_cents, stock FROM products WHERE product_id = ?",
+                                 (product_id,)).fetchone()
+        if row is None:
+            return [{"seq": record["seq"], "product_id": product_id, "kind": "unknown_product", "detail": quantity}]
+        conflicts = []
+        price_cents, stock = row
+        if price_cents != record["unit_price_cents"]:
+            # The price the customer paid offline stands; the current price is kept for the retailer
+            conflicts.append({"seq": record["seq"], "product_id": product_id, "kind": "price_changed",
+                              "detail": price_cents})
+        if not self._change_stock(product_id, -quantity, events):
+            if stock:
+                self._change_stock(product_id, -stock, events)
+            conflicts.append({"seq": record["seq"], "product_id": product_id, "kind": "oversold",
+                              "detail": quantity - stock})
+            metrics.inc("inventory.oversold")
+        return conflicts
+
+    def _touch(self, basket_id, events):
+        """Applies a touch operation."""
+        return self._conn.execute("UPDATE reservations SET ts = ? WHERE basket_id = ? AND status = ?",
+                                  (time.time(), basket_id, HELD)).rowcount
+
+    def _release_expired(self, cutoff, events):
+        """Releases every line held since before cutoff."""
+        lines = self._conn.execute(
+            "SELECT line_id FROM reservations WHERE status = ? AND ts < ?", (HELD, cutoff)
+        ).fetchall()
+        for (line_id,) in lines:
+            self._release(line_id, events)
+        return len(lines)
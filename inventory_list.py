@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+
+# Windowed view of the catalog for the retailer's inventory list
+class InventoryListModel:
+    def __init__(self, catalog, page_size=100, max_pages=8):
+        """Initializes the model over a Catalog.
+
+        Rows are fetched from the catalog a page at a time as the list is
+        scrolled, and at most max_pages pages are kept, so memory stays the
+        same whether the catalog holds a hundred products or a million.
+        """
+        self.catalog = catalog
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.search = None
+        self.category = None
+        self.max_stock = None
+        self._pages = OrderedDict()
+        self._count = None
+
+    def set_filter(self, search=None, category=None, max_stock=None):
+        """Changes the search text, category and low-stock filters and drops the cached rows."""
+        self.search = search or None
+        self.category = category or None
+        self.max_stock = max_stock
+        self.reload()
+
+    def reload(self):
+        """Drops the cached rows and row count so they are read from the catalog again."""
+        self._pages.clear()
+        self._count = None
+
+    def count(self):
+        """Returns the number of rows that match the current filters."""
+        if self._count is None:
+            self._count = self.catalog.count(self.search, self.category, self.max_stock)
+        return self._count
+
+    def row(self, index):
+        """Returns the product shown at the given row, or None past the end of the list."""
+        if index < 0:
+            return None
+        page = self._page(index // self.page_size)
+        offset = index % self.page_size
+        return page[offset] if offset < len(page) else None
+
+    def rows(self, first, count):
+        """Returns the products shown in count rows starting at first."""
+        rows = []
+        for index in range(first, min(first + count, self.count())):
+            rows.append(self.row(index))
+        return rows
+
+    def _page(self, number):
+        """Returns one page of rows, reading it from the catalog if it is not cached."""
+        page = self._pages.get(number)
+        if page is not None:
+            self._pages.move_to_end(number)
+            return page
+        page = self.catalog.products(number * self.page_size, self.page_size,
+                                     self.search, self.category, self.max_stock)
+        self._pages[number] = page
+        if len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return page
+
+    def apply_stock(self, levels):
+        """Updates the stock of cached rows from a {product_id: stock} dictionary.
+
+        Returns the indexes of the rows that changed, so a view only has to
+        redraw those. Rows that are not cached pick the new stock up when
+        their page is next read.
+        """
+        changed = []
+        for number, page in self._pages.items():
+            for offset, product in enumerate(page):
+                stock = levels.get(product["product_id"])
+                if stock is not None and stock != product["stock"]:
+                    product["stock"] = stock
+                    changed.append(number * self.page_size + offset)
+        return changed
+
+    def refresh_stock(self, first, count):
+        """Re-reads the stock of count rows starting at first and returns the indexes of rows that changed."""
+        ids = [product["product_id"] for product in self.rows(first, count)]
+        return self.apply_stock(self.catalog.stock_levels(ids)) if ids else []
@@ -0,0 +1,436 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where msvcrt locks a byte range instead
+    fcntl = None
+    import msvcrt
+
+DEFAULT_PATH = "transactions.jsonl"
+SCHEMA_VERSION = 1
+
+# Fields every record type must carry, checked on append and on replay
+REQUIRED_FIELDS = {
+    "sale": ("product_id", "name", "quantity", "unit_price_cents", "amount_cents"),
+}
+
+# How the writer makes batches durable: fsync every group commit, at most every fsync_interval, or never
+FSYNC_POLICIES = ("commit", "interval", "never")
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    seq INTEGER PRIMARY KEY,
+    session_id TEXT,
+    basket_id TEXT,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_session ON entries (session_id, seq);
+CREATE TABLE IF NOT EXISTS synced_entries (
+    device_id TEXT NOT NULL,
+    device_seq INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (device_id, device_seq)
+);
+"""
+
+
+# Raised when another process already has a journal open for writing
+class JournalInUseError(RuntimeError):
+    pass
+
+
+def index_path(path):
+    """Returns the path of the sidecar offset index for a journal file."""
+    return path + ".idx"
+
+
+def lock_path(path):
+    """Returns the path of the file a journal's writer holds locked."""
+    return path + ".lock"
+
+
+def _lock(path):
+    """Takes an exclusive lock on a journal's lock file without waiting and returns the file that holds it.
+
+    Raises JournalInUseError if another process holds it.
+    """
+    file = open(lock_path(path), "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        file.close()
+        raise JournalInUseError(f"Journal {path} is open in another process; to share it, run checkout_server.py "
+                                f"and point every app at it with GOBUY_SERVER")
+    return file
+
+
+def new_id():
+    """Returns a new random session or basket ID."""
+    return uuid.uuid4().hex
+
+
+def _valid(record):
+    """Returns True if a decoded line is a complete record; types this version does not know are kept."""
+    if not isinstance(record, dict) or record.get("v") != SCHEMA_VERSION:
+        return False
+    if not isinstance(record.get("seq"), int) or not isinstance(record.get("type"), str):
+        return False
+    return all(field in record for field in REQUIRED_FIELDS.get(record["type"], ()))
+
+
+def _scan(path, start=0, skipped=None):
+    """Yields (offset, length, record) for each valid record from start, stopping at a torn final line.
+
+    A complete line that is not a valid record, such as one corrupted on
+    disk, is passed over, and its (offset, length) added to skipped if given.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as file:
+        file.seek(start)
+        offset = start
+        for line in file:
+            if not line.endswith(b"\n"):
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if _valid(record):
+                yield offset, len(line), record
+            elif skipped is not None:
+                skipped.append((offset, len(line)))
+            offset += len(line)
+
+
+def scan(path=DEFAULT_PATH, start=0):
+    """Yields (offset, length, record) for each record from byte offset start, for readers that resume where they stopped."""
+    return _scan(path, start)
+
+
+def read_records(path=DEFAULT_PATH, record_type=None):
+    """Yields journal records in append order, optionally only those of one type."""
+    for _, _, record in _scan(path):
+        if record_type is None or record["type"] == record_type:
+            yield record
+
+
+def read_session(session_id, path=DEFAULT_PATH, record_type=None):
+    """Yields one session's records by seeking to the offsets in the sidecar index.
+
+    The cost depends on the size of the session, not on the size of the journal.
+    """
+    if not os.path.exists(index_path(path)):
+        return
+    conn = sqlite3.connect(index_path(path))
+    try:
+        entries = conn.execute(
+            "SELECT offset, length FROM entries WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+    with open(path, "rb") as file:
+        for offset, length in entries:
+            file.seek(offset)
+            record = json.loads(file.read(length))
+            if record_type is None or record["type"] == record_type:
+                yield record
+
+
+# Append-only JSON Lines transaction journal with a group-committing background writer
+class Journal:
+    def __init__(self, path=DEFAULT_PATH, fsync="commit", fsync_interval=1.0, max_batch=256):
+        """Opens the journal, recovering from a torn tail left by a crash, and starts the writer.
+
+        Records passed to append are queued and written by a background
+        thread in batches of up to max_batch lines. fsync is one of
+        FSYNC_POLICIES. Every record is tagged with the current session and
+        basket IDs and its offset is kept in a sidecar SQLite index so one
+        session can be read back without scanning the whole journal. Raises
+        JournalInUseError if another process has the journal open.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        # One writer per journal: another process would number its records and cut off torn tails on its own
+        self._lock_file = _lock(path)
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self._index = sqlite3.connect(index_path(path), check_same_thread=False)
+        self._index.execute("PRAGMA journal_mode=WAL")
+        self._index.execute("PRAGMA synchronous=NORMAL")
+        self._index.executescript(INDEX_SCHEMA)
+        self._end, last_seq = self._recover()
+        self.next_seq = last_seq + 1
+        self.committed_seq = last_seq
+        # Sequence number of the first record the writer failed to write, if any
+        self.lost_seq = None
+        self._handled_seq = last_seq
+        self._seq_lock = threading.Lock()
+        self._committed = threading.Condition()
+        self._queue = queue.Queue()
+        self._last_fsync = time.monotonic()
+        # Whether written records are waiting for an fsync under the "interval" policy
+        self._unsynced = False
+        self.start_session()
+        self._file = open(path, "ab")
+        self._thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self._thread.start()
+
+    def _recover(self):
+        """Brings the journal and its index back in line after a crash.
+
+        Only the records after the last indexed one are scanned. If the
+        journal lost data the index still refers to, the whole journal is
+        rescanned and the index rebuilt. Corrupt lines between records are
+        reported and left in place; only a torn final line, one a crash cut
+        off before its newline, is truncated. Returns the journal's end
+        offset and last sequence number.
+        """
+        start = 0
+        last_seq = 0
+        row = self._index.execute("SELECT seq, offset, length FROM entries ORDER BY seq DESC LIMIT 1").fetchone()
+        if row and self._indexed_record_intact(*row):
+            last_seq, offset, length = row
+            start = offset + length
+        elif row:
+            print("Journal: index does not match the journal, rebuilding it.")
+            with self._index:
+                self._index.execute("DELETE FROM entries")
+                self._index.execute("DELETE FROM synced_entries")
+
+        valid_end = start
+        missing = []
+        synced = []
+        skipped = []
+        for offset, length, record in _scan(self.path, start, skipped):
+            missing.append(self._entry(record, offset, length))
+            synced += self._synced_entries([record])
+            valid_end = offset + length
+            last_seq = max(last_seq, record["seq"])
+        with self._index:
+            self._index.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", missing)
+            self._index.executemany("INSERT OR REPLACE INTO synced_entries VALUES (?, ?, ?)", synced)
+        if skipped:
+            metrics.inc("journal.corrupt_lines", len(skipped))
+            print(f"Journal: skipping {len(skipped)} corrupt lines, the first at byte {skipped[0][0]}.")
+            valid_end = max(valid_end, skipped[-1][0] + skipped[-1][1])
+
+        if os.path.exists(self.path) and os.path.getsize(self.path) > valid_end:
+            print(f"Journal: discarding {os.path.getsize(self.path) - valid_end} bytes of torn records.")
+            with open(self.path, "r+b") as file:
+                file.truncate(valid_end)
+        return valid_end, last_seq
+
+    def _indexed_record_intact(self, seq, offset, length):
+        """Returns True if the journal still holds the indexed record at its recorded offset."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < offset + length:
+            return False
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            line = file.read(length)
+        try:
+            return line.endswith(b"\n") and json.loads(line).get("seq") == seq
+        except ValueError:
+            return False
+
+    def start_session(self):
+        """Starts a new checkout session with a fresh basket and returns the session ID."""
+        self.session_id = new_id()
+        self.basket_id = new_id()
+        return self.session_id
+
+    def start_basket(self):
+        """Starts a new basket within the current session and returns its ID."""
+        self.basket_id = new_id()
+        return self.basket_id
+
+    def append(self, record_type, **fields):
+        """Queues a record for writing and returns its sequence number without waiting for disk."""
+        missing = [field for field in REQUIRED_FIELDS.get(record_type, ()) if field not in fields]
+        if record_type not in REQUIRED_FIELDS or missing:
+            raise ValueError(f"Invalid {record_type} record, missing fields: {missing}")
+        with self._seq_lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            record = {"v": SCHEMA_VERSION, "seq": seq, "ts": time.time(), "type": record_type,
+                      "session_id": self.session_id, "basket_id": self.basket_id}
+            record.update(fields)
+            self._queue.put(record)
+        return seq
+
+    def flush(self, timeout=None):
+        """Waits until the writer has handled every record appended so far.
+
+        Returns True if they have all been written and indexed, and False
+        if the wait timed out or any record was lost to a failed write.
+        """
+        with self._seq_lock:
+            target = self.next_seq - 1
+        with self._committed:
+            handled = self._committed.wait_for(lambda: self._handled_seq >= target, timeout)
+            return handled and self.committed_seq >= target and (self.lost_seq is None or self.lost_seq > target)
+
+    def synced_seqs(self, device_id, first, last):
+        """Returns the device sequence numbers from first to last of the synced records already written."""
+        conn = sqlite3.connect(index_path(self.path))
+        try:
+            rows = conn.execute(
+                "SELECT device_seq FROM synced_entries WHERE device_id = ? AND device_seq BETWEEN ? AND ?",
+                (device_id, first, last),
+            ).fetchall()
+        finally:
+            conn.close()
+        return {device_seq for device_seq, in rows}
+
+    def records(self, record_type=None):
+        """Flushes pending writes and yields the journal's records."""
+        self.flush()
+        return read_records(self.path, record_type)
+
+    def session_records(self, session_id=None, record_type=None):
+        """Flushes pending writes and yields one session's records, the current one by default."""
+        self.flush()
+        return read_session(session_id or self.session_id, self.path, record_type)
+
+    def close(self):
+        """Writes any queued records, syncs them to disk and stops the writer."""
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        self._index.close()
+        self._lock_file.close()
+
+    def _run(self):
+        """Drains the queue in batches and group-commits each batch.
+
+        Under the "interval" policy, records left unsynced when writes stop
+        are synced once fsync_interval has passed, without waiting for the
+        next batch.
+        """
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self._sync_wait())]
+            except queue.Empty:
+                self._sync_pending()
+                continue
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            records = [record for record in batch if record is not None]
+            if records:
+                self._commit(records)
+            if stopping:
+                self._sync()
+                return
+
+    def _commit(self, records):
+        """Writes one batch of records with a single write, applies the fsync policy and indexes the batch."""
+        lines = [json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n" for record in records]
+        entries = []
+        offset = self._end
+        for record, line in zip(records, lines):
+            entries.append(self._entry(record, offset, len(line)))
+            offset += len(line)
+        written = False
+        try:
+            with metrics.span("journal.write"):
+                self._file.write(b"".join(lines))
+                self._file.flush()
+                if self.fsync == "commit" or (
+                        self.fsync == "interval" and time.monotonic() - self._last_fsync >= self.fsync_interval):
+                    self._sync()
+                else:
+                    self._unsynced = self.fsync == "interval"
+            metrics.inc("journal.records", len(records))
+            metrics.inc("journal.batches")
+            self._end = offset
+            written = True
+            # Indexed after the write; _recover repairs an index that got ahead of a lost tail or fell behind
+            with self._index:
+                self._index.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", entries)
+                self._index.executemany("INSERT OR REPLACE INTO synced_entries VALUES (?, ?, ?)",
+                                        self._synced_entries(records))
+        except Exception as e:
+            # Caught whatever it is, so the writer keeps going and flush() callers are woken
+            metrics.inc("journal.write_errors")
+            print(f"Error writing to journal: {e}")
+            if not written:
+                self._discard_batch()
+        with self._committed:
+            if written:
+                self.committed_seq = records[-1]["seq"]
+            elif self.lost_seq is None:
+                self.lost_seq = records[0]["seq"]
+            self._handled_seq = records[-1]["seq"]
+            self._committed.notify_all()
+
+    def _discard_batch(self):
+        """Cuts off whatever part of a failed batch reached the file, so the next batch starts on a clean line.
+
+        If the file cannot be cut back, the next batch goes after whatever
+        the file now holds, so its offsets stay right.
+        """
+        try:
+            # Closing drops the failed write's buffered bytes into the file, where they are cut off
+            self._file.close()
+        except OSError:
+            pass
+        try:
+            os.truncate(self.path, self._end)
+        except OSError as e:
+            print(f"Error cutting back journal: {e}")
+        try:
+            self._file = open(self.path, "ab")
+            self._end = self._file.seek(0, os.SEEK_END)
+        except OSError as e:
+            # Later batches fail on the closed file and come back here to try again
+            print(f"Error reopening journal: {e}")
+
+    def _entry(self, record, offset, length):
+        """Returns the index row for a record at the given offset."""
+        return (record["seq"], record.get("session_id"), record.get("basket_id"), offset, length)
+
+    def _synced_entries(self, records):
+        """Returns the synced_entries rows for the records a device synced, which carry its ID and sequence number."""
+        return [(record["device_id"], record["device_seq"], record["seq"]) for record in records
+                if record.get("device_id") is not None and isinstance(record.get("device_seq"), int)]
+
+    def _sync(self):
+        """Forces written records to disk."""
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+
+    def _sync_wait(self):
+        """Returns how long the writer may wait for records before unsynced ones are due, or None for no limit."""
+        if not self._unsynced:
+            return None
+        return max(0.0, self.fsync_interval - (time.monotonic() - self._last_fsync))
+
+    def _sync_pending(self):
+        """Syncs records written since the last fsync, trying again an interval later if it fails."""
+        try:
+            self._sync()
+        except Exception as e:
+            metrics.inc("journal.write_errors")
+            print(f"Error syncing journal: {e}")
+            self._last_fsync = time.monotonic()
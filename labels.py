@@ -0,0 +1,230 @@
+"""Bulk barcode and QR label generator.
+
+Renders Code128, EAN-13 or QR labels for every product in the catalog (or
+a CSV price file) across a process pool, skips labels whose payload and
+render settings have not changed since the last run, and can lay the
+labels out on print-ready PDF sheets.
+
+    python labels.py --symbology code128 --out labels
+    python labels.py --csv prices.csv --symbology ean13 --sheet labels.pdf
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from catalog import DEFAULT_PATH as CATALOG_PATH, Catalog
+
+SYMBOLOGIES = ("code128", "ean13", "qr")
+CACHE_FILE = ".label_cache.json"
+# Bump when the rendering code changes so cached labels are redrawn
+RENDERER_VERSION = 1
+
+DEFAULT_SETTINGS = {
+    "module_width": 0.2,
+    "module_height": 15.0,
+    "dpi": 300,
+    "qr_box_size": 10,
+    "qr_border": 4,
+}
+
+
+def load_products(catalog_path=CATALOG_PATH, csv_path=None):
+    """Returns the products to label from a CSV price file or the catalog database.
+
+    Raises FileNotFoundError if the catalog database does not exist, since
+    opening it would create one seeded with the demo products.
+    """
+    if csv_path:
+        with open(csv_path, newline="") as file:
+            return list(csv.DictReader(file))
+    if not os.path.exists(catalog_path):
+        raise FileNotFoundError(f"No catalog database at {catalog_path}; load one or pass --csv")
+    catalog = Catalog(catalog_path)
+    try:
+        return catalog.products()
+    finally:
+        catalog.close()
+
+
+def payload_for(product, symbology):
+    """Returns the data to encode for a product, or None if it cannot carry this symbology."""
+    if symbology == "ean13":
+        ean = (product.get("ean") or "").strip()
+        return ean if ean.isdigit() and len(ean) in (12, 13) else None
+    return product["product_id"]
+
+
+def label_filename(product_id, symbology):
+    """Returns the PNG file name for a product's label."""
+    if symbology == "code128":
+        return f"{product_id}.png"
+    return f"{product_id}_{symbology}.png"
+
+
+def cache_key(payload, symbology, settings):
+    """Returns a hash of everything that affects how a label is drawn."""
+    key = json.dumps([RENDERER_VERSION, symbology, payload, settings], sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def render_label(job):
+    """Renders one label to a PNG file; runs in a worker process."""
+    symbology, payload, settings, path = job
+    if symbology == "qr":
+        import qrcode
+        qr = qrcode.QRCode(box_size=settings["qr_box_size"], border=settings["qr_border"])
+        qr.add_data(payload)
+        qr.make(fit=True)
+        qr.make_image().save(path)
+        return path
+
+    import barcode
+    from barcode.writer import ImageWriter
+    code = barcode.get(symbology, payload, writer=ImageWriter())
+    options = {"module_width": settings["module_width"], "module_height": settings["module_height"],
+               "dpi": settings["dpi"]}
+    # python-barcode appends the extension itself
+    return code.save(os.path.splitext(path)[0], options=options)
+
+
+def _render_job(job):
+    """Renders one label in a worker process and returns None, or the error that stopped it as text."""
+    try:
+        render_label(job)
+        return None
+    except Exception as e:
+        # Returned rather than raised, so one bad label does not stop the others
+        return f"{type(e).__name__}: {e}"
+
+
+def write_sheets(path, labels, columns=3, rows=8):
+    """Lays (product, image path) pairs out on A4 PDF pages, columns x rows labels per page."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    page_width, page_height = A4
+    margin = 24
+    cell_width = (page_width - 2 * margin) / columns
+    cell_height = (page_height - 2 * margin) / rows
+    c = canvas.Canvas(path, pagesize=A4, pageCompression=1)
+    per_page = columns * rows
+    for i, (product, image_path) in enumerate(labels):
+        if i and i % per_page == 0:
+            c.showPage()
+        slot = i % per_page
+        x = margin + (slot % columns) * cell_width
+        y = page_height - margin - (slot // columns + 1) * cell_height
+        c.drawImage(image_path, x + 4, y + 16, width=cell_width - 8, height=cell_height - 22,
+                    preserveAspectRatio=True, anchor="c")
+        c.setFont("Helvetica", 8)
+        caption = product["name"]
+        if product.get("price") not in (None, ""):
+            caption += f"  ${float(product['price']):.2f}"
+        c.drawCentredString(x + cell_width / 2, y + 5, caption[:40])
+    c.save()
+
+
+def generate(products, symbology="code128", out_dir=".", settings=None, workers=None, force=False):
+    """Renders labels for products, reusing unchanged ones, and returns a summary with throughput.
+
+    The summary's "labels" entry lists (product, image path) pairs in
+    catalog order, ready for write_sheets. A label that fails to render is
+    left out of them and listed in "failed" as (product ID, error) instead.
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    os.makedirs(out_dir, exist_ok=True)
+    cache_path = os.path.join(out_dir, CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_path) and not force:
+        with open(cache_path) as file:
+            cache = json.load(file)
+
+    labels = []
+    jobs = []
+    keys = {}
+    rendering = []
+    skipped = 0
+    unsupported = 0
+    for product in products:
+        payload = payload_for(product, symbology)
+        if payload is None:
+            unsupported += 1
+            continue
+        filename = label_filename(product["product_id"], symbology)
+        path = os.path.join(out_dir, filename)
+        key = cache_key(payload, symbology, settings)
+        labels.append((product, path))
+        if cache.get(filename) == key and os.path.exists(path):
+            skipped += 1
+            continue
+        keys[filename] = key
+        jobs.append((symbology, payload, settings, path))
+        rendering.append((product, filename))
+
+    start = time.perf_counter()
+    failed = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Chunking keeps inter-process overhead low when there are thousands of small labels
+            errors = pool.map(_render_job, jobs, chunksize=max(1, len(jobs) // 64))
+            for (product, filename), error in zip(rendering, errors):
+                if error is not None:
+                    failed.append((product["product_id"], error))
+                    del keys[filename]
+    seconds = time.perf_counter() - start
+    if failed:
+        failed_ids = {product_id for product_id, _ in failed}
+        labels = [(product, path) for product, path in labels if product["product_id"] not in failed_ids]
+
+    cache.update(keys)
+    with open(cache_path, "w") as file:
+        json.dump(cache, file)
+    rendered = len(jobs) - len(failed)
+    return {
+        "rendered": rendered,
+        "failed": failed,
+        "skipped": skipped,
+        "unsupported": unsupported,
+        "seconds": seconds,
+        "labels_per_second": rendered / seconds if seconds else 0.0,
+        "labels": labels,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render barcode and QR labels for the product catalog.")
+    parser.add_argument("--catalog", default=CATALOG_PATH, help="catalog database to read products from")
+    parser.add_argument("--csv", help="CSV price file to read products from instead of the catalog")
+    parser.add_argument("--symbology", choices=SYMBOLOGIES, default="code128")
+    parser.add_argument("--out", default=".", help="directory for the label PNGs")
+    parser.add_argument("--workers", type=int, help="number of render processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="re-render labels even if they are cached")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_SETTINGS["dpi"])
+    parser.add_argument("--sheet", help="also write a print-ready multi-label PDF to this path")
+    parser.add_argument("--columns", type=int, default=3, help="labels per row on the PDF sheet")
+    parser.add_argument("--rows", type=int, default=8, help="label rows per PDF page")
+    args = parser.parse_args(argv)
+
+    try:
+        products = load_products(args.catalog, args.csv)
+    except FileNotFoundError as e:
+        raise SystemExit(str(e))
+    summary = generate(products, args.symbology, args.out, {"dpi": args.dpi}, args.workers, args.force)
+    print(f"Rendered {summary['rendered']} labels in {summary['seconds']:.2f}s "
+          f"({summary['labels_per_second']:.1f} labels/s), {summary['skipped']} unchanged, "
+          f"{summary['unsupported']} without a {args.symbology} payload.")
+    for product_id, error in summary["failed"]:
+        print(f"Error rendering the label for {product_id}: {error}")
+    if args.sheet:
+        start = time.perf_counter()
+        write_sheets(args.sheet, summary["labels"], args.columns, args.rows)
+        print(f"Wrote {len(summary['labels'])} labels to {args.sheet} in {time.perf_counter() - start:.2f}s")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+from journal import DEFAULT_PATH as JOURNAL_PATH, scan
+from wallet import DEFAULT_PATH
+
+# Points earned per whole dollar paid from the wallet
+POINTS_PER_DOLLAR = 1
+
+# Cents one point is worth when redeemed
+POINT_VALUE_CENTS = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    customer_id TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL CHECK (balance >= 0)
+);
+CREATE TABLE IF NOT EXISTS points_events (
+    event_id TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS points_replay (
+    journal_path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+def points_for(paid_cents):
+    """Returns the points earned by a payment of paid_cents."""
+    return max(paid_cents, 0) // 100 * POINTS_PER_DOLLAR
+
+
+def sale_event_id(seq, record):
+    """Returns the accrual event ID for a journal sale record with sequence number seq.
+
+    The ID comes from the payment and basket line the sale was paid as, and
+    the device for a synced sale, so it stays the same when the journal is
+    replayed but not when a replaced journal numbers its records from 1
+    again. Records written before sales carried them fall back to seq.
+    """
+    if record.get("payment_id") is not None and record.get("line_id") is not None:
+        if record.get("device_id") is not None:
+            return f"sale:{record['device_id']}:{record['payment_id']}:{record['line_id']}"
+        return f"sale:{record['payment_id']}:{record['line_id']}"
+    if record.get("device_id") is not None:
+        return f"sale:{record['device_id']}:{record['device_seq']}"
+    return f"sale:{seq}"
+
+
+def paid_cents(record):
+    """Returns what a journal sale record says was paid from the wallet."""
+    return record["amount_cents"] - record.get("discount_cents", 0) - record.get("points_cents", 0)
+
+
+def points_earned(paid_before_cents, paid_cents):
+    """Returns the points a line paying paid_cents adds to a payment that had paid paid_before_cents before it.
+
+    The lines of a payment together earn the points for its total, so a
+    basket of items under a dollar each still earns.
+    """
+    return points_for(paid_before_cents + paid_cents) - points_for(paid_before_cents)
+
+
+# A queued redemption and, once the consumer has applied it, its outcome
+class _Redemption:
+    def __init__(self, customer_id, points, event_id):
+        """Initializes the redemption request."""
+        self.customer_id = customer_id
+        self.points = points
+        self.event_id = event_id
+        self.result = 0
+        self.error = None
+        self.done = threading.Event()
+
+
+# A queued refund of a redemption whose payment did not go through
+class _Refund:
+    def __init__(self, customer_id, event_id):
+        """Initializes the refund of the redemption with event_id."""
+        self.customer_id = customer_id
+        self.event_id = event_id
+
+
+# Loyalty points per customer, accrued from payment events in batches on the wallet database
+class LoyaltyService:
+    def __init__(self, path=DEFAULT_PATH, max_batch=512, busy_timeout=5.0):
+        """Opens the points tables in the wallet database and starts the consumer thread.
+
+        accrue() only queues an event, so checkout never waits for points.
+        The consumer applies whatever is queued in one transaction, adding
+        each customer's points with a single UPDATE. Every event has an ID
+        that is recorded with it, so an event applied twice, whether queued
+        again or replayed from the journal, only counts once.
+        """
+        self.path = path
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._read_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        self._thread = threading.Thread(target=self._run, name="loyalty-consumer", daemon=True)
+        self._thread.start()
+
+    def accrue(self, customer_id, event_id, paid_cents):
+        """Queues the points for a payment of paid_cents and returns them without waiting for disk."""
+        points = points_for(paid_cents)
+        if points:
+            self._put((event_id, customer_id, points))
+        return points
+
+    def accrue_sale(self, seq, record):
+        """Queues the points for a journal sale record with sequence number seq and returns them.
+
+        A sale records the points it earned as its share of its payment's
+        points, which are worked out on the payment's total; older records
+        earn on their own amount.
+        """
+        if record.get("customer_id") is None:
+            return 0
+        points = record.get("points_earned")
+        if points is None:
+            points = points_for(paid_cents(record))
+        if points:
+            self._put((sale_event_id(seq, record), record["customer_id"], points))
+        return points
+
+    def redeem(self, customer_id, points, event_id):
+        """Spends up to points of a customer's points and returns how many were spent.
+
+        Waits for queued accruals first so they can be spent. Redeeming an
+        event ID again returns the points it spent the first time.
+        """
+        if points <= 0:
+            return 0
+        redemption = _Redemption(customer_id, points, event_id)
+        self._put(redemption)
+        redemption.done.wait()
+        if redemption.error is not None:
+            raise redemption.error
+        return redemption.result
+
+    def refund(self, customer_id, points, event_id):
+        """Gives back points from a redemption whose payment did not go through.
+
+        The redemption is voided rather than offset, so redeeming its event
+        ID again, as a retried payment does, spends points afresh.
+        """
+        if points:
+            self._put(_Refund(customer_id, event_id))
+
+    def redeem_cents(self, customer_id, max_cents, event_id):
+        """Spends points on up to max_cents of a payment and returns the cents they cover."""
+        return self.redeem(customer_id, max_cents // POINT_VALUE_CENTS, event_id) * POINT_VALUE_CENTS
+
+    def refund_cents(self, customer_id, cents, event_id):
+        """Gives back the points that covered cents of a payment that did not go through."""
+        self.refund(customer_id, cents // POINT_VALUE_CENTS, event_id)
+
+    def balance(self, customer_id):
+        """Returns a customer's points once the events queued so far have been applied."""
+        self.flush()
+        with self._read_lock:
+            row = self._reader.execute("SELECT balance FROM points WHERE customer_id = ?", (customer_id,)).fetchone()
+        return row[0] if row else 0
+
+    def flush(self, timeout=None):
+        """Waits until every queued event has been applied."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def catch_up(self, journal_path=JOURNAL_PATH, from_start=False):
+        """Accrues points for sales in the journal that were not applied, such as after a crash.
+
+        Only records appended since the last catch-up are read, or the whole
+        journal with from_start. Returns the number of sale records queued;
+        ones already applied are ignored.
+        """
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT offset FROM points_replay WHERE journal_path = ?", (journal_path,)
+            ).fetchone()
+        start = row[0] if row and not from_start else 0
+        if start and (not os.path.exists(journal_path) or os.path.getsize(journal_path) < start):
+            # The journal was replaced, so replay it from the start
+            start = 0
+        end = start
+        queued = 0
+        for offset, length, record in scan(journal_path, start):
+            if record["type"] == "sale" and self.accrue_sale(record["seq"], record):
+                queued += 1
+            end = offset + length
+        self.flush()
+        with self._read_lock:
+            self._reader.execute("INSERT OR REPLACE INTO points_replay VALUES (?, ?)", (journal_path, end))
+        return queued
+
+    def close(self):
+        """Applies any queued events and stops the consumer thread."""
+        self._queue.put(None)
+        self._thread.join()
+        self._conn.close()
+        with self._read_lock:
+            self._reader.close()
+
+    def _put(self, item):
+        """Queues an accrual or redemption for the consumer."""
+        with self._idle:
+            self._pending += 1
+        self._queue.put(item)
+
+    def _run(self):
+        """Applies queued events in batches, one transaction per batch."""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            items = [item for item in batch if item is not None]
+            if items:
+                self._apply(items)
+                with self._idle:
+                    self._pending -= len(items)
+                    self._idle.notify_all()
+            if stopping:
+                return
+
+    def _apply(self, items):
+        """Applies one batch of accruals, redemptions and refunds in a single transaction.
+
+        If the batch fails, its events are applied again one transaction
+        each, so only the event that fails is lost rather than every other
+        customer's points queued with it.
+        """
+        redemptions = [item for item in items if isinstance(item, _Redemption)]
+        ts = time.time()
+        with metrics.span("loyalty.batch"):
+            try:
+                self._transaction(items, ts)
+            except Exception as e:
+                # Whatever went wrong, the consumer carries on
+                print(f"Error applying loyalty points, retrying the batch one event at a time: {e}")
+                self._rollback()
+                metrics.inc("loyalty.batch_retries")
+                for item in items:
+                    try:
+                        self._transaction([item], ts)
+                    except Exception as e:
+                        print(f"Error applying loyalty event, dropping it: {e}")
+                        self._rollback()
+                        metrics.inc("loyalty.dropped")
+                        if isinstance(item, _Redemption):
+                            item.result, item.error = 0, e
+        metrics.inc("loyalty.events", len(items))
+        metrics.inc("loyalty.batches")
+        for redemption in redemptions:
+            redemption.done.set()
+
+    def _transaction(self, items, ts):
+        """Applies accruals, redemptions and refunds in one transaction, raising whatever makes it fail."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        # Accruals go first so a redemption can spend points earned in the same batch
+        totals = {}
+        for item in items:
+            if not isinstance(item, tuple):
+                continue
+            event_id, customer_id, points = item
+            inserted = self._conn.execute(
+                "INSERT OR IGNORE INTO points_events VALUES (?, ?, ?, ?)", (event_id, customer_id, points, ts)
+            ).rowcount
+            if inserted:
+                totals[customer_id] = totals.get(customer_id, 0) + points
+            else:
+                metrics.inc("loyalty.duplicates")
+        self._conn.executemany(
+            "INSERT INTO points VALUES (?, ?) ON CONFLICT (customer_id) DO UPDATE SET balance = balance + ?",
+            [(customer_id, points, points) for customer_id, points in totals.items()],
+        )
+        # Redemptions and refunds in the order they were queued, so a retry follows its refund
+        for item in items:
+            if isinstance(item, _Redemption):
+                item.result = self._redeem(item, ts)
+            elif isinstance(item, _Refund):
+                self._refund(item)
+        self._conn.execute("COMMIT")
+
+    def _rollback(self):
+        """Rolls back a failed transaction, if one is still open."""
+        try:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+        except sqlite3.Error as e:
+            print(f"Error rolling back loyalty points: {e}")
+
+    def _redeem(self, redemption, ts):
+        """Applies one redemption and returns the points it spent."""
+        row = self._conn.execute(
+            "SELECT points FROM points_events WHERE event_id = ?", (redemption.event_id,)
+        ).fetchone()
+        if row is not None:
+            return -row[0]
+        row = self._conn.execute(
+            "SELECT balance FROM points WHERE customer_id = ?", (redemption.customer_id,)
+        ).fetchone()
+        points = min(redemption.points, row[0] if row else 0)
+        if points:
+            self._conn.execute("UPDATE points SET balance = balance - ? WHERE customer_id = ?",
+                               (points, redemption.customer_id))
+            self._conn.execute("INSERT INTO points_events VALUES (?, ?, ?, ?)",
+                               (redemption.event_id, redemption.customer_id, -points, ts))
+        return points
+
+    def _refund(self, refund):
+        """Applies one refund, giving back what its redemption spent and forgetting the redemption."""
+        row = self._conn.execute(
+            "SELECT points FROM points_events WHERE event_id = ? AND customer_id = ? AND points < 0",
+            (refund.event_id, refund.customer_id)
+        ).fetchone()
+        if row is None:
+            metrics.inc("loyalty.duplicates")
+            return
+        self._conn.execute("UPDATE points SET balance = balance - ? WHERE customer_id = ?",
+                           (row[0], refund.customer_id))
+        self._conn.execute("DELETE FROM points_events WHERE event_id = ?", (refund.event_id,))
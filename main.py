@@ -3,89 +3,142 @@ from kivy.uix.screenmanager import ScreenManager, Screen
 from kivymd.app import MDApp
 from kivy.uix.image import Image
 from kivy.clock import Clock
-import cv2
-from pyzbar.pyzbar import decode
-from reportlab.pdfgen import canvas
-import os
 from kivymd.uix.button import MDRaisedButton
 from kivymd.uix.label import MDLabel
+from kivymd.uix.dialog import MDDialog
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.gridlayout import GridLayout
 from kivy.uix.widget import Widget
 from kivy.graphics import Rectangle, Color
-
-# Wallet class for customer balances
-class Wallet:
-    def __init__(self, initial_balance=100.0):
-        """Initializes the wallet with a starting balance."""
-        self.balance = initial_balance
-
-    def get_balance(self):
-        """Returns the current balance."""
-        return self.balance
-
-    def deduct_amount(self, amount):
-        """Deducts the specified amount from the wallet if sufficient funds are available."""
-        if self.balance >= amount:
-            self.balance -= amount
-            return True
-        else:
-            return False
+import metrics
+from decode_worker import DecodeWorker
+from scanner_loader import load_scanner_async
+from scan_debounce import ScanDebouncer
+from scan_tracker import ScanTracker, basket_items, batch_scan_from_env
+from checkout import CheckoutError, CheckoutService
+from checkout_client import connect_from_env
+from journal import new_id
+from loyalty import POINT_VALUE_CENTS
+from receipts import generate_receipt_async
+from sync import start_from_env
 
 # Class for displaying the camera feed and scanning QR codes
 class CameraPreview(Image):
-    def __init__(self, capture, fps=30, **kwargs):
-        """Initializes the camera preview widget."""
+    def __init__(self, capture, parent_screen, decode_fn, fps=30, stats_interval=10,
+                 debounce_window=2.0, debounce_size=128, gate_settings=None, batch=False, **kwargs):
+        """Initializes the camera preview widget.
+
+        With batch, every code in a frame is taken, and codes are tracked
+        across frames so each item in view is counted once.
+        """
         super().__init__(**kwargs)
+        # Imported here so numpy is only loaded once the scanner is in use
+        from frame_gate import FrameGate
+        from preview import TextureUploader
         self.capture = capture
+        self.parent_screen = parent_screen
         self.fps = fps
+        # The camera image is upside down; the uploader corrects that with texture coordinates
+        self.uploader = TextureUploader(rotate_180=True)
+        # Repeat scans of a code that stays in view are dropped before they reach payment
+        self.debouncer = ScanDebouncer(window=debounce_window, max_entries=debounce_size)
+        # In batch mode each code in view is followed by its bounding box instead, so copies of a product all count
+        self.tracker = ScanTracker() if batch else None
+        # Unchanged and blurry frames are skipped before decoding, and an idle scene is decoded less and less often
+        self.gate = FrameGate(**(gate_settings or {}))
+        # Decoding runs on a background worker so slow frames never stall the preview
+        self.decode_worker = DecodeWorker(decode_fn=decode_fn, on_result=self.on_decoded, gate=self.gate)
+        self.decode_worker.start()
         Clock.schedule_interval(self.update, 1.0 / self.fps)
+        Clock.schedule_interval(self.report_stats, stats_interval)
 
     def update(self, dt):
         """Updates the camera feed and scans for QR codes."""
         if not self.capture.isOpened():
-            print("Error: Camera is not opened.")
+            # Already reported when the camera failed to open; this runs on every tick
+            metrics.inc("preview.camera_closed")
             return
         
+        # The capture thread keeps only the newest frame, so this never waits on the camera
         ret, frame = self.capture.read()
         if not ret:
-            print("Error: Failed to read from the camera.")
             return
         
         try:
-            # Rotate the frame 180 degrees to correct the upside-down view
-            frame = cv2.rotate(frame, cv2.ROTATE_180)
-
-            buf = frame.tobytes()
-
-            if not self.texture or self.texture.size != (frame.shape[1], frame.shape[0]):
-                from kivy.graphics.texture import Texture
-                self.texture = Texture.create(size=(frame.shape[1], frame.shape[0]), colorfmt='bgr')
-                self.texture.flip_vertical()
-            self.texture.blit_buffer(buf, colorfmt='bgr', bufferfmt='ubyte')
+            # Blit straight from the camera buffer; the 180 degree rotation is done by the texture
+            with metrics.span("preview.blit"):
+                self.texture = self.uploader.upload(frame)
             self.canvas.ask_update()
 
-            # Scan for QR codes
-            decoded_objects = decode(frame)
-            for obj in decoded_objects:
-                print(f"QR Code detected: {obj.data.decode('utf-8')}")
-                self.parent.process_qr_data(obj.data.decode('utf-8'))
-                break
+            # Hand the frame to the decode worker; QR codes come back through on_decoded
+            self.decode_worker.submit(frame)
         except Exception as e:
             print(f"An error occurred during frame update: {e}")
 
+    def on_decoded(self, decoded_objects):
+        """Processes QR codes found by the decode worker on the UI thread."""
+        if self.tracker is not None:
+            new = self.tracker.update(decoded_objects)
+            metrics.inc("scan.suppressed", len(decoded_objects) - len(new))
+            if new:
+                metrics.inc("scan.accepted", len(new))
+                # Everything that came into view in this frame goes to the basket together
+                self.parent_screen.process_qr_batch([obj.data.decode('utf-8') for obj in new], scan_id=new_id())
+            return
+        for obj in decoded_objects:
+            if not self.debouncer.accept(obj.data, obj.rect):
+                metrics.inc("scan.suppressed")
+                break
+            metrics.inc("scan.accepted")
+            # Each accepted scan gets its own idempotency key so a retried payment is charged once
+            self.parent_screen.process_qr_data(obj.data.decode('utf-8'), scan_id=new_id())
+            break
+
+    def report_stats(self, dt):
+        """Reports how many frames were captured, decoded and dropped, and how many scans were suppressed."""
+        if metrics.enabled:
+            # The same counters are in the metrics export, so there is no need to print them
+            return
+        stats = self.decode_worker.stats.snapshot()
+        scans = self.debouncer.stats()
+        gate = self.gate.stats()
+        tracked = f", items={self.tracker.stats()['items']}" if self.tracker is not None else ""
+        print(f"Decode stats: captured={stats['frames_captured']}, "
+              f"decoded={stats['frames_decoded']}, dropped={stats['frames_dropped']}, "
+              f"skipped={stats['frames_skipped']} ({gate['skip_ratio']:.0%}), "
+              f"suppressed={scans['suppressed']}{tracked}")
+
+    def stop(self):
+        """Stops the preview updates and the decode worker."""
+        Clock.unschedule(self.update)
+        Clock.unschedule(self.report_stats)
+        self.decode_worker.stop()
+
 # Screen class for QR code scanning, payment processing, and receipt generation
 class QRCodeScannerScreen(Screen):
-    def __init__(self, app, wallet, **kwargs):
+    def __init__(self, app, capture_settings=None, decoder_settings=None, gate_settings=None, batch_scan=False,
+                 **kwargs):
         """Initializes the QR code scanner screen."""
         super().__init__(**kwargs)
         self.app = app
-        self.wallet = wallet
-        self.capture = cv2.VideoCapture(0)
-        if not self.capture.isOpened():
-            print("Error: Unable to access the camera.")
-            return
-        print("Camera successfully opened.")
+        # capture_settings are CaptureThread options: source, width, height, fps, fourcc, buffer_size
+        self.capture_settings = capture_settings or {}
+        # decoder_settings are make_scan_decoder options. In "roi" mode only the grayscale guide box is
+        # decoded, with a periodic full-frame fallback; decoder is a backend name from
+        # decoders.BACKENDS, or "auto" to pick the fastest one as it runs
+        # Shoppers scan both the store's printed labels and the retail codes on packaging
+        self.decoder_settings = {"decoder": "pyzbar", "symbology": ("label", "product"), **(decoder_settings or {})}
+        # gate_settings are FrameGate options: motion_threshold, blur_threshold, box, idle_interval and
+        # max_idle_interval; both thresholds at 0 decode every frame
+        self.gate_settings = gate_settings or {}
+        # batch_scan takes every code in view at once, so by default the whole frame is decoded and checked
+        self.batch_scan = batch_scan
+        if batch_scan:
+            self.decoder_settings = {"decode_mode": "full", "multi": True, **self.decoder_settings}
+            self.gate_settings = {"box": None, **self.gate_settings}
+        self.capture = None
+        self.camera_preview = None
+        self.camera_loading = False
         
         # Main layout for the screen
         main_layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
@@ -99,7 +152,7 @@ class QRCodeScannerScreen(Screen):
             self.rect = Rectangle(pos=(20, self.height - 70), size=(self.width - 40, 40))
         
         self.balance_label = MDLabel(
-            text=f"[Wallet Balance: ${self.wallet.get_balance():.2f}]",
+            text=f"[Wallet Balance: ${self.app.balance_cents() / 100:.2f}]",
             halign="center",
             theme_text_color="Secondary",
             markup=True,
@@ -110,11 +163,13 @@ class QRCodeScannerScreen(Screen):
         # Add "Coupons" and "Points" buttons
         self.coupons_button = MDRaisedButton(
             text="Coupons",
-            pos_hint={"center_x": 0.5}
+            pos_hint={"center_x": 0.5},
+            on_release=lambda x: self.app.show_coupons()
         )
         self.points_button = MDRaisedButton(
             text="Points",
-            pos_hint={"center_x": 0.5}
+            pos_hint={"center_x": 0.5},
+            on_release=lambda x: self.app.show_points()
         )
         header_layout.add_widget(self.coupons_button)
         header_layout.add_widget(self.points_button)
@@ -129,9 +184,11 @@ class QRCodeScannerScreen(Screen):
             Rectangle(pos=ad_box.pos, size=ad_box.size)
         main_layout.add_widget(ad_box)
 
-        # Add the camera preview
-        self.camera_preview = CameraPreview(capture=self.capture)
-        main_layout.add_widget(self.camera_preview)
+        # The camera preview takes this slot once the camera is open
+        self.preview_slot = BoxLayout()
+        self.camera_status = MDLabel(text="Starting camera...", halign="center", theme_text_color="Secondary")
+        self.preview_slot.add_widget(self.camera_status)
+        main_layout.add_widget(self.preview_slot)
 
         # Add a button for generating the receipt
         self.receipt_button = MDRaisedButton(
@@ -145,74 +202,230 @@ class QRCodeScannerScreen(Screen):
         # Add the layout to the screen
         self.add_widget(main_layout)
 
-    def process_qr_data(self, data):
-        """Processes the QR code data, identifies the product, and deducts the price from the wallet."""
-        # Simulated product database (replace with real database or API call)
-        product_database = {
-            "product123": {"name": "Product A", "price": 15.0},
-            "product456": {"name": "Product B", "price": 20.0},
-            "product789": {"name": "Product C", "price": 25.0}
-        }
-
+    def process_qr_data(self, data, scan_id=None):
+        """Processes the QR code data, identifies the product, and deducts the discounted price from the wallet."""
         # Extract product information from the QR code data
-        product_id = data  # Assume the QR code contains the product ID
-        product_info = product_database.get(product_id)
-
-        if product_info:
-            item_name = product_info["name"]
-            item_price = product_info["price"]
-            
-            if self.wallet.deduct_amount(item_price):
-                print(f"Scanned item: {item_name}, Price: ${item_price:.2f}")
-                try:
-                    # Log the transaction to a file for receipt generation
-                    with open("transactions.txt", "a") as file:
-                        file.write(f"Scanned item: {item_name}, Price: ${item_price:.2f}\n")
-                    print(f"Payment of ${item_price:.2f} processed for: {item_name}")
-                    
-                    # Update the balance display
-                    self.balance_label.text = f"[Wallet Balance: ${self.wallet.get_balance():.2f}]"
-                except Exception as e:
-                    print(f"Error writing to file: {e}")
+        product_id = data  # Assume the QR code contains the product ID or EAN
+        checkout = self.app.checkout
+        basket_id = self.app.basket_id
+        # The scan ID is both the basket line and the payment, so a retried scan is held and charged once
+        line_id = scan_id or new_id()
+        try:
+            # Holding the unit before charging means two lanes cannot sell the last one
+            line = checkout.add_item(basket_id, product_id, 1, line_id=line_id)
+        except OSError as e:
+            print(f"Checkout server unreachable: {e}. Payment not processed.")
+            return
+        except CheckoutError as e:
+            if e.status == 404:
+                print("Product not found in the database. Payment not processed.")
             else:
+                print(f"{e.message}. Payment not processed.")
+            return
+
+        item_name = line["product"]["name"]
+        try:
+            payment = checkout.pay(basket_id, payment_id=line_id, use_points=self.app.use_points)
+        except OSError as e:
+            # The payment may have gone through, so the line stays held; a retry with the scan ID charges once
+            print(f"Payment not confirmed: {e}")
+            return
+        except CheckoutError as e:
+            try:
+                checkout.remove_item(basket_id, line_id)
+            except (CheckoutError, OSError) as remove_error:
+                print(f"{item_name} not returned to stock: {remove_error}")
+            if e.status == 402:
                 print("Insufficient balance. Payment failed.")
-        else:
-            print("Product not found in the database. Payment not processed.")
+            else:
+                print(f"Payment failed: {e.message}")
+            return
+
+        print(f"Scanned item: {item_name}, Price: ${line['product']['price']:.2f}")
+        if payment["discount_cents"]:
+            print(f"{line['coupon']}: -${payment['discount_cents'] / 100:.2f}")
+        print(f"Payment of ${(payment['charged_cents'] + payment['points_cents']) / 100:.2f} processed for: {item_name}")
+
+        # The sale is committed locally; wake the sync engine to send it to the retailer
+        if self.app.sync is not None:
+            self.app.sync.notify()
+
+        # Update the balance display
+        self.balance_label.text = f"[Wallet Balance: ${payment['balance_cents'] / 100:.2f}]"
+
+    def process_qr_batch(self, codes, scan_id=None):
+        """Adds every item that came into view in one frame to the basket in one call and pays for them together."""
+        checkout = self.app.checkout
+        basket_id = self.app.basket_id
+        # The scan ID is the payment, and the lines are derived from it, so a retried batch is charged once
+        scan_id = scan_id or new_id()
+        try:
+            result = checkout.add_items(basket_id, basket_items(codes, scan_id))
+        except (CheckoutError, OSError) as e:
+            print(f"Items not added: {e}")
+            return
+        lines = [line for line in result["lines"] if "error" not in line]
+        for line in result["lines"]:
+            if "error" in line:
+                print(f"{line['error']}. {line['code']} not added.")
+        if not lines:
+            return
+
+        try:
+            payment = checkout.pay(basket_id, payment_id=scan_id, use_points=self.app.use_points)
+        except OSError as e:
+            # The payment may have gone through, so the lines stay held; a retry with the scan ID charges once
+            print(f"Payment not confirmed: {e}")
+            return
+        except CheckoutError as e:
+            for line in lines:
+                try:
+                    checkout.remove_item(basket_id, line["line_id"])
+                except (CheckoutError, OSError) as remove_error:
+                    print(f"{line['product']['name']} not returned to stock: {remove_error}")
+            if e.status == 402:
+                print("Insufficient balance. Payment failed.")
+            else:
+                print(f"Payment failed: {e.message}")
+            return
+
+        for line in lines:
+            print(f"Scanned item: {line['product']['name']} x{line['quantity']}, "
+                  f"Price: ${line['product']['price']:.2f}")
+        if payment["discount_cents"]:
+            print(f"Discounts: -${payment['discount_cents'] / 100:.2f}")
+        print(f"Payment of ${(payment['charged_cents'] + payment['points_cents']) / 100:.2f} processed "
+              f"for {sum(line['quantity'] for line in lines)} items")
+
+        if self.app.sync is not None:
+            self.app.sync.notify()
+        self.balance_label.text = f"[Wallet Balance: ${payment['balance_cents'] / 100:.2f}]"
+
+    def on_enter(self):
+        """Starts opening the camera in the background so the screen shows straight away."""
+        if self.camera_preview is None and not self.camera_loading:
+            self.camera_loading = True
+            load_scanner_async(self.on_camera_ready, self.capture_settings, self.decoder_settings)
+
+    def on_camera_ready(self, capture, decode_fn):
+        """Adds the camera preview once the camera is open, or reports that it could not be opened."""
+        self.camera_loading = False
+        if capture is None:
+            print("Error: Unable to access the camera.")
+            self.camera_status.text = "Camera unavailable"
+            return
+        if self.manager is not None and self.manager.current_screen is not self:
+            # The screen was left while the camera was opening
+            capture.release()
+            return
+        print("Camera successfully opened.")
+        self.capture = capture
+        self.camera_preview = CameraPreview(capture=capture, parent_screen=self, decode_fn=decode_fn,
+                                            gate_settings=self.gate_settings, batch=self.batch_scan)
+        self.preview_slot.clear_widgets()
+        self.preview_slot.add_widget(self.camera_preview)
 
     def on_leave(self):
         """Releases the camera when leaving the screen."""
-        if self.capture.isOpened():
+        if self.camera_preview is not None:
+            self.camera_preview.stop()
+            self.preview_slot.clear_widgets()
+            self.preview_slot.add_widget(self.camera_status)
+            self.camera_preview = None
+        if self.capture is not None and self.capture.isOpened():
             self.capture.release()
             print("Camera released.")
+        self.capture = None
 
 # Main app class for managing the app and generating receipts
 class MainApp(MDApp):
     def build(self):
-        """Builds the main app and initializes the wallet."""
-        self.wallet = Wallet(initial_balance=100.0)  # Set an initial balance for testing
+        """Builds the main app and opens the customer's wallet and basket."""
+        metrics.configure_from_env()
+        # The shared checkout server if GOBUY_SERVER names one, otherwise the stores on this machine
+        self.checkout = connect_from_env() or CheckoutService()
+        # Working offline-first, sales committed here are sent to the server named by GOBUY_SYNC
+        self.sync = start_from_env(self.checkout.journal.path) if isinstance(self.checkout, CheckoutService) else None
+        self.customer_id = "customer"
+        # A checkout server's wallets are opened when it is set up, with --wallet
+        if isinstance(self.checkout, CheckoutService):
+            self.checkout.open_wallet(self.customer_id, initial_balance=100.0)  # Initial balance for testing
+        basket = self.checkout.open_basket(self.customer_id)
+        self.basket_id = basket["basket_id"]
+        self.session_id = basket["session_id"]
+        self.use_points = False
         sm = ScreenManager()
-        screen = QRCodeScannerScreen(app=self, wallet=self.wallet, name='scanner')
+        # GOBUY_BATCH_SCAN takes every code in view, for scanning a whole basket at once
+        screen = QRCodeScannerScreen(app=self, batch_scan=batch_scan_from_env(), name='scanner')
         sm.add_widget(screen)
         return sm
 
+    def on_stop(self):
+        """Returns unpaid stock, writes any queued transactions and any profiler samples before the app exits."""
+        try:
+            self.checkout.close_basket(self.basket_id)
+        except OSError as e:
+            # The server returns the stock once the basket's holds expire
+            print(f"Basket not closed: {e}")
+        if self.sync is not None:
+            self.sync.close()
+        self.checkout.close()
+        metrics.shutdown()
+
+    def balance_cents(self):
+        """Returns the customer's wallet balance in cents."""
+        return self.checkout.wallet(self.customer_id)["balance_cents"]
+
+    def show_coupons(self):
+        """Shows the promotions applied to the basket and how many are running."""
+        try:
+            applied = self.checkout.applied(self.basket_id)
+            running = self.checkout.coupons(limit=0)["count"]
+        except (CheckoutError, OSError) as e:
+            print(f"Coupons unavailable: {e}")
+            return
+        lines = [f"{line['product']}: {line['coupon']} (-${line['discount_cents'] / 100:.2f})"
+                 for line in applied["promotions"]]
+        lines.append(f"Saved so far: ${applied['discount_cents'] / 100:.2f}")
+        lines.append(f"{running} promotions running")
+        MDDialog(title="Coupons", text="\n".join(lines), size_hint=(0.8, 0.5)).open()
+
+    def show_points(self):
+        """Shows the customer's points and lets them choose whether checkout spends them."""
+        try:
+            points = self.checkout.wallet(self.customer_id)["points"]
+        except (CheckoutError, OSError) as e:
+            print(f"Points unavailable: {e}")
+            return
+        dialog = MDDialog(
+            title="Points",
+            text=f"You have {points} points (${points * POINT_VALUE_CENTS / 100:.2f}).\n"
+                 f"Points are {'being' if self.use_points else 'not being'} spent at checkout.",
+            size_hint=(0.8, 0.5),
+            buttons=[
+                MDRaisedButton(
+                    text="Save points" if self.use_points else "Use points",
+                    on_release=lambda x: self.toggle_points(dialog)
+                )
+            ]
+        )
+        dialog.open()
+
+    def toggle_points(self, dialog):
+        """Switches spending points at checkout on or off."""
+        self.use_points = not self.use_points
+        dialog.dismiss()
+
     def generate_receipt(self):
-        """Generates a PDF receipt from the transactions file."""
-        if os.path.exists("transactions.txt"):
-            try:
-                c = canvas.Canvas("receipt.pdf")
-                c.drawString(100, 800, "Transaction Receipt")
-                with open("transactions.txt", "r") as file:
-                    lines = file.readlines()
-                    y = 780
-                    for line in lines:
-                        c.drawString(100, y, line.strip())
-                        y -= 20
-                c.save()
-                print("Receipt generated as receipt.pdf")
-            except Exception as e:
-                print(f"Error generating receipt: {e}")
+        """Generates a paginated PDF receipt for the current session on a worker thread."""
+        generate_receipt_async(lambda: self.checkout.sales(self.session_id), self.on_receipt_generated)
+
+    def on_receipt_generated(self, result):
+        """Reports the outcome of a background receipt render."""
+        if isinstance(result, Exception):
+            print(f"Error generating receipt: {result}")
         else:
-            print("No transactions to include in the receipt.")
+            print(f"Receipt generated as {result['path']} ({result['lines']} lines, {result['pages']} pages)")
 
 # Run the app
 if __name__ == '__main__':
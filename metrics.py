@@ -0,0 +1,294 @@
+"""Lightweight counters, histograms and spans for the scanner hot path.
+
+Call sites use the module functions (metrics.inc, metrics.observe,
+metrics.span, metrics.gauge). While metrics are disabled those names are
+bound to no-ops, so instrumentation costs one function call. enable()
+rebinds them to the recording versions.
+
+Snapshots can be written to a JSON file periodically or served as
+Prometheus text on a local port, and a sampling profiler can be switched
+on for field debugging. configure_from_env() sets all of this up from
+GOBUY_METRICS, GOBUY_METRICS_JSON, GOBUY_METRICS_PORT and GOBUY_PROFILE.
+"""
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+# Distribution of observed values with fixed buckets
+class Histogram:
+    def __init__(self):
+        """Initializes an empty histogram."""
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Adds one value."""
+        index = 0
+        while index < len(BUCKETS_MS) and value > BUCKETS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def to_dict(self):
+        """Returns the histogram as plain data."""
+        return {"count": self.count, "sum": self.total, "min": self.min, "max": self.max,
+                "mean": self.total / self.count if self.count else None,
+                "buckets": dict(zip([str(b) for b in BUCKETS_MS] + ["+Inf"], self.buckets))}
+
+
+# Process-wide store of counters, gauges and histograms
+class Registry:
+    def __init__(self):
+        """Initializes an empty registry."""
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = collections.defaultdict(int)
+        self.gauges = {}
+        self.histograms = collections.defaultdict(Histogram)
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def snapshot(self):
+        """Returns all metrics as JSON-serialisable data."""
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "uptime_s": time.time() - self.started,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms_ms": {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            metric = _metric_name(name) + "_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(snap["gauges"].items()):
+            metric = _metric_name(name)
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        for name, hist in sorted(snap["histograms_ms"].items()):
+            metric = _metric_name(name) + "_ms"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in hist["buckets"].items():
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f"{metric}_sum {hist['sum']}", f"{metric}_count {hist['count']}"]
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name):
+    """Turns a dotted metric name into a Prometheus metric name."""
+    return "gobuy_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+REGISTRY = Registry()
+enabled = False
+_profiler = None
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def _noop_span(name):
+    return _NOOP_SPAN
+
+
+@contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, (time.perf_counter() - start) * 1000)
+
+
+# Bound to no-ops until enable() is called
+inc = _noop
+gauge = _noop
+observe = _noop
+span = _noop_span
+
+
+def enable():
+    """Starts recording metrics."""
+    global enabled, inc, gauge, observe, span
+    enabled = True
+    inc, gauge, observe, span = REGISTRY.inc, REGISTRY.gauge, REGISTRY.observe, _span
+
+
+def disable():
+    """Stops recording metrics; already recorded values are kept."""
+    global enabled, inc, gauge, observe, span
+    enabled = False
+    inc, gauge, observe, span = _noop, _noop, _noop, _noop_span
+
+
+def snapshot():
+    """Returns the current metrics as plain data."""
+    return REGISTRY.snapshot()
+
+
+def start_json_export(path, interval=10.0):
+    """Writes a snapshot to path every interval seconds on a daemon thread."""
+    def run():
+        while True:
+            time.sleep(interval)
+            temp_path = path + ".tmp"
+            try:
+                with open(temp_path, "w") as file:
+                    json.dump(REGISTRY.snapshot(), file, indent=2)
+                # Replace atomically so readers never see a half-written file
+                os.replace(temp_path, path)
+            except Exception as e:
+                # A full disk or a missing directory must not stop later exports
+                print(f"Failed to write metrics to {path}: {e}")
+
+    thread = threading.Thread(target=run, name="metrics-json", daemon=True)
+    thread.start()
+    return thread
+
+
+def serve(port=9464, host="127.0.0.1"):
+    """Serves Prometheus text on /metrics (and JSON on /metrics.json) from a daemon thread."""
+    # http.server (and the email package it pulls in) is slow to import, so only load it when asked
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics.json":
+                body, content_type = json.dumps(REGISTRY.snapshot()).encode(), "application/json"
+            else:
+                body, content_type = REGISTRY.prometheus().encode(), "text/plain; version=0.0.4"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+# Statistical profiler that periodically samples every thread's Python stack
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        """Initializes the profiler with the sampling interval in seconds."""
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts sampling on a daemon thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while self._running:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def write(self, path):
+        """Writes the samples in collapsed-stack format, readable by flamegraph tools."""
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+def configure_from_env(environ=os.environ):
+    """Enables metrics, exporters and the profiler according to GOBUY_* environment variables.
+
+    GOBUY_METRICS=1 records metrics, GOBUY_METRICS_JSON=<file> also writes a
+    snapshot every GOBUY_METRICS_INTERVAL seconds, GOBUY_METRICS_PORT=<port>
+    serves them on localhost, and GOBUY_PROFILE=<file> runs the sampling
+    profiler until shutdown() writes its stacks to that file.
+    """
+    global _profiler
+    if environ.get("GOBUY_METRICS", "") in ("1", "true", "yes"):
+        enable()
+    if environ.get("GOBUY_METRICS_JSON"):
+        enable()
+        start_json_export(environ["GOBUY_METRICS_JSON"], float(environ.get("GOBUY_METRICS_INTERVAL", "10")))
+    if environ.get("GOBUY_METRICS_PORT"):
+        enable()
+        serve(int(environ["GOBUY_METRICS_PORT"]))
+    if environ.get("GOBUY_PROFILE") and _profiler is None:
+        _profiler = SamplingProfiler()
+        _profiler.path = environ["GOBUY_PROFILE"]
+        _profiler.start()
+
+
+def shutdown():
+    """Stops the profiler started by configure_from_env and writes out its samples."""
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler.write(_profiler.path)
+        _profiler = None
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+# Uploads camera frames to a Kivy texture without copying them, doing the orientation with texture coordinates
+class TextureUploader:
+    def __init__(self, rotate_180=False, flip_vertical=False):
+        """Initializes the uploader with the orientation fix the preview needs.
+
+        rotate_180 and flip_vertical describe the same correction that used
+        to be applied with cv2.rotate(frame, ROTATE_180) and cv2.flip(frame, 0);
+        here they only flip the texture's UVs, so the pixels are never moved.
+        """
+        # Kivy textures start at the bottom row, so camera rows already need one vertical flip
+        self.flip_v = (not flip_vertical) ^ rotate_180
+        self.flip_h = rotate_180
+        self.texture = None
+        self._staging = None
+
+    def prepare(self, frame):
+        """Returns a flat byte buffer over the frame's pixels, copying only if the frame is not contiguous.
+
+        Non-contiguous frames (such as crops or views) are copied into a
+        staging array that is allocated once and reused for every frame of
+        the same shape.
+        """
+        if frame.flags.c_contiguous:
+            # reshape on a contiguous array is a view, so this only wraps the existing pixels
+            return frame.reshape(-1).data
+        if self._staging is None or self._staging.shape != frame.shape or self._staging.dtype != frame.dtype:
+            self._staging = np.empty(frame.shape, frame.dtype)
+        np.copyto(self._staging, frame)
+        return self._staging.reshape(-1).data
+
+    def upload(self, frame):
+        """Blits a BGR frame into the texture, creating the texture when the frame size changes."""
+        size = (frame.shape[1], frame.shape[0])
+        if self.texture is None or self.texture.size != size:
+            from kivy.graphics.texture import Texture
+            self.texture = Texture.create(size=size, colorfmt='bgr')
+            if self.flip_v:
+                self.texture.flip_vertical()
+            if self.flip_h:
+                self.texture.flip_horizontal()
+        self.texture.blit_buffer(self.prepare(frame), colorfmt='bgr', bufferfmt='ubyte')
+        return self.texture
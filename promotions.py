@@ -0,0 +1,290 @@
+import collections
+import sqlite3
+import threading
+import time
+
+from catalog import DEFAULT_PATH
+
+# What a promotion's value means for each kind:
+#   percent: percentage off the line
+#   fixed:   cents off each unit
+#   bogo:    units to buy for each free unit (1 is buy one, get one free)
+KINDS = ("percent", "fixed", "bogo")
+
+# What a promotion applies to: one product ID, or every product in a category
+SCOPES = ("sku", "category")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS promotions (
+    promotion_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    target TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS promotion_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO promotion_version VALUES (1, 0);
+CREATE TABLE IF NOT EXISTS promotion_requests (
+    request_id TEXT PRIMARY KEY,
+    promotion_id INTEGER NOT NULL
+);
+"""
+
+Promotion = collections.namedtuple("Promotion", "promotion_id name kind scope target value")
+
+
+def line_discount(promotion, unit_cents, quantity):
+    """Returns the discount in cents a promotion gives on quantity units at unit_cents each."""
+    if promotion.kind == "percent":
+        return unit_cents * quantity * promotion.value // 100
+    if promotion.kind == "fixed":
+        return min(promotion.value, unit_cents) * quantity
+    return quantity // (promotion.value + 1) * unit_cents
+
+
+# Active promotions compiled into lookups by product ID and by category
+class PromotionIndex:
+    def __init__(self, promotions, version=None):
+        """Initializes the index from a list of Promotions."""
+        self.version = version
+        self.count = 0
+        self.by_sku = {}
+        self.by_category = {}
+        for promotion in promotions:
+            buckets = self.by_sku if promotion.scope == "sku" else self.by_category
+            buckets.setdefault(promotion.target, []).append(promotion)
+            self.count += 1
+
+    def index(self):
+        """Returns the index itself, so a fixed index can stand in for a PromotionStore."""
+        return self
+
+    def candidates(self, product):
+        """Returns the promotions that apply to a product."""
+        return self.by_sku.get(product["product_id"], []) + self.by_category.get(product.get("category"), [])
+
+    def best(self, product, quantity, paid_quantity=0):
+        """Returns (discount_cents, promotion) for the promotion that saves most on a line, or (0, None).
+
+        Promotions do not stack; a line gets the single best one. Only
+        quantity units are priced: paid_quantity units already paid for
+        count towards a promotion such as buy one, get one free, but the
+        discount they were charged with is not given again.
+        """
+        best_discount, best_promotion = 0, None
+        for promotion in self.candidates(product):
+            discount = (line_discount(promotion, product["price_cents"], paid_quantity + quantity)
+                        - line_discount(promotion, product["price_cents"], paid_quantity))
+            if discount > best_discount:
+                best_discount, best_promotion = discount, promotion
+        return best_discount, best_promotion
+
+
+# Promotions stored in the catalog database
+class PromotionStore:
+    def __init__(self, path=DEFAULT_PATH):
+        """Opens (or creates) the promotion tables in the catalog database."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._index = None
+
+    def add(self, name, kind, scope, target, value, request_id=None):
+        """Adds an active promotion and returns it; raises ValueError for an invalid one.
+
+        Adding again with the same request_id returns the promotion the first
+        call added instead of adding another, so a resent request is harmless.
+        """
+        return self.add_many([(name, kind, scope, target, value)], [request_id])[0]
+
+    def add_many(self, promotions, request_ids=None):
+        """Adds (name, kind, scope, target, value) promotions in one transaction and returns them.
+
+        request_ids, if given, has an ID or None for each promotion, as add() takes it.
+        """
+        rows = []
+        for name, kind, scope, target, value in promotions:
+            value = int(value)
+            if kind not in KINDS:
+                raise ValueError(f"Unknown promotion kind: {kind}")
+            if scope not in SCOPES:
+                raise ValueError(f"Unknown promotion scope: {scope}")
+            if not name or not target:
+                raise ValueError("A promotion needs a name and a target")
+            if value < 1 or (kind == "percent" and value > 100):
+                raise ValueError(f"Invalid {kind} promotion value: {value}")
+            rows.append((name, kind, scope, target, value))
+        added = []
+        inserted = False
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for row, request_id in zip(rows, request_ids or [None] * len(rows)):
+                    if request_id is not None:
+                        existing = self._conn.execute(
+                            "SELECT p.promotion_id, p.name, p.kind, p.scope, p.target, p.value "
+                            "FROM promotion_requests r JOIN promotions p USING (promotion_id) WHERE r.request_id = ?",
+                            (request_id,),
+                        ).fetchone()
+                        if existing is not None:
+                            added.append(Promotion(*existing))
+                            continue
+                    cursor = self._conn.execute(
+                        "INSERT INTO promotions (name, kind, scope, target, value, created) VALUES (?, ?, ?, ?, ?, ?)",
+                        row + (time.time(),),
+                    )
+                    if request_id is not None:
+                        self._conn.execute("INSERT INTO promotion_requests VALUES (?, ?)",
+                                           (request_id, cursor.lastrowid))
+                    added.append(Promotion(cursor.lastrowid, *row))
+                    inserted = True
+                if inserted:
+                    self._bump_version()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def deactivate(self, promotion_id):
+        """Stops a promotion from applying to new scans."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("UPDATE promotions SET active = 0 WHERE promotion_id = ?", (promotion_id,))
+                self._bump_version()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _bump_version(self):
+        """Records that the promotions changed, so every process rebuilds its index."""
+        self._conn.execute("UPDATE promotion_version SET version = version + 1 WHERE id = 1")
+
+    def version(self):
+        """Returns a number that changes whenever any process changes the promotions."""
+        with self._lock:
+            return self._conn.execute("SELECT version FROM promotion_version WHERE id = 1").fetchone()[0]
+
+    def active(self, limit=None):
+        """Returns active promotions, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT promotion_id, name, kind, scope, target, value FROM promotions WHERE active = 1 "
+                "ORDER BY promotion_id DESC LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [Promotion(*row) for row in rows]
+
+    def index(self):
+        """Returns the PromotionIndex of the active promotions, rebuilding it only after a change.
+
+        Checking for a change is a single-row read, so this is cheap to call
+        on every scan.
+        """
+        version = self.version()
+        if self._index is None or self._index.version != version:
+            self._index = PromotionIndex(self.active(), version)
+        return self._index
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+# Basket lines with their best promotion, re-evaluated only for the product that changes
+class Basket:
+    def __init__(self, promotions):
+        """Initializes an empty basket priced with a PromotionStore or a PromotionIndex."""
+        self.promotions = promotions
+        self.lines = {}
+        self.subtotal_cents = 0
+        self.discount_cents = 0
+        self._index = None
+
+    @property
+    def total_cents(self):
+        """Returns what the basket costs after promotions."""
+        return self.subtotal_cents - self.discount_cents
+
+    def add(self, product, quantity=1):
+        """Adds quantity unpaid units of a catalog product (negative to take some out).
+
+        Returns (discount_cents, promotion): the change in the basket's
+        discount caused by this change, and the promotion now applied to
+        the product's line.
+        """
+        self._refresh_index()
+        line = self.lines.get(product["product_id"])
+        if line is None:
+            line = {"product": product, "quantity": 0, "paid_quantity": 0, "paid_discount_cents": 0,
+                    "discount_cents": 0, "promotion": None}
+        old_quantity, old_discount = line["quantity"], line["discount_cents"]
+        # Units already paid for cannot be taken out
+        line["quantity"] = max(old_quantity + quantity, line["paid_quantity"])
+        self._price(line)
+        if line["quantity"]:
+            self.lines[product["product_id"]] = line
+        else:
+            self.lines.pop(product["product_id"], None)
+        self.subtotal_cents += (line["quantity"] - old_quantity) * product["price_cents"]
+        self.discount_cents += line["discount_cents"] - old_discount
+        return line["discount_cents"] - old_discount, line["promotion"]
+
+    def due(self, product_id):
+        """Returns (discount_cents, promotion) for a product's units not yet paid for, or (0, None)."""
+        line = self.lines.get(product_id)
+        if line is None or line["quantity"] == line["paid_quantity"]:
+            return 0, None
+        discount = line["discount_cents"] - line["paid_discount_cents"]
+        return discount, line["promotion"] if discount else None
+
+    def settle(self, product_id):
+        """Records a product's unpaid units as paid, fixing the discount they were charged with."""
+        line = self.lines.get(product_id)
+        if line is not None:
+            line["paid_quantity"] = line["quantity"]
+            line["paid_discount_cents"] = line["discount_cents"]
+
+    def applied(self):
+        """Returns (product, promotion, discount_cents) for every line that has a promotion."""
+        return [(line["product"], line["promotion"], line["discount_cents"])
+                for line in self.lines.values() if line["promotion"] is not None]
+
+    def clear(self):
+        """Empties the basket."""
+        self.lines.clear()
+        self.subtotal_cents = 0
+        self.discount_cents = 0
+
+    def _price(self, line):
+        """Prices a line's unpaid units with the best promotion, keeping the discount its paid units were charged."""
+        unpaid = line["quantity"] - line["paid_quantity"]
+        discount, promotion = 0, None
+        if unpaid:
+            discount, promotion = self._index.best(line["product"], unpaid, line["paid_quantity"])
+        # A line whose paid units were discounted keeps showing that promotion until the unpaid units get one
+        if promotion is not None or not line["paid_discount_cents"]:
+            line["promotion"] = promotion
+        line["discount_cents"] = line["paid_discount_cents"] + discount
+
+    def _refresh_index(self):
+        """Picks up changed promotions, re-pricing the unpaid units already in the basket."""
+        index = self.promotions.index()
+        if index is self._index:
+            return
+        self._index = index
+        self.discount_cents = 0
+        for line in self.lines.values():
+            self._price(line)
+            self.discount_cents += line["discount_cents"]
@@ -0,0 +1,122 @@
+import os
+import threading
+
+from ui_thread import schedule_on_ui_thread
+
+PAGE_TOP = 800
+PAGE_BOTTOM = 60
+LINE_HEIGHT = 16
+
+# Held while a receipt is rendered, so two renders never write the same file at once
+_render_lock = threading.Lock()
+
+# Column x positions for item, quantity, unit price and subtotal
+COLUMNS = (60, 330, 400, 480)
+
+
+def _money(cents):
+    """Formats integer cents as a dollar amount."""
+    sign = "-" if cents < 0 else ""
+    return f"{sign}${abs(cents) / 100:.2f}"
+
+
+# Streams journal records into a paginated PDF receipt
+class ReceiptRenderer:
+    def __init__(self, path="receipt.pdf", title="Transaction Receipt"):
+        """Initializes the renderer with the output file and receipt title."""
+        self.path = path
+        self.title = title
+
+    def render(self, records):
+        """Draws one line per sale record, starting new pages as needed, and returns a summary.
+
+        records is consumed as a stream, so only the current page is laid out
+        in memory; finished pages are kept as compressed PDF streams.
+        """
+        from reportlab.pdfgen import canvas
+
+        self._canvas = canvas.Canvas(self.path, pageCompression=1)
+        self._page = 0
+        self._start_page()
+        lines = 0
+        items = 0
+        subtotal_cents = 0
+        discount_cents = 0
+        points_cents = 0
+        for record in records:
+            quantity = record["quantity"]
+            line_cents = record["amount_cents"]
+            self._row(record["name"], str(quantity), _money(record["unit_price_cents"]), _money(line_cents))
+            lines += 1
+            items += quantity
+            subtotal_cents += line_cents
+            discount = record.get("discount_cents", 0)
+            if discount:
+                self._row(f"  Coupon: {record.get('coupon', 'discount')}", "", "", _money(-discount))
+                discount_cents += discount
+            points_cents += record.get("points_cents", 0)
+
+        total_cents = subtotal_cents - discount_cents
+        self._y -= LINE_HEIGHT / 2
+        self._row("Subtotal", str(items), "", _money(subtotal_cents), bold=True)
+        if discount_cents:
+            self._row("Coupons", "", "", _money(-discount_cents), bold=True)
+        self._row("Total", "", "", _money(total_cents), bold=True)
+        if points_cents:
+            self._row("Paid with points", "", "", _money(points_cents))
+            self._row("Paid from wallet", "", "", _money(total_cents - points_cents))
+        self._canvas.save()
+        return {"path": self.path, "lines": lines, "pages": self._page, "total_cents": total_cents}
+
+    def _start_page(self):
+        """Starts a new page with the title and column headers."""
+        if self._page:
+            self._canvas.showPage()
+        self._page += 1
+        c = self._canvas
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(COLUMNS[0], PAGE_TOP, self.title)
+        c.setFont("Helvetica", 9)
+        c.drawRightString(COLUMNS[3] + 60, PAGE_TOP, f"Page {self._page}")
+        self._y = PAGE_TOP - 2 * LINE_HEIGHT
+        self._row("Item", "Qty", "Unit", "Subtotal", bold=True)
+
+    def _row(self, item, quantity, unit, subtotal, bold=False):
+        """Draws one receipt row, moving to a new page when the current one is full."""
+        if self._y < PAGE_BOTTOM:
+            self._start_page()
+        c = self._canvas
+        c.setFont("Helvetica-Bold" if bold else "Helvetica", 10)
+        c.drawString(COLUMNS[0], self._y, item[:45])
+        c.drawRightString(COLUMNS[1] + 30, self._y, quantity)
+        c.drawRightString(COLUMNS[2] + 50, self._y, unit)
+        c.drawRightString(COLUMNS[3] + 60, self._y, subtotal)
+        self._y -= LINE_HEIGHT
+
+
+def generate_receipt_async(records_factory, on_done, path="receipt.pdf", dispatch=None):
+    """Renders a receipt on a worker thread and passes the summary, or the error, to on_done.
+
+    records_factory is called on the worker thread so the journal is read
+    there rather than on the UI thread. Renders take turns, and each is
+    written to a temporary file that replaces path once it is complete, so
+    path never holds a half-written or interleaved receipt.
+    """
+    dispatch = dispatch or schedule_on_ui_thread
+
+    def run():
+        partial = path + ".tmp"
+        with _render_lock:
+            try:
+                result = ReceiptRenderer(partial).render(records_factory())
+                os.replace(partial, path)
+                result["path"] = path
+            except Exception as e:
+                if os.path.exists(partial):
+                    os.remove(partial)
+                result = e
+        dispatch(on_done, result)
+
+    thread = threading.Thread(target=run, name="receipt-renderer", daemon=True)
+    thread.start()
+    return thread
@@ -6,32 +6,39 @@ from kivymd.uix.label import MDLabel
 from kivymd.uix.textfield import MDTextField
 from kivymd.uix.dialog import MDDialog
 from kivy.uix.boxlayout import BoxLayout
-
-# Simulated database for products and coupons
-inventory = {
-    "product123": {"name": "Product A", "price": 15.0, "stock": 10},
-    "product456": {"name": "Product B", "price": 20.0, "stock": 5},
-    "product789": {"name": "Product C", "price": 25.0, "stock": 8}
-}
-
-coupons = {
-    "Coupon 1": 3,
-    "Coupon 2": 2
-}
-
-# Wallet class for customer wallets
-class Wallet:
-    def __init__(self, initial_balance=100.0):
-        """Initializes the wallet with a starting balance."""
-        self.balance = initial_balance
-
-    def get_balance(self):
-        """Returns the current balance."""
-        return self.balance
-
-    def add_balance(self, amount):
-        """Adds the specified amount to the wallet."""
-        self.balance += amount
+from kivy.uix.relativelayout import RelativeLayout
+from kivy.uix.scrollview import ScrollView
+from kivy.clock import Clock
+from kivy.metrics import dp
+from decimal import Decimal, InvalidOperation
+from checkout import CheckoutError, CheckoutService
+from checkout_client import connect_from_env
+from inventory import LOW_STOCK
+from inventory_list import InventoryListModel
+from journal import new_id
+from promotions import KINDS, SCOPES, Promotion
+
+# Catalog reads for the inventory and analysis pages, made through the checkout server or the local stores
+class CheckoutCatalog:
+    def __init__(self, checkout):
+        """Initializes the view over a CheckoutService or CheckoutClient."""
+        self.checkout = checkout
+
+    def products(self, offset=0, limit=None, search=None, category=None, max_stock=None):
+        """Returns products ordered by name, as Catalog.products() does."""
+        return self.checkout.products(offset, limit, search, category, max_stock)
+
+    def count(self, search=None, category=None, max_stock=None):
+        """Returns the number of products matching the products() filters."""
+        return self.checkout.count_products(search, category, max_stock)
+
+    def categories(self):
+        """Returns the distinct product categories in alphabetical order."""
+        return self.checkout.categories()
+
+    def stock_levels(self, product_ids):
+        """Returns the current stock of each of the given products as a {product_id: stock} dictionary."""
+        return self.checkout.stock(list(product_ids))
 
 # Screen class for managing retailer's inventory, wallets, and coupons
 class RetailerManagementScreen(Screen):
@@ -40,6 +47,10 @@ class RetailerManagementScreen(Screen):
         self.app = app
         layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
 
+        # Low-stock alerts raised by checkouts
+        self.alerts_label = MDLabel(text="", halign="center", theme_text_color="Error", size_hint=(1, 0.1))
+        layout.add_widget(self.alerts_label)
+
         # Wallet Management Button
         self.wallet_button = MDRaisedButton(
             text="Wallet",
@@ -87,6 +98,12 @@ class RetailerManagementScreen(Screen):
 
         self.add_widget(layout)
 
+    def show_low_stock(self, events):
+        """Lists the products that most recently ran low, newest first."""
+        self.alerts_label.text = "Low stock: " + ", ".join(
+            f"{event['name']} ({event['stock']} left)" for event in reversed(events[-3:])
+        )
+
     def create_wallet(self):
         """Creates a wallet for a new customer."""
         dialog = MDDialog(
@@ -103,10 +120,17 @@ class RetailerManagementScreen(Screen):
         dialog.open()
 
     def add_wallet(self, dialog):
-        """Adds a new wallet with the specified balance."""
-        initial_balance = float(dialog.content_cls.text)
-        new_wallet = Wallet(initial_balance)
-        print(f"New wallet created with initial balance: ${new_wallet.get_balance():.2f}")
+        """Adds a new wallet with the specified balance to the wallet store."""
+        if not isinstance(self.app.checkout, CheckoutService):
+            print("Wallets are opened on the checkout server with --wallet when it is set up.")
+            return
+        try:
+            new_wallet = self.app.checkout.open_wallet(new_id(), dialog.content_cls.text)
+        except (CheckoutError, OSError) as e:
+            print(f"Wallet not created: {e}")
+            return
+        print(f"New wallet {new_wallet['customer_id']} created with initial balance: "
+              f"${new_wallet['balance_cents'] / 100:.2f}")
         dialog.dismiss()
 
     def show_suppliers(self):
@@ -129,24 +153,97 @@ class RetailerManagementScreen(Screen):
         )
         dialog.open()
 
+# Scrolling inventory list that reuses a fixed pool of row widgets, like a RecycleView
+class InventoryList(ScrollView):
+    def __init__(self, model, row_height=dp(40), **kwargs):
+        """Initializes the list over an InventoryListModel.
+
+        Only enough row widgets to fill the visible area are created; as the
+        list scrolls they are moved and rebound to the products underneath,
+        so the widget count does not grow with the catalog.
+        """
+        super().__init__(**kwargs)
+        self.model = model
+        self.row_height = row_height
+        self.rows = []
+        self.first = None
+        self.content = RelativeLayout(size_hint_y=None)
+        self.add_widget(self.content)
+        self.bind(height=lambda instance, value: self.reload(), scroll_y=lambda instance, value: self.refresh())
+
+    def reload(self):
+        """Resizes the list for the current number of rows and redraws the visible ones."""
+        self.content.height = max(self.model.count() * self.row_height, self.height)
+        visible = int(self.height // self.row_height) + 2
+        while len(self.rows) < visible:
+            row = BoxLayout(orientation='horizontal', spacing=10, size_hint=(1, None), height=self.row_height)
+            row.name_label = MDLabel(halign="left")
+            row.stock_label = MDLabel(halign="center")
+            row.add_widget(row.name_label)
+            row.add_widget(row.stock_label)
+            self.rows.append(row)
+            self.content.add_widget(row)
+        self.first = None
+        self.refresh()
+
+    def refresh(self):
+        """Binds the pooled rows to the products under the visible part of the list."""
+        hidden = max(self.content.height - self.height, 0)
+        first = int((1 - self.scroll_y) * hidden // self.row_height)
+        if first == self.first:
+            return
+        try:
+            products = self.model.rows(first, len(self.rows))
+        except (CheckoutError, OSError) as e:
+            # The rows stay as they are and are read again on the next scroll or reload
+            print(f"Inventory rows not read: {e}")
+            return
+        self.first = first
+        for offset, row in enumerate(self.rows):
+            product = products[offset] if offset < len(products) else None
+            row.y = self.content.height - (first + offset + 1) * self.row_height
+            row.opacity = 1 if product else 0
+            row.name_label.text = product["name"] if product else ""
+            row.stock_label.text = str(product["stock"]) if product else ""
+
+    def update_rows(self, indexes):
+        """Redraws the stock of whichever of the given rows are on screen."""
+        for index in indexes:
+            offset = index - (self.first or 0)
+            if 0 <= offset < len(self.rows):
+                self.rows[offset].stock_label.text = str(self.model.row(index)["stock"])
+
 # Screen class for displaying the inventory details
 class InventoryPageScreen(Screen):
-    def __init__(self, **kwargs):
+    def __init__(self, catalog, stock_refresh_interval=2, **kwargs):
         super().__init__(**kwargs)
+        self.catalog = catalog
+        self.stock_refresh_interval = stock_refresh_interval
+        self.model = InventoryListModel(catalog)
+        self.categories = [None]
+        self.low_stock = False
         layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
 
-        # Header Label
-        header_label = MDLabel(text="Item", halign="left", font_style="H6")
-        layout.add_widget(header_label)
+        # Search and filter controls
+        filter_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='60dp')
+        self.search_field = MDTextField(hint_text="Search by name, ID or EAN")
+        self.search_field.bind(text=lambda instance, value: self.schedule_filter())
+        filter_layout.add_widget(self.search_field)
+        self.category_button = MDRaisedButton(text="All categories", on_release=lambda x: self.next_category())
+        filter_layout.add_widget(self.category_button)
+        self.low_stock_button = MDRaisedButton(text="Low stock: off", on_release=lambda x: self.toggle_low_stock())
+        filter_layout.add_widget(self.low_stock_button)
+        layout.add_widget(filter_layout)
+
+        # Header Labels
+        header_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='40dp')
+        header_layout.add_widget(MDLabel(text="Item", halign="left", font_style="H6"))
+        header_layout.add_widget(MDLabel(text="Stock", halign="center", font_style="H6"))
+        layout.add_widget(header_layout)
 
         # Display inventory items
-        for product_id, product in inventory.items():
-            item_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='40dp')
-            item_label = MDLabel(text=product['name'], halign="left")
-            stock_label = MDLabel(text=str(product['stock']), halign="center")
-            item_layout.add_widget(item_label)
-            item_layout.add_widget(stock_label)
-            layout.add_widget(item_layout)
+        self.inventory_list = InventoryList(self.model)
+        layout.add_widget(self.inventory_list)
 
         # Analysis button
         analysis_button = MDRaisedButton(
@@ -159,76 +256,244 @@ class InventoryPageScreen(Screen):
 
         self.add_widget(layout)
 
+    def on_enter(self):
+        """Reloads the list and starts polling the visible rows for stock changes."""
+        try:
+            # Keep the selected category first when the list of categories is refreshed
+            categories = [None] + self.catalog.categories()
+            index = categories.index(self.categories[0]) if self.categories[0] in categories else 0
+            self.categories = categories[index:] + categories[:index]
+            self.model.reload()
+            self.inventory_list.reload()
+        except (CheckoutError, OSError) as e:
+            print(f"Inventory not loaded: {e}")
+        Clock.schedule_interval(self.refresh_stock, self.stock_refresh_interval)
+
+    def on_leave(self):
+        """Stops polling for stock changes."""
+        Clock.unschedule(self.refresh_stock)
+
+    def refresh_stock(self, dt):
+        """Re-reads the stock of the visible rows and redraws the ones that changed."""
+        try:
+            changed = self.model.refresh_stock(self.inventory_list.first or 0, len(self.inventory_list.rows))
+        except (CheckoutError, OSError) as e:
+            # Tried again at the next interval
+            print(f"Stock not refreshed: {e}")
+            return
+        self.inventory_list.update_rows(changed)
+
+    def schedule_filter(self):
+        """Applies the search text once typing pauses, rather than on every keystroke."""
+        Clock.unschedule(self.apply_filter)
+        Clock.schedule_once(self.apply_filter, 0.3)
+
+    def apply_filter(self, dt=None):
+        """Applies the search, category and low-stock filters and scrolls back to the top."""
+        self.model.set_filter(self.search_field.text.strip(), self.categories[0],
+                              LOW_STOCK if self.low_stock else None)
+        self.inventory_list.scroll_y = 1
+        try:
+            self.inventory_list.reload()
+        except (CheckoutError, OSError) as e:
+            print(f"Inventory not loaded: {e}")
+
+    def next_category(self):
+        """Cycles the category filter through all categories."""
+        self.categories = self.categories[1:] + self.categories[:1]
+        self.category_button.text = self.categories[0] or "All categories"
+        self.apply_filter()
+
+    def toggle_low_stock(self):
+        """Switches the low-stock filter on or off."""
+        self.low_stock = not self.low_stock
+        self.low_stock_button.text = "Low stock: on" if self.low_stock else "Low stock: off"
+        self.apply_filter()
+
     def open_analysis_page(self, instance):
         """Opens the analysis page."""
         self.manager.current = 'analysis_page'
 
 # Screen class for displaying the coupon details and adding a new coupon
 class CouponsPageScreen(Screen):
-    def __init__(self, **kwargs):
+    def __init__(self, checkout, max_rows=20, **kwargs):
         super().__init__(**kwargs)
+        self.checkout = checkout
+        self.max_rows = max_rows
         layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
 
-        # Display coupon details
-        for coupon_name, coupon_value in coupons.items():
-            coupon_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='40dp')
-            coupon_label = MDLabel(text=coupon_name, halign="left")
-            coupon_value_label = MDLabel(text=str(coupon_value), halign="center")
-            coupon_layout.add_widget(coupon_label)
-            coupon_layout.add_widget(coupon_value_label)
-            layout.add_widget(coupon_layout)
+        # Display coupon details, newest first
+        self.count_label = MDLabel(text="", halign="center", font_style="H6", size_hint_y=None, height='40dp')
+        layout.add_widget(self.count_label)
+        self.coupon_list = BoxLayout(orientation='vertical', spacing=10)
+        layout.add_widget(self.coupon_list)
 
         # Add Coupon button
         add_coupon_button = MDRaisedButton(
             text="Add Coupon",
             size_hint=(1, None),
-            height='50dp'
+            height='50dp',
+            on_release=lambda x: self.create_coupon()
         )
         layout.add_widget(add_coupon_button)
 
         self.add_widget(layout)
 
-# Screen class for displaying the top sold items (Analysis Page)
+    def on_enter(self):
+        """Redraws the list of running promotions."""
+        self.coupon_list.clear_widgets()
+        try:
+            coupons = self.checkout.coupons(limit=self.max_rows)
+        except (CheckoutError, OSError) as e:
+            self.count_label.text = "Promotions unavailable"
+            print(f"Promotions not loaded: {e}")
+            return
+        self.count_label.text = f"{coupons['count']} promotions running"
+        for promotion in (Promotion(**promotion) for promotion in coupons["promotions"]):
+            coupon_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='40dp')
+            coupon_layout.add_widget(MDLabel(text=promotion.name, halign="left"))
+            coupon_layout.add_widget(MDLabel(text=f"{promotion.scope} {promotion.target}", halign="center"))
+            coupon_layout.add_widget(MDLabel(text=describe_promotion(promotion), halign="right"))
+            self.coupon_list.add_widget(coupon_layout)
+
+    def create_coupon(self):
+        """Opens a dialog for adding a promotion."""
+        fields = BoxLayout(orientation='vertical', spacing=10, size_hint_y=None, height='300dp')
+        fields.add_widget(MDTextField(hint_text="Name"))
+        fields.add_widget(MDTextField(hint_text="Kind: " + ", ".join(KINDS)))
+        fields.add_widget(MDTextField(hint_text="Applies to: " + ", ".join(SCOPES)))
+        fields.add_widget(MDTextField(hint_text="Product ID or category"))
+        fields.add_widget(MDTextField(hint_text="% off, $ off each, or units to buy per free unit"))
+        dialog = MDDialog(
+            title="Add Coupon",
+            type="custom",
+            content_cls=fields,
+            buttons=[
+                MDRaisedButton(
+                    text="Create",
+                    on_release=lambda x: self.add_coupon(dialog)
+                )
+            ]
+        )
+        dialog.open()
+
+    def add_coupon(self, dialog):
+        """Adds the promotion entered in the dialog to the shared store."""
+        # Children are listed last-added first
+        name, kind, scope, target, value = [field.text.strip() for field in reversed(dialog.content_cls.children)]
+        kind, scope = kind.lower(), scope.lower()
+        try:
+            # Fixed discounts are entered in dollars and stored in cents
+            value = int(Decimal(value) * 100) if kind == "fixed" else int(value)
+            promotion = Promotion(**self.checkout.add_coupon(name, kind, scope, target, value))
+        except (InvalidOperation, OverflowError, ValueError) as e:
+            print(f"Invalid coupon: {e}")
+            return
+        except (CheckoutError, OSError) as e:
+            print(f"Coupon not added: {e}")
+            return
+        print(f"Coupon {promotion.name} added: {describe_promotion(promotion)}")
+        dialog.dismiss()
+        self.on_enter()
+
+def describe_promotion(promotion):
+    """Returns a short description of what a promotion takes off."""
+    if promotion.kind == "percent":
+        return f"{promotion.value}% off"
+    if promotion.kind == "fixed":
+        return f"${promotion.value / 100:.2f} off each"
+    return f"Buy {promotion.value}, get 1 free"
+
+# Screen class for displaying the top sold items, revenue and sell-through (Analysis Page)
 class AnalysisPageScreen(Screen):
-    def __init__(self, **kwargs):
+    def __init__(self, checkout, **kwargs):
         super().__init__(**kwargs)
-        layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        self.checkout = checkout
+        self.layout = BoxLayout(orientation='vertical', spacing=10, padding=10)
+        self.add_widget(self.layout)
+
+    def on_enter(self):
+        """Reads the sales aggregates from checkout, which catches them up with new sales, and redraws the page."""
+        try:
+            report = self.checkout.sales_report()
+        except (CheckoutError, OSError) as e:
+            print(f"Sales report not read: {e}")
+            return
+        self.layout.clear_widgets()
 
         # Header Label
         header_label = MDLabel(text="Top Items Sold", halign="center", font_style="H5")
-        layout.add_widget(header_label)
-
-        # Item details
-        items_sold = {
-            "Apple": 100,
-            "Banana": 50,
-            "Chips": 30
-        }
-
-        for item_name, sold_count in items_sold.items():
-            item_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='40dp')
-            item_label = MDLabel(text=item_name, halign="left")
-            sold_label = MDLabel(text=f"Sold: {sold_count}", halign="right")
-            item_layout.add_widget(item_label)
-            item_layout.add_widget(sold_label)
-            layout.add_widget(item_layout)
-
-        self.add_widget(layout)
+        self.layout.add_widget(header_label)
+
+        # Best sellers from the running aggregates, with the share of their stock that has sold
+        for item in report["top_items"]:
+            self.add_row(item["name"], f"Sold: {item['units']}  ${item['revenue_cents'] / 100:.2f}  "
+                                       f"Sell-through: {item['sell_through']:.0%}")
+
+        self.layout.add_widget(MDLabel(text="Revenue by Day", halign="center", font_style="H6"))
+        for day, revenue_cents in report["daily_revenue"]:
+            self.add_row(day, f"${revenue_cents / 100:.2f}")
+
+        today = report["hourly_revenue"]
+        busiest_hour, busiest_cents = max(today, key=lambda entry: entry[1])
+        self.layout.add_widget(MDLabel(
+            text=f"Busiest hour in the last 24: {busiest_hour} (${busiest_cents / 100:.2f})" if busiest_cents
+            else "No sales in the last 24 hours",
+            halign="center"
+        ))
+
+    def add_row(self, label, value):
+        """Adds one label and value row to the page."""
+        item_layout = BoxLayout(orientation='horizontal', spacing=10, size_hint_y=None, height='40dp')
+        item_layout.add_widget(MDLabel(text=label, halign="left"))
+        item_layout.add_widget(MDLabel(text=value, halign="right"))
+        self.layout.add_widget(item_layout)
 
 # Main app class for managing the retailer's app
 class RetailerApp(MDApp):
     def build(self):
+        # The shared checkout server if GOBUY_SERVER names one, otherwise the stores on this machine
+        self.checkout = connect_from_env() or CheckoutService()
+        self.catalog = CheckoutCatalog(self.checkout)
         self.sm = ScreenManager()
-        retailer_screen = RetailerManagementScreen(app=self, name='retailer')
-        self.sm.add_widget(retailer_screen)
+        self.retailer_screen = RetailerManagementScreen(app=self, name='retailer')
+        self.sm.add_widget(self.retailer_screen)
+        # Checkouts in the customer apps record low-stock events through the checkout service
+        self.low_stock_events = []
+        try:
+            self.low_stock_events = self.checkout.low_stock_events(limit=3)
+        except (CheckoutError, OSError) as e:
+            print(f"Low-stock events not read: {e}")
+        if self.low_stock_events:
+            self.retailer_screen.show_low_stock(self.low_stock_events)
+        Clock.schedule_interval(self.check_low_stock, 5)
 
         # Add screens for inventory, coupons, and analysis
-        self.sm.add_widget(InventoryPageScreen(name='inventory_page'))
-        self.sm.add_widget(CouponsPageScreen(name='coupons_page'))
-        self.sm.add_widget(AnalysisPageScreen(name='analysis_page'))
+        self.sm.add_widget(InventoryPageScreen(catalog=self.catalog, name='inventory_page'))
+        self.sm.add_widget(CouponsPageScreen(checkout=self.checkout, name='coupons_page'))
+        self.sm.add_widget(AnalysisPageScreen(checkout=self.checkout, name='analysis_page'))
 
         return self.sm
 
+    def check_low_stock(self, dt):
+        """Shows low-stock events recorded since the last check on the dashboard."""
+        after_id = self.low_stock_events[-1]["event_id"] if self.low_stock_events else 0
+        try:
+            events = self.checkout.low_stock_events(after_id)
+        except (CheckoutError, OSError) as e:
+            # Checked again at the next interval
+            print(f"Low-stock events not read: {e}")
+            return
+        if events:
+            for event in events:
+                print(f"Low stock: {event['name']} has {event['stock']} left")
+            self.low_stock_events = (self.low_stock_events + events)[-3:]
+            self.retailer_screen.show_low_stock(self.low_stock_events)
+
+    def on_stop(self):
+        """Closes checkout, which saves the sales aggregates so the next start only reads new transactions."""
+        self.checkout.close()
+
     def show_inventory_page(self):
         """Opens the inventory page screen."""
         self.sm.current = 'inventory_page'
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Time-windowed LRU cache that drops repeat scans of a code that is still in view
+class ScanDebouncer:
+    def __init__(self, window=2.0, max_entries=128, cell_size=80, clock=time.monotonic):
+        """Initializes the debouncer.
+
+        A scan is a repeat when the same payload was accepted or suppressed
+        within the last window seconds in the same or a neighbouring
+        cell_size-pixel grid cell. At most max_entries codes are remembered;
+        the least recently seen one is evicted first.
+        """
+        self.window = window
+        self.max_entries = max_entries
+        self.cell_size = cell_size
+        self.clock = clock
+        self.accepted = 0
+        self.suppressed = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def accept(self, data, rect=None):
+        """Returns True for a new scan and False for a repeat inside the window."""
+        now = self.clock()
+        cell = self._cell(rect)
+        with self._lock:
+            self._expire(now)
+            for key in self._neighbours(data, cell):
+                if key in self._seen:
+                    # Keep suppressing while the code stays in view, following it into the cell it moved to
+                    del self._seen[key]
+                    self._seen[(data, cell)] = now
+                    self._seen.move_to_end((data, cell))
+                    self.suppressed += 1
+                    return False
+            self._seen[(data, cell)] = now
+            if len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+            self.accepted += 1
+            return True
+
+    def clear(self):
+        """Forgets all remembered codes."""
+        with self._lock:
+            self._seen.clear()
+
+    def stats(self):
+        """Returns the accepted and suppressed scan counts."""
+        with self._lock:
+            return {"accepted": self.accepted, "suppressed": self.suppressed}
+
+    def _expire(self, now):
+        """Drops entries whose window has passed, oldest first."""
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self.window:
+                break
+            self._seen.popitem(last=False)
+
+    def _cell(self, rect):
+        """Returns the grid cell containing the centre of a bounding box."""
+        if rect is None:
+            return (0, 0)
+        left, top, width, height = rect
+        return ((left + width // 2) // self.cell_size, (top + height // 2) // self.cell_size)
+
+    def _neighbours(self, data, cell):
+        """Yields the cache keys for a payload in a cell and the eight cells around it."""
+        col, row = cell
+        for d_col in (-1, 0, 1):
+            for d_row in (-1, 0, 1):
+                yield (data, (col + d_col, row + d_row))
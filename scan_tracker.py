@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+# Seconds a code may go unseen, such as behind a hand or in frames the gate skipped, before its track ends
+MAX_AGE = 2.0
+
+# How far a code's centre may move between sightings, as a multiple of the code's own size
+MAX_DISTANCE = 1.5
+
+
+def _centre(rect):
+    """Returns the centre and size of a bounding box."""
+    left, top, width, height = rect
+    return (left + width / 2, top + height / 2), max(width, height, 1)
+
+
+# One physical code followed across frames
+class _Track:
+    def __init__(self, track_id, data, rect, now):
+        """Initializes the track at the code's first sighting."""
+        self.track_id = track_id
+        self.data = data
+        self.sightings = 0
+        self.see(rect, now)
+
+    def see(self, rect, now):
+        """Moves the track to where the code was seen now."""
+        self.centre, self.size = _centre(rect)
+        self.last_seen = now
+        self.sightings += 1
+
+
+# Follows every code in view across frames by bounding box, so each physical item is counted once
+class ScanTracker:
+    def __init__(self, max_age=MAX_AGE, max_distance=MAX_DISTANCE, clock=time.monotonic):
+        """Initializes the tracker.
+
+        A code found in a frame continues the nearest track with the same
+        payload whose last centre is within max_distance times the code's
+        size; each track takes at most one code per frame, so two items with
+        the same code side by side are two tracks. A code that continues no
+        track starts a new one and is reported as a new item. A track ends
+        once it has gone max_age seconds without being seen, after which the
+        code counts again; frames without any code end nothing by
+        themselves, as a decoder can miss every code in a frame.
+        """
+        self.max_age = max_age
+        self.max_distance = max_distance
+        self.clock = clock
+        self.frames = 0
+        self.items = 0
+        self._tracks = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def update(self, symbols):
+        """Matches one frame's decoded symbols to the tracks and returns the symbols of items not seen before."""
+        now = self.clock()
+        with self._lock:
+            self.frames += 1
+            self._tracks = [track for track in self._tracks if now - track.last_seen < self.max_age]
+            # Closest pairs first, so a code next to its own track is never taken by one further away
+            pairs = []
+            for index, symbol in enumerate(symbols):
+                centre, size = _centre(symbol.rect)
+                for track in self._tracks:
+                    if track.data != symbol.data:
+                        continue
+                    distance = ((centre[0] - track.centre[0]) ** 2 + (centre[1] - track.centre[1]) ** 2) ** 0.5
+                    if distance <= self.max_distance * max(size, track.size):
+                        pairs.append((distance, index, track))
+            pairs.sort(key=lambda pair: pair[0])
+            matched, continued = set(), set()
+            for _, index, track in pairs:
+                if index in matched or track.track_id in continued:
+                    continue
+                track.see(symbols[index].rect, now)
+                matched.add(index)
+                continued.add(track.track_id)
+            new = []
+            for index, symbol in enumerate(symbols):
+                if index in matched:
+                    continue
+                self._tracks.append(_Track(self._next_id, symbol.data, symbol.rect, now))
+                self._next_id += 1
+                new.append(symbol)
+            self.items += len(new)
+            return new
+
+    def clear(self):
+        """Ends every track, so the codes in view count again."""
+        with self._lock:
+            self._tracks = []
+
+    def stats(self):
+        """Returns how many frames were tracked, how many items were counted and how many codes are tracked."""
+        with self._lock:
+            return {"frames": self.frames, "items": self.items, "tracked": len(self._tracks)}
+
+
+def batch_scan_from_env(environ=os.environ):
+    """Returns True if GOBUY_BATCH_SCAN turns on batch scanning of every code in view."""
+    return environ.get("GOBUY_BATCH_SCAN", "") in ("1", "true", "yes")
+
+
+def basket_items(codes, scan_id):
+    """Returns add_items entries for the codes newly seen in one frame, one line per product.
+
+    Copies of a product become one line of that many units. Line IDs are
+    derived from scan_id, so resending the same scan sets the same lines.
+    """
+    counts = {}
+    for code in codes:
+        counts[code] = counts.get(code, 0) + 1
+    return [{"code": code, "quantity": quantity, "line_id": f"{scan_id}-{index}"}
+            for index, (code, quantity) in enumerate(counts.items())]
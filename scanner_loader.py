@@ -0,0 +1,40 @@
+import threading
+
+import metrics
+from ui_thread import schedule_on_ui_thread
+
+
+def load_scanner_async(on_ready, capture_settings=None, decoder_settings=None, dispatch=None):
+    """Opens the camera and builds the decode function on a worker thread.
+
+    cv2, numpy and the decoder libraries are first imported on that thread,
+    so the app's first screen is drawn before they have loaded.
+    capture_settings are CaptureThread options and decoder_settings are
+    make_scan_decoder options. on_ready(capture, decode_fn) is called through
+    dispatch, which defaults to Kivy's Clock.schedule_once; both arguments
+    are None if the camera could not be opened.
+    """
+    dispatch = dispatch or schedule_on_ui_thread
+
+    def run():
+        capture = None
+        try:
+            with metrics.span("startup.scanner_load"):
+                from capture import CaptureThread
+                from decode_region import make_scan_decoder
+                capture = CaptureThread(**(capture_settings or {}))
+                if not capture.start():
+                    dispatch(on_ready, None, None)
+                    return
+                decode_fn = make_scan_decoder(**(decoder_settings or {}))
+        except Exception as e:
+            print(f"An error occurred while starting the scanner: {e}")
+            if capture is not None:
+                capture.release()
+            dispatch(on_ready, None, None)
+            return
+        dispatch(on_ready, capture, decode_fn)
+
+    thread = threading.Thread(target=run, name="scanner-loader", daemon=True)
+    thread.start()
+    return thread
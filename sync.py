@@ -0,0 +1,257 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+from itertools import islice
+
+import metrics
+from checkout import CheckoutError
+from checkout_client import CheckoutClient
+from journal import DEFAULT_PATH as JOURNAL_PATH, INDEX_SCHEMA, index_path, new_id, scan
+
+# Seconds between sync attempts while there is nothing new to send
+SYNC_INTERVAL = 5.0
+
+# Longest wait between retries while the server cannot be reached
+MAX_BACKOFF = 60.0
+
+# Statuses the server refuses a batch with when a record in it can never be applied, however often it is sent
+REJECTED = (400, 409, 413, 422)
+
+# The device's ID and how far its journal has been applied by the server, kept next to the journal index,
+# and the records the server refused, which are sent as "parked" stand-ins instead
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    device_id TEXT PRIMARY KEY,
+    acked_seq INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_parked (
+    seq INTEGER PRIMARY KEY,
+    status INTEGER NOT NULL,
+    error TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+"""
+
+
+# Sends a device's journal to the checkout server in the background, resuming where the server left off
+class SyncEngine:
+    def __init__(self, server, journal_path=JOURNAL_PATH, batch_size=500, interval=SYNC_INTERVAL,
+                 max_backoff=MAX_BACKOFF):
+        """Opens the sync state for a journal; call start() to sync in the background.
+
+        server is anything with receive_sync(device_id, records), normally a
+        CheckoutClient. Checkout keeps committing to the local journal at
+        full speed whether or not the server can be reached; the journal is
+        the queue of records still to send. Records go in batches of up to
+        batch_size in sequence order, deflated by the client, and the server
+        answers with the last sequence number it has applied, which is where
+        the next batch starts. A batch that fails is retried with
+        exponential backoff up to max_backoff seconds.
+
+        A batch the server refuses with a REJECTED status is halved until
+        the record it refuses is found. That record is parked: it is kept in
+        the sync state, and the server is sent a "parked" stand-in in its
+        place. The server records the stand-in as a conflict and moves past
+        it, so one bad record does not hold back every record after it. A
+        sequence number missing from the journal, from a batch the writer
+        lost or a corrupt line, is sent as a "gap" stand-in the same way.
+        """
+        self.server = server
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.conflicts = 0
+        self.last_error = None
+        # Whether the last batch sent was not applied at all, so sync is stuck until something changes
+        self.stalled = False
+        self._failures = 0
+        self._limit = batch_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._state = sqlite3.connect(index_path(journal_path), check_same_thread=False, isolation_level=None)
+        self._state.execute("PRAGMA journal_mode=WAL")
+        self._state.executescript(INDEX_SCHEMA + SCHEMA)
+        row = self._state.execute("SELECT device_id, acked_seq, offset FROM sync_state").fetchone()
+        if row is None:
+            row = (new_id(), 0, 0)
+            self._state.execute("INSERT INTO sync_state VALUES (?, ?, ?)", row)
+        self.device_id, self.acked_seq, self._offset = row
+        self._parked = dict(self._state.execute("SELECT seq, status FROM sync_parked"))
+        if not os.path.exists(journal_path) or os.path.getsize(journal_path) < self._offset:
+            # The journal was replaced or cut short, so find the acked record again
+            self._offset = self._offset_after(self.acked_seq)
+
+    def _offset_after(self, seq):
+        """Returns the journal offset just past the record with sequence number seq, or of the last record before it."""
+        if seq <= 0:
+            return 0
+        row = self._state.execute(
+            "SELECT offset + length FROM entries WHERE seq <= ? ORDER BY seq DESC LIMIT 1", (seq,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _save(self, acked_seq, offset):
+        """Records how far the server has applied the journal."""
+        self.acked_seq, self._offset = acked_seq, offset
+        self._state.execute("UPDATE sync_state SET acked_seq = ?, offset = ? WHERE device_id = ?",
+                            (acked_seq, offset, self.device_id))
+
+    def _park(self, record, error):
+        """Keeps a record the server refused and sends a stand-in for it from now on."""
+        with self._state:
+            self._state.execute("INSERT OR REPLACE INTO sync_parked VALUES (?, ?, ?, ?)",
+                                (record["seq"], error.status, error.message, json.dumps(record)))
+        self._parked[record["seq"]] = error.status
+        metrics.inc("sync.parked")
+        print(f"Sync record {record['seq']} refused by the server and parked: {error.message}")
+
+    def _outgoing(self, record):
+        """Returns what to send for a journal record: the record, or the stand-in for a parked one."""
+        if record["seq"] not in self._parked:
+            return record
+        stand_in = {"v": record.get("v"), "seq": record["seq"], "type": "parked",
+                    "status": self._parked[record["seq"]]}
+        if isinstance(record.get("product_id"), str):
+            stand_in["product_id"] = record["product_id"]
+        return stand_in
+
+    def _outgoing_batch(self, batch):
+        """Returns what to send for a batch, with a "gap" stand-in for each sequence number missing before a record."""
+        outgoing = []
+        expected = self.acked_seq + 1
+        for _, _, record in batch:
+            outgoing += [{"v": record.get("v"), "seq": seq, "type": "gap"} for seq in range(expected, record["seq"])]
+            outgoing.append(self._outgoing(record))
+            expected = record["seq"] + 1
+        return outgoing
+
+    def parked(self):
+        """Returns the records the server refused, with the status and error it refused them with, oldest first."""
+        with self._lock:
+            rows = self._state.execute("SELECT seq, status, error, record FROM sync_parked ORDER BY seq").fetchall()
+        return [{"seq": seq, "status": status, "error": error, "record": json.loads(record)}
+                for seq, status, error, record in rows]
+
+    def sync_batch(self):
+        """Sends the next batch of records and returns how many the server newly applied.
+
+        Raises OSError or CheckoutError if the server cannot take the batch.
+        """
+        with self._lock:
+            while True:
+                batch = [(offset, length, record) for offset, length, record
+                         in islice(scan(self.journal_path, self._offset), self._limit)
+                         if record["seq"] > self.acked_seq]
+                if not batch:
+                    return 0
+                try:
+                    with metrics.span("sync.batch"):
+                        reply = self.server.receive_sync(self.device_id, self._outgoing_batch(batch))
+                    break
+                except CheckoutError as e:
+                    if e.status not in REJECTED:
+                        raise
+                    if len(batch) > 1:
+                        # Smaller batches until the refused record is the only one sent
+                        self._limit = len(batch) // 2
+                    else:
+                        self._park(batch[0][2], e)
+                        self._limit = self.batch_size
+            acked_seq = reply["acked_seq"]
+            ends = {record["seq"]: offset + length for offset, length, record in batch}
+            applied = max(0, min(acked_seq, batch[-1][2]["seq"]) - self.acked_seq)
+            if not applied and not self.stalled:
+                metrics.inc("sync.stalled")
+                print(f"Sync stalled: the server stays at sequence number {acked_seq} with records still to send")
+            self.stalled = not applied
+            # Normally the server acks the whole batch; otherwise resume from the record it expects next
+            self._save(acked_seq, ends[acked_seq] if acked_seq in ends else self._offset_after(acked_seq))
+            self.conflicts += len(reply["conflicts"])
+            metrics.inc("sync.batches")
+            metrics.inc("sync.records", applied)
+            if reply["conflicts"]:
+                metrics.inc("sync.conflicts", len(reply["conflicts"]))
+            return applied
+
+    def sync(self):
+        """Sends batches until the server has everything committed so far and returns how many records it applied."""
+        total = 0
+        while True:
+            acked_seq = self.acked_seq
+            total += self.sync_batch()
+            if self.acked_seq == acked_seq:
+                return total
+
+    def pending(self):
+        """Returns how many committed records the server has not applied yet."""
+        with self._lock:
+            return self._state.execute("SELECT COUNT(*) FROM entries WHERE seq > ?", (self.acked_seq,)).fetchone()[0]
+
+    def status(self):
+        """Returns the device ID, sync position, records still to send, conflicts reported back and the last error.
+
+        stalled is True while records are pending but the server did not
+        move acked_seq past any of the last batch. A reply lost on the way
+        is not sent again, so the server's sync_status() is the full list
+        of conflicts.
+        """
+        pending = self.pending()
+        return {"device_id": self.device_id, "acked_seq": self.acked_seq, "pending": pending,
+                "stalled": self.stalled and pending > 0, "conflicts": self.conflicts, "last_error": self.last_error}
+
+    def start(self):
+        """Starts syncing in the background and returns the engine."""
+        self._thread = threading.Thread(target=self._run, name="journal-sync", daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """Asks the background thread to sync now, after a sale was committed; ignored while backing off."""
+        if not self._failures:
+            self._wake.set()
+
+    def close(self):
+        """Stops the background thread; unsent records stay in the journal for the next start."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._state.close()
+
+    def _run(self):
+        """Syncs whenever woken or every interval, backing off while the server cannot be reached."""
+        delay = 0
+        while True:
+            self._wake.wait(delay)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.sync()
+                self._failures = 0
+                self.last_error = None
+                delay = self.interval
+            except Exception as e:
+                if not isinstance(e, (OSError, CheckoutError)):
+                    # Such as a garbled reply or an unreadable journal index; the thread carries on regardless
+                    print(f"Sync failed: {e!r}")
+                self._failures += 1
+                self.last_error = str(e)
+                metrics.inc("sync.failures")
+                # Full jitter, so devices that lost the same Wi-Fi do not all come back at once
+                delay = random.uniform(0, min(self.max_backoff, 2 ** self._failures))
+
+
+def start_from_env(journal_path=JOURNAL_PATH, environ=os.environ):
+    """Starts a SyncEngine for the server named by GOBUY_SYNC ("host:port"), or returns None if it is not set."""
+    address = environ.get("GOBUY_SYNC")
+    if not address:
+        return None
+    return SyncEngine(CheckoutClient(address, timeout=30.0), journal_path).start()
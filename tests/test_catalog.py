@@ -0,0 +1,33 @@
+import sqlite3
+
+import pytest
+
+from catalog import Catalog
+
+
+def write_csv(path, header, rows):
+    path.write_text("\n".join([header] + rows) + "\n")
+
+
+def test_reloading_a_price_file_keeps_stock(tmp_path):
+    catalog = Catalog(str(tmp_path / "catalog.db"), seed_defaults=False)
+    csv_path = tmp_path / "prices.csv"
+    write_csv(csv_path, "product_id,ean,name,price,category,stock", ["sku1,,Tea,1.50,drinks,7"])
+    catalog.load_csv(str(csv_path))
+    write_csv(csv_path, "product_id,ean,name,price,category", ["sku1,,Tea,1.75,drinks"])
+    catalog.load_csv(str(csv_path))
+    catalog.load_csv(str(csv_path))
+
+    assert catalog.lookup("sku1")["price_cents"] == 175
+    assert catalog.stock_levels(["sku1"]) == {"sku1": 7}
+    catalog.close()
+
+
+def test_an_ean_taken_by_another_product_is_refused(tmp_path):
+    catalog = Catalog(str(tmp_path / "catalog.db"), seed_defaults=False)
+    catalog.upsert_many([{"product_id": "sku1", "ean": "4000000000001", "name": "Tea", "price": "1.50", "stock": 3}])
+
+    with pytest.raises(sqlite3.IntegrityError):
+        catalog.upsert_many([{"product_id": "sku2", "ean": "4000000000001", "name": "Coffee", "price": "2.50"}])
+    assert catalog.lookup("sku1")["ean"] == "4000000000001"
+    catalog.close()
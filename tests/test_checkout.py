@@ -0,0 +1,60 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+from checkout import CheckoutError, CheckoutService
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = CheckoutService(str(tmp_path / "catalog.db"), str(tmp_path / "wallets.db"),
+                              str(tmp_path / "transactions.jsonl"), pool_size=1)
+    yield service
+    service.close()
+
+
+def basket_with_points(service, points):
+    service.open_wallet("customer", 100)
+    service.loyalty.accrue("customer", "earned", points * 100)
+    basket = service.open_basket("customer")
+    service.add_item(basket["basket_id"], "product123")
+    return basket["basket_id"]
+
+
+def test_points_come_back_when_the_wallet_cannot_be_charged(service, monkeypatch):
+    basket_id = basket_with_points(service, 5)
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(service.wallets, "transfer", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        service.pay(basket_id, "payment", use_points=True)
+
+    assert service.loyalty.balance("customer") == 5
+
+
+def test_points_come_back_when_the_payment_id_was_used_for_another_charge(service):
+    service.open_wallet("other", 100)
+    service.wallets.transfer("other", "retailer", 1, "pay:payment")
+    basket_id = basket_with_points(service, 5)
+
+    with pytest.raises(CheckoutError) as raised:
+        service.pay(basket_id, "payment", use_points=True)
+
+    assert raised.value.status == 409
+    assert service.loyalty.balance("customer") == 5
+
+
+def test_paying_from_a_wallet_that_no_longer_exists_is_not_found(service, tmp_path):
+    basket_id = basket_with_points(service, 5)
+    with closing(sqlite3.connect(str(tmp_path / "wallets.db"))) as conn:
+        conn.execute("DELETE FROM wallets WHERE wallet_id = 'customer'")
+        conn.commit()
+
+    with pytest.raises(CheckoutError) as raised:
+        service.pay(basket_id, "payment", use_points=True)
+
+    assert raised.value.status == 404
+    assert service.loyalty.balance("customer") == 5
@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+import pytest
+
+from catalog import Catalog
+from checkout import CheckoutError, CheckoutService
+from checkout_client import CheckoutClient
+from checkout_server import CheckoutServer
+
+
+@pytest.fixture
+def client(tmp_path):
+    catalog_path = str(tmp_path / "catalog.db")
+    catalog = Catalog(catalog_path)
+    catalog.upsert_many([{"product_id": "https://shop.example/p?id=1 a", "name": "Linked", "price": "2.00",
+                          "stock": 5}])
+    catalog.close()
+    service = CheckoutService(catalog_path, str(tmp_path / "wallets.db"), str(tmp_path / "transactions.jsonl"),
+                              pool_size=1)
+    server = CheckoutServer(service, port=0, workers=2)
+    loop = asyncio.new_event_loop()
+    port = loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    client = CheckoutClient(f"127.0.0.1:{port}")
+    yield service, client
+    client.close()
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    service.close()
+
+
+def test_codes_and_ids_with_reserved_characters_round_trip(client):
+    service, client = client
+    code = "https://shop.example/p?id=1 a"
+    service.open_wallet("shopper one", 10)
+
+    assert client.lookup(code)["name"] == "Linked"
+    assert client.wallet("shopper one")["balance_cents"] == 1000
+    basket = client.open_basket("shopper one", session_id="till 1/a", basket_id="basket #1")
+    client.add_item(basket["basket_id"], code, line_id="line 1/a")
+    client.remove_item(basket["basket_id"], "line 1/a")
+    client.add_item(basket["basket_id"], code, line_id="line 2?b")
+    client.pay(basket["basket_id"], "payment 1")
+
+    assert [sale["product_id"] for sale in client.sales("till 1/a")] == [code]
+
+
+def test_wallets_cannot_be_opened_over_http(client):
+    service, client = client
+
+    with pytest.raises(CheckoutError) as raised:
+        client._call("POST", "/wallets", {"customer_id": "intruder", "initial_balance": "1000000"})
+
+    assert raised.value.status == 404
+    with pytest.raises(KeyError):
+        service.wallets.balance_cents("intruder")
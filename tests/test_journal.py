@@ -0,0 +1,24 @@
+import time
+
+import journal
+from journal import Journal
+
+
+def test_interval_policy_syncs_the_last_batch_without_another_write(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = journal.os.fsync
+    monkeypatch.setattr(journal.os, "fsync", lambda fd: synced.append(time.monotonic()) or real_fsync(fd))
+    log = Journal(str(tmp_path / "transactions.jsonl"), fsync="interval", fsync_interval=0.2)
+    # The first batch is synced on write, as the interval has passed since the journal opened
+    time.sleep(0.3)
+    log.append("sale", product_id="sku1", name="Tea", quantity=1, unit_price_cents=150, amount_cents=150)
+    log.flush()
+    log.append("sale", product_id="sku1", name="Tea", quantity=1, unit_price_cents=150, amount_cents=150)
+    log.flush()
+    written = time.monotonic()
+    synced_before = len(synced)
+
+    time.sleep(0.5)
+    assert len(synced) == synced_before + 1
+    assert synced[-1] - written < 0.45
+    log.close()
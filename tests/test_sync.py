@@ -0,0 +1,22 @@
+import time
+
+from checkout import CheckoutService
+
+
+def open_service(tmp_path, name):
+    return CheckoutService(str(tmp_path / f"{name}-catalog.db"), str(tmp_path / f"{name}-wallets.db"),
+                           str(tmp_path / f"{name}.jsonl"), pool_size=1)
+
+
+def test_a_sale_synced_late_counts_when_it_was_made(tmp_path):
+    server = open_service(tmp_path, "server")
+    sold_at = time.time() - 3 * 86400
+    sale = {"v": 1, "seq": 1, "ts": sold_at, "type": "sale", "product_id": "product123", "name": "Product A",
+            "quantity": 1, "unit_price_cents": 1500, "amount_cents": 1500}
+
+    assert server.receive_sync("device", [sale])["acked_seq"] == 1
+    report = server.sales_report(days=7, hours=24, utc_offset=0)
+    server.close()
+
+    assert dict(report["daily_revenue"])[time.strftime("%Y-%m-%d", time.gmtime(sold_at))] == 1500
+    assert sum(cents for _, cents in report["hourly_revenue"]) == 0
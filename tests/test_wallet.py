@@ -0,0 +1,28 @@
+import pytest
+
+from wallet import WalletStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = WalletStore(str(tmp_path / "wallets.db"))
+    yield store
+    store.close()
+
+
+def test_an_unknown_wallet_is_not_mistaken_for_a_declined_one(store):
+    store.open_wallet("known", 1)
+
+    assert store.apply("known", -500) is False
+    with pytest.raises(KeyError):
+        store.apply("missing", -500)
+    with pytest.raises(KeyError):
+        store.transfer("missing", "known", 500)
+
+
+def test_a_negative_deduction_is_refused(store):
+    wallet = store.open_wallet("known", 1)
+
+    with pytest.raises(ValueError):
+        wallet.deduct_amount(-5)
+    assert store.balance_cents("known") == 100
@@ -0,0 +1,4 @@
+def schedule_on_ui_thread(callback, *args):
+    """Calls callback(*args) on the Kivy main thread; the default dispatch of the background workers."""
+    from kivy.clock import Clock
+    Clock.schedule_once(lambda dt: callback(*args))
@@ -0,0 +1,232 @@
+import sqlite3
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+import metrics
+from catalog import to_cents
+
+DEFAULT_PATH = "wallets.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wallets (
+    wallet_id TEXT PRIMARY KEY,
+    balance_cents INTEGER NOT NULL CHECK (balance_cents >= 0)
+);
+CREATE TABLE IF NOT EXISTS operations (
+    idempotency_key TEXT PRIMARY KEY,
+    wallet_id TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    balance_cents INTEGER NOT NULL,
+    ts REAL NOT NULL
+);
+"""
+
+
+# Durable store of wallet balances in integer cents
+class WalletStore:
+    def __init__(self, path=DEFAULT_PATH):
+        """Opens (or creates) the wallet database."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def open_wallet(self, wallet_id, initial_balance=0):
+        """Returns the wallet with the given ID, creating it with initial_balance if it does not exist."""
+        initial_cents = to_cents(initial_balance)
+        if initial_cents < 0:
+            raise ValueError("Initial balance cannot be negative")
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO wallets (wallet_id, balance_cents) VALUES (?, ?)",
+                (wallet_id, initial_cents),
+            )
+        return Wallet(self, wallet_id)
+
+    def create_wallet(self, initial_balance=0):
+        """Creates a wallet with a new random ID and returns it."""
+        return self.open_wallet(uuid.uuid4().hex, initial_balance)
+
+    def balance_cents(self, wallet_id):
+        """Returns a wallet's balance in cents."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT balance_cents FROM wallets WHERE wallet_id = ?", (wallet_id,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown wallet: {wallet_id}")
+        return row[0]
+
+    def _applied(self, idempotency_key, wallet_id, amount_cents):
+        """Returns True if the operation with idempotency_key was applied, raising ValueError if it was a different one."""
+        if idempotency_key is None:
+            return False
+        row = self._conn.execute(
+            "SELECT wallet_id, amount_cents FROM operations WHERE idempotency_key = ?", (idempotency_key,)
+        ).fetchone()
+        if row is None:
+            return False
+        if row != (wallet_id, amount_cents):
+            raise ValueError(f"Idempotency key {idempotency_key} was used for {row[1]} cents on wallet {row[0]}")
+        return True
+
+    def _require(self, wallet_id):
+        """Raises KeyError if there is no wallet with wallet_id."""
+        if self._conn.execute("SELECT 1 FROM wallets WHERE wallet_id = ?", (wallet_id,)).fetchone() is None:
+            raise KeyError(f"Unknown wallet: {wallet_id}")
+
+    def apply(self, wallet_id, amount_cents, idempotency_key=None):
+        """Atomically adds amount_cents (negative to deduct) to a wallet.
+
+        Deductions only succeed if the balance covers them. Only operations
+        that succeed are remembered under their idempotency_key: one already
+        applied is not applied again and returns True, and one reused for a
+        different wallet or amount raises ValueError. A declined deduction is
+        not remembered, so retrying it with the same key tries it afresh.
+        Returns True on success and raises KeyError for an unknown wallet.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._applied(idempotency_key, wallet_id, amount_cents):
+                    self._conn.execute("COMMIT")
+                    return True
+                # The balance check and update are one statement, so no reader can see a half-applied change
+                updated = self._conn.execute(
+                    "UPDATE wallets SET balance_cents = balance_cents + ? "
+                    "WHERE wallet_id = ? AND balance_cents + ? >= 0",
+                    (amount_cents, wallet_id, amount_cents),
+                ).rowcount
+                if not updated:
+                    self._require(wallet_id)
+                if updated and idempotency_key is not None:
+                    balance = self._conn.execute(
+                        "SELECT balance_cents FROM wallets WHERE wallet_id = ?", (wallet_id,)
+                    ).fetchone()[0]
+                    self._conn.execute(
+                        "INSERT INTO operations VALUES (?, ?, ?, ?, ?)",
+                        (idempotency_key, wallet_id, amount_cents, balance, time.time()),
+                    )
+                self._conn.execute("COMMIT")
+                return bool(updated)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def credit_many(self, wallet_id, credits):
+        """Adds (idempotency_key, amount_cents) credits to one wallet in a single transaction.
+
+        Credits whose key was already applied are skipped; a key reused for
+        a different wallet or amount raises ValueError. Returns the total
+        added.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT balance_cents FROM wallets WHERE wallet_id = ?", (wallet_id,)
+                ).fetchone()
+                if row is None:
+                    raise KeyError(f"Unknown wallet: {wallet_id}")
+                balance = row[0]
+                added = 0
+                now = time.time()
+                for idempotency_key, amount_cents in credits:
+                    if amount_cents < 0:
+                        raise ValueError("Credits cannot be negative")
+                    if self._applied(idempotency_key, wallet_id, amount_cents):
+                        continue
+                    self._conn.execute(
+                        "INSERT INTO operations VALUES (?, ?, ?, ?, ?)",
+                        (idempotency_key, wallet_id, amount_cents, balance + amount_cents, now),
+                    )
+                    balance += amount_cents
+                    added += amount_cents
+                if added:
+                    self._conn.execute("UPDATE wallets SET balance_cents = ? WHERE wallet_id = ?", (balance, wallet_id))
+                self._conn.execute("COMMIT")
+                return added
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def transfer(self, from_wallet_id, to_wallet_id, amount_cents, idempotency_key=None):
+        """Atomically moves amount_cents from one wallet to another if the first can cover it.
+
+        Either both balances change or neither does. Returns True on
+        success; a transfer whose idempotency_key was already applied is
+        not applied again, and one reused for a different wallet or amount
+        raises ValueError. Either wallet being unknown raises KeyError.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._applied(idempotency_key, from_wallet_id, -amount_cents):
+                    self._conn.execute("COMMIT")
+                    return True
+                updated = self._conn.execute(
+                    "UPDATE wallets SET balance_cents = balance_cents - ? "
+                    "WHERE wallet_id = ? AND balance_cents - ? >= 0",
+                    (amount_cents, from_wallet_id, amount_cents),
+                ).rowcount
+                if updated:
+                    if not self._conn.execute(
+                        "UPDATE wallets SET balance_cents = balance_cents + ? WHERE wallet_id = ?",
+                        (amount_cents, to_wallet_id),
+                    ).rowcount:
+                        raise KeyError(f"Unknown wallet: {to_wallet_id}")
+                    if idempotency_key is not None:
+                        balance = self._conn.execute(
+                            "SELECT balance_cents FROM wallets WHERE wallet_id = ?", (from_wallet_id,)
+                        ).fetchone()[0]
+                        self._conn.execute(
+                            "INSERT INTO operations VALUES (?, ?, ?, ?, ?)",
+                            (idempotency_key, from_wallet_id, -amount_cents, balance, time.time()),
+                        )
+                else:
+                    self._require(from_wallet_id)
+                self._conn.execute("COMMIT")
+                return bool(updated)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+# Wallet class for customer and retailer balances, backed by a WalletStore
+class Wallet:
+    def __init__(self, store, wallet_id):
+        """Initializes the wallet handle for a stored wallet."""
+        self.store = store
+        self.wallet_id = wallet_id
+
+    def get_balance(self):
+        """Returns the current balance in dollars."""
+        return Decimal(self.store.balance_cents(self.wallet_id)) / 100
+
+    def get_balance_cents(self):
+        """Returns the current balance in cents."""
+        return self.store.balance_cents(self.wallet_id)
+
+    def deduct_amount(self, amount, idempotency_key=None):
+        """Deducts the specified amount from the wallet if sufficient funds are available."""
+        if amount < 0:
+            raise ValueError("Deductions cannot be negative")
+        with metrics.span("wallet.deduct"):
+            deducted = self.store.apply(self.wallet_id, -to_cents(amount), idempotency_key)
+        metrics.inc("wallet.deductions" if deducted else "wallet.declined")
+        return deducted
+
+    def add_balance(self, amount, idempotency_key=None):
+        """Adds the specified amount to the wallet."""
+        if amount < 0:
+            raise ValueError("Credits cannot be negative")
+        return self.store.apply(self.wallet_id, to_cents(amount), idempotency_key)